@@ -1,9 +1,16 @@
 import csv
 import re
+import time
 import pprint
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
-from ppr import ned, build_graph, analyse_graph
+import numpy as np
+
+from ppr import (ned, build_graph, analyse_graphs, run_ppr, compute_final_scores,
+    collect_disambiguations, graph_arrays, analyse_arrays, resolve_ties)
+from corpus import run_corpus
 import settings
 
 
@@ -59,7 +66,6 @@ def test_performance():
     
 
 def test_performance_parallel():
-    settings.PARALLEL = True
     grand_correct, grand_total = 0, 0
     aida_dict = create_aida_dict()
     with ThreadPoolExecutor(max_workers=4) as e:
@@ -67,24 +73,157 @@ def test_performance_parallel():
         for doc_name, d in aida_dict.items():
             doc_ents.append((doc_name, list(d.keys())))
         futures_dict = {e.submit(build_graph, ents) : doc_name for doc_name, ents in doc_ents}
+        graphs = {}
         for future in as_completed(futures_dict):
-            doc_name = futures_dict[future]
-            G, links_dict, backlinks_count_dict = future.result()
-
-            #perform the more computationally intense step not in parallel
-            disambiguations = analyse_graph(G, links_dict, backlinks_count_dict)
-            correct, total = count_correct(aida_dict[doc_name], disambiguations)
-            print('{0} has {1} total terms of which {2} are correct'.format(doc_name, total, correct))
-            percentage = 100 * correct / total
-            settings.logger.info('accuracy for {0}: {1}%'.format(doc_name, percentage))
-            grand_correct += correct
-            grand_total += total
-            print('another one')
+            graphs[futures_dict[future]] = future.result()
+
+    #perform the more computationally intense step not in parallel,
+    #analysing every document's graph in batches
+    doc_names = [doc_name for doc_name, _ in doc_ents]
+    results = analyse_graphs([graphs[doc_name] for doc_name in doc_names])
+    for doc_name, disambiguations in zip(doc_names, results):
+        correct, total = count_correct(aida_dict[doc_name], disambiguations)
+        print('{0} has {1} total terms of which {2} are correct'.format(doc_name, total, correct))
+        percentage = 100 * correct / total
+        settings.logger.info('accuracy for {0}: {1}%'.format(doc_name, percentage))
+        grand_correct += correct
+        grand_total += total
     
     final_percentage = 100 * grand_correct / grand_total
     print('overall accuracy: {0}%'.format(final_percentage))
 
 
+def test_performance_pipelined(io_workers=4, cpu_workers=None, batch_size=16):
+    '''
+    evaluate on AIDA with graphs built in a thread pool and analysed
+    in a process pool as they arrive. graphs are sent to the workers
+    as arrays in batches of batch_size, and the results are reported
+    in document order so runs are repeatable. the workers are spawned
+    rather than forked, since forking while the I/O threads are running
+    and the request cache's SQLite connection is open can copy held locks
+    into the children. analyse_arrays doesn't use settings, so the
+    workers need no setup
+
+    :param io_workers: the number of threads building graphs
+    :param cpu_workers: the number of analysis processes, defaulting
+    to one per CPU
+    :param batch_size: the number of graphs analysed in each task
+    '''
+    aida_dict = create_aida_dict()
+    doc_names = list(aida_dict)
+    tied = {}
+    with ThreadPoolExecutor(max_workers=io_workers) as io_pool, \
+            ProcessPoolExecutor(max_workers=cpu_workers,
+                mp_context=multiprocessing.get_context('spawn')) as cpu_pool:
+        futures_dict = {io_pool.submit(build_graph, list(aida_dict[doc_name].keys())): doc_name
+            for doc_name in doc_names}
+        analysis_futures = {}
+        batch_names, batch = [], []
+        for future in as_completed(futures_dict):
+            G, _, _ = future.result()
+            batch_names.append(futures_dict[future])
+            batch.append(graph_arrays(G))
+            if len(batch) == batch_size:
+                analysis_futures[cpu_pool.submit(analyse_arrays, batch,
+                    settings.PPR_ENGINE, settings.PPR_EPSILON)] = batch_names
+                batch_names, batch = [], []
+        if batch:
+            analysis_futures[cpu_pool.submit(analyse_arrays, batch,
+                settings.PPR_ENGINE, settings.PPR_EPSILON)] = batch_names
+        for future in as_completed(analysis_futures):
+            tied.update(zip(analysis_futures[future], future.result()))
+
+    grand_correct, grand_total = 0, 0
+    for doc_name in doc_names:
+        disambiguations = resolve_ties(tied[doc_name])
+        correct, total = count_correct(aida_dict[doc_name], disambiguations)
+        print('{0} has {1} total terms of which {2} are correct'.format(doc_name, total, correct))
+        if total:
+            settings.logger.info('accuracy for {0}: {1}%'.format(doc_name, 100 * correct / total))
+        grand_correct += correct
+        grand_total += total
+
+    final_percentage = 100 * grand_correct / grand_total
+    print('overall accuracy: {0}%'.format(final_percentage))
+
+
+def test_performance_corpus():
+    '''
+    evaluate on AIDA, resolving the candidates and links of the
+    whole corpus before building any document's graph
+    '''
+    grand_correct, grand_total = 0, 0
+    aida_dict = create_aida_dict()
+    documents = [(doc_name, list(d.keys())) for doc_name, d in aida_dict.items()]
+    for doc_name, disambiguations in run_corpus(documents):
+        correct, total = count_correct(aida_dict[doc_name], disambiguations)
+        print('{0} has {1} total terms of which {2} are correct'.format(doc_name, total, correct))
+        grand_correct += correct
+        grand_total += total
+
+    final_percentage = 100 * grand_correct / grand_total
+    print('overall accuracy: {0}%'.format(final_percentage))
+
+
+def compare_ppr_engines(epsilons=(1e-2, 1e-3, 1e-4), max_docs=None, push_min_nodes=0):
+    '''
+    report the accuracy and speed of the push PPR engine at each
+    epsilon against exact power iteration on the AIDA documents.
+    graphs are built once, so only the PPR step is timed
+
+    :param epsilons: the push tolerances to try
+    :param max_docs: optional limit on the number of documents
+    :param push_min_nodes: graphs with fewer nodes run power iteration
+    even with the push engine, as in run_ppr. this defaults to 0 so
+    that push runs on every graph, since almost every AIDA graph is
+    below PUSH_MIN_NODES
+    '''
+    aida_dict = create_aida_dict()
+    docs = list(aida_dict)[:max_docs]
+    engines = [('power', None)] + [('push', epsilon) for epsilon in epsilons]
+    seconds = {engine: 0 for engine in engines}
+    correct = {engine: 0 for engine in engines}
+    agreement = {engine: 0 for engine in engines}
+    max_error = {engine: 0 for engine in engines}
+    grand_total, mention_total = 0, 0
+    graphs, pushed_graphs = 0, 0
+    for doc in docs:
+        G, links_dict, backlinks_count_dict = build_graph(list(aida_dict[doc].keys()))
+        graphs += 1
+        if G.number_of_nodes() >= max(push_min_nodes, 1):
+            pushed_graphs += 1
+        exact, exact_disambiguations = None, None
+        for engine in engines:
+            start = time.perf_counter()
+            G, S = run_ppr(G, 0.85, *engine, push_min_nodes=push_min_nodes)
+            seconds[engine] += time.perf_counter() - start
+            compute_final_scores(G, S, links_dict, backlinks_count_dict)
+            disambiguations = collect_disambiguations(G)
+            if exact is None:
+                exact, exact_disambiguations = S, disambiguations
+            if S.size:
+                max_error[engine] = max(max_error[engine], np.abs(S - exact).max())
+            agreement[engine] += sum(
+                disambiguations[m] == exact_disambiguations[m] for m in disambiguations)
+            doc_correct, total = count_correct(aida_dict[doc], disambiguations)
+            correct[engine] += doc_correct
+        grand_total += total
+        mention_total += len(exact_disambiguations)
+
+    print('{0:<16}{1:>12}{2:>12}{3:>14}{4:>12}'.format(
+        'engine', 'seconds', 'accuracy', 'agreement', 'max error'))
+    for engine in engines:
+        name = engine[0] if engine[1] is None else 'push {0:g}'.format(engine[1])
+        print('{0:<16}{1:>12.3f}{2:>11.2f}%{3:>13.2f}%{4:>12.2e}'.format(
+            name,
+            seconds[engine],
+            100 * correct[engine] / max(grand_total, 1),
+            100 * agreement[engine] / max(mention_total, 1),
+            max_error[engine]
+        ))
+    print('push ran on {0} of {1} graphs, the rest ran power iteration'.format(pushed_graphs, graphs))
+
+
 def disambiguate(doc):
     '''
     deprecated as a function
@@ -97,9 +236,32 @@ def disambiguate(doc):
     return correct, total
 
 
+def setup_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--io-workers', type=int, default=4,
+        help='number of threads building graphs')
+    parser.add_argument('-w', '--cpu-workers', type=int,
+        help='number of processes analysing graphs, defaulting to one per CPU')
+    parser.add_argument('-b', '--batch-size', type=int, default=16,
+        help='number of graphs sent to an analysis process at once')
+    parser.add_argument('-c', '--compare-engines', action='store_true',
+        help='report the accuracy and speed of the PPR engines instead')
+    parser.add_argument('--corpus', action='store_true',
+        help='resolve candidates and links for the whole corpus before analysing documents')
+    parser.add_argument('-n', '--max-docs', type=int,
+        help='only use the first n documents when comparing engines')
+    return parser
+
+
 def main():
+    args = setup_parser().parse_args()
     settings.init('en', False)
-    test_performance_parallel()
+    if args.compare_engines:
+        compare_ppr_engines(max_docs=args.max_docs)
+    elif args.corpus:
+        test_performance_corpus()
+    else:
+        test_performance_pipelined(args.io_workers, args.cpu_workers, args.batch_size)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,266 @@
+'''
+replay the NED pipeline over a fixed set of documents and report
+where the time goes
+
+requests are answered without the network, so runs are repeatable.
+by default they are answered by the stand-in API in standin.py,
+which rebuilds the responses to the batched queries made now from
+the per-title responses in all.json, through a new, empty request
+cache so every run makes the same requests. documents with mentions
+all.json has nothing on are reported as skipped, and the run fails
+if every document is skipped. for each document the benchmark
+reports the wall time of each stage (candidates, links, edges,
+PPR and scoring), the peak memory traced while disambiguating it
+and the number of MediaWiki requests issued. the results are saved
+as JSON so they can be compared between commits.
+
+the stage timings and request counts are read from the metrics
+which ned(..., return_metrics=True) collects, and the rest of those
+metrics, such as cache hit rates and request latencies, are saved
+alongside, summed over every document.
+
+with --source cache, requests are instead replayed from the request
+cache, seeded with any requests in all.json which it is missing, and
+documents whose requests aren't all cached are skipped. with
+--source network, requests missing from the cache are fetched over
+the network and stored in it.
+
+run like:
+
+python benchmark.py results.json
+python benchmark.py results.json --source network
+python benchmark.py new.json --compare old.json
+python benchmark.py results.json -m metrics.prom
+'''
+import os.path as op
+import glob
+import sys
+import json
+import time
+import argparse
+import tempfile
+import platform
+import subprocess
+import tracemalloc
+from collections import Counter
+
+import requests
+
+import settings
+import ppr
+from aida import create_aida_dict
+from request_cache import open_cache, RequestCache
+from standin import StandInAPI, StandInSession
+from metrics import Metrics
+from cnlp_utils import get_entities
+
+
+#the stages timed in ned's stage_seconds metric
+STAGES = ['candidates', 'links', 'edges', 'ppr', 'scoring']
+DEMO_GLOB = 'demo/tokenized/*/*.json'
+AIDA_DOCS = 20
+SOURCES = ['standin', 'cache', 'network']
+
+
+class OfflineSession:
+    '''
+    a stand-in for a requests session which refuses to use the network
+    '''
+    def get(self, url=None, params=None, **kwargs):
+        raise requests.ConnectionError('the network is disabled while benchmarking: {0}'.format(url))
+
+
+def benchmark_inputs(aida_docs=AIDA_DOCS):
+    '''
+    return a list of (name, entities) pairs: the first aida_docs
+    AIDA documents followed by the demo CoreNLP files
+    '''
+    inputs = []
+    if aida_docs and op.isfile('aida_annotations.tsv'):
+        aida_dict = create_aida_dict()
+        for doc in list(aida_dict)[:aida_docs]:
+            inputs.append(('aida/{0}'.format(doc), list(aida_dict[doc].keys())))
+    for filepath in sorted(glob.glob(DEMO_GLOB)):
+        inputs.append((filepath, sorted(get_entities(filepath))))
+    return inputs
+
+
+def run_document(entities):
+    '''
+    disambiguate one document from a cold in-memory cache. returns
+    a dict of its timings and counts, read from the metrics ned
+    collected, and the metrics themselves
+    '''
+    settings.MEMORY_CACHE.clear()
+    start = time.perf_counter()
+    _, metrics = ppr.ned(entities, return_metrics=True)
+    return {
+        'mentions': len(entities),
+        'nodes': metrics.counter('nodes'),
+        'edges': metrics.counter('edges'),
+        'seconds': time.perf_counter() - start,
+        'stages': {stage: metrics.seconds('stage_seconds', stage=stage) for stage in STAGES},
+        'requests': metrics.counter('mw_requests'),
+        'network_requests': metrics.total('http_requests'),
+    }, metrics
+
+
+def peak_memory(entities):
+    '''
+    disambiguate one document again under tracemalloc, which is
+    too slow to leave on while timing, and return the peak bytes
+    '''
+    settings.MEMORY_CACHE.clear()
+    tracemalloc.start()
+    try:
+        ppr.ned(entities)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(inputs, source='standin', memory=True):
+    '''
+    run every input through ned. returns the results as a dict,
+    and a Metrics registry of the metrics of every completed document.
+    raises RuntimeError if every document is skipped
+
+    :param inputs: list of (name, entities) pairs
+    :param source: where requests missing from the cache are answered:
+    'standin' for the stand-in API built from all.json, 'cache' to
+    skip documents with requests missing from the cache, or 'network'
+    :param memory: whether to measure the peak memory of each document
+    '''
+    settings.REPLAYING = True
+    settings.OFFLINE = source == 'cache'
+    api = None
+    if source == 'standin':
+        api = StandInAPI.load()
+        network = StandInSession(api)
+    elif source == 'network':
+        network = settings.SESSION
+    else:
+        network = OfflineSession()
+    settings.SESSION = network
+    if source != 'network':
+        settings.PAGEVIEWS_SESSION = network
+
+    metrics = Metrics()
+    documents = []
+    for name, entities in inputs:
+        settings.logger.info('benchmarking {0}'.format(name))
+        unknown = [] if api is None else [e for e in entities if not api.covers([e])]
+        if unknown:
+            documents.append({'name': name, 'skipped': 'all.json has no responses for {0} of its {1} mentions'.format(
+                len(unknown), len(entities))})
+            continue
+        try:
+            result, document_metrics = run_document(entities)
+            if memory:
+                result['peak_memory'] = peak_memory(entities)
+        except (LookupError, requests.ConnectionError) as e:
+            documents.append({'name': name, 'skipped': str(e)})
+            continue
+        result['name'] = name
+        documents.append(result)
+        metrics.merge(document_metrics)
+
+    completed = [d for d in documents if 'skipped' not in d]
+    if not completed:
+        reasons = Counter(d['skipped'] for d in documents).most_common(1)
+        raise RuntimeError('every document was skipped{0}'.format(
+            ', most often because: {0}'.format(reasons[0][0]) if reasons else ''))
+    totals = {
+        'documents': len(completed),
+        'skipped': len(documents) - len(completed),
+        'seconds': sum(d['seconds'] for d in completed),
+        'stages': {stage: sum(d['stages'][stage] for d in completed) for stage in STAGES},
+        'requests': sum(d['requests'] for d in completed),
+        'network_requests': sum(d['network_requests'] for d in completed),
+    }
+    if memory:
+        totals['peak_memory'] = max([d['peak_memory'] for d in completed], default=0)
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'language': settings.LANG,
+        'documents': documents,
+        'totals': totals,
+    }, metrics
+
+
+def compare(results, baseline):
+    '''
+    print the totals of a run next to those of a baseline run
+    '''
+    new, old = results['totals'], baseline['totals']
+    rows = [('total', new['seconds'], old['seconds'])]
+    rows += [(stage, new['stages'][stage], old['stages'].get(stage, 0)) for stage in STAGES]
+    print('{0:<12}{1:>12}{2:>12}{3:>10}'.format('stage', 'baseline', 'current', 'change'))
+    for stage, current, previous in rows:
+        change = '{0:+.1f}%'.format(100 * (current - previous) / previous) if previous else '-'
+        print('{0:<12}{1:>12.3f}{2:>12.3f}{3:>10}'.format(stage, previous, current, change))
+    print('{0:<12}{1:>12}{2:>12}'.format('requests', old['requests'], new['requests']))
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('outfile', help='path to save the JSON results to')
+    parser.add_argument('-l', '--language', help='language', default='en')
+    parser.add_argument('-n', '--aida-docs', type=int, default=AIDA_DOCS,
+        help='number of AIDA documents to run')
+    parser.add_argument('-s', '--source', choices=SOURCES, default='standin',
+        help='where requests are answered: the stand-in API built from all.json, '
+        'only the request cache, or the network for requests missing from the cache')
+    parser.add_argument('--no-memory', action='store_true',
+        help="don't measure peak memory, which runs each document twice")
+    parser.add_argument('-c', '--compare', help='path to the results of a baseline run')
+    parser.add_argument('-m', '--metrics',
+        help='path to save metrics to, in Prometheus text format if it ends in .prom and JSON otherwise')
+    return parser
+
+
+def main():
+    parser = setup_parser()
+    args = parser.parse_args()
+    settings.init(args.language, replaying=True)
+    settings.CACHE.close()
+    with tempfile.TemporaryDirectory() as directory:
+        if args.source == 'standin':
+            settings.CACHE = RequestCache(op.join(directory, 'requests.sqlite'))
+        else:
+            settings.CACHE = open_cache(settings.CACHE.filepath, seed=True)
+        try:
+            results, metrics = run_benchmark(benchmark_inputs(args.aida_docs), args.source, not args.no_memory)
+        except RuntimeError as e:
+            sys.exit(str(e))
+        finally:
+            settings.CACHE.close()
+    with open(args.outfile, 'w') as fw:
+        json.dump(results, fw, indent=2)
+    if args.metrics:
+        with open(args.metrics, 'w') as fw:
+            if args.metrics.endswith('.prom'):
+                fw.write(metrics.to_prometheus())
+            else:
+                fw.write(metrics.to_json(indent=2))
+    totals = results['totals']
+    print('{0} documents in {1:.3f}s with {2} requests ({3} skipped)'.format(
+        totals['documents'], totals['seconds'], totals['requests'], totals['skipped']))
+    if totals['skipped'] and args.source == 'cache':
+        print('skipped documents have requests missing from the cache, run with --source network to fetch them')
+    if args.compare:
+        with open(args.compare) as fr:
+            compare(results, json.load(fr))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+'''
+an offline index from mentions to their candidate articles
+
+mentions are stored in a sorted title index, with a CSR array
+pointing into a second index of candidate titles, and a third
+index of case-folded mentions points back to the mentions, so the
+whole index can be memory-mapped. it is loaded the first time it
+is used.
+
+the index can be built from a TSV of mention/candidate pairs, from
+a link store plus a list of disambiguation page titles, or from
+the candidate queries already in the request cache.
+
+run like:
+
+python candidate_index.py outdir --pairs pairs.tsv
+python candidate_index.py outdir --link-store store_dir --disambiguations titles.txt
+python candidate_index.py outdir --from-cache
+'''
+import os
+import os.path as op
+import json
+import argparse
+
+import numpy as np
+
+from linkstore import TitleIndex, LinkStore
+
+
+DISAMBIGUATION_SUFFIX = ' (disambiguation)'
+
+
+def fold(mention):
+    return mention.casefold()
+
+
+class CandidateIndex:
+    '''
+    read-only access to a candidate index directory
+
+    :param directory: the directory written by build_candidate_index
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        self._loaded = False
+
+    def _load(self):
+        if not self._loaded:
+            self.mentions = TitleIndex.load(self.directory, 'mentions')
+            self.titles = TitleIndex.load(self.directory, 'candidates')
+            self.folded = TitleIndex.load(self.directory, 'folded')
+            self.indptr = np.load(op.join(self.directory, 'indptr.npy'), mmap_mode='r')
+            self.indices = np.load(op.join(self.directory, 'indices.npy'), mmap_mode='r')
+            self.folded_indptr = np.load(op.join(self.directory, 'folded_indptr.npy'), mmap_mode='r')
+            self.folded_indices = np.load(op.join(self.directory, 'folded_indices.npy'), mmap_mode='r')
+            self._loaded = True
+
+    def _candidates_at(self, mention_id):
+        ids = self.indices[self.indptr[mention_id]:self.indptr[mention_id + 1]]
+        return [self.titles[i] for i in ids]
+
+    def _folded_candidates_at(self, folded_id):
+        '''
+        the candidates of every mention with the same case-folded form
+        '''
+        candidates = {}
+        start, end = self.folded_indptr[folded_id], self.folded_indptr[folded_id + 1]
+        for mention_id in self.folded_indices[start:end]:
+            for candidate in self._candidates_at(mention_id):
+                candidates[candidate] = None
+        return list(candidates)
+
+    def candidates(self, mention):
+        '''
+        return the candidates of a mention, or None if the mention
+        isn't in the index. mentions with no exact match are looked
+        up ignoring case
+        '''
+        self._load()
+        mention_id = self.mentions.lookup(mention)
+        if mention_id is not None:
+            return self._candidates_at(mention_id)
+        folded_id = self.folded.lookup(fold(mention))
+        if folded_id is not None:
+            return self._folded_candidates_at(folded_id)
+        return None
+
+    def prefix(self, prefix, limit=10):
+        '''
+        return a dict of up to limit case-folded mentions starting
+        with a prefix, ignoring case, and their candidates
+        '''
+        self._load()
+        matches = {}
+        for folded_id in self.folded.prefix_range(fold(prefix))[:limit]:
+            matches[self.folded[folded_id]] = self._folded_candidates_at(folded_id)
+        return matches
+
+    def __contains__(self, mention):
+        return self.candidates(mention) is not None
+
+
+def build_candidate_index(pairs, outdir):
+    '''
+    build a candidate index from (mention, candidate) pairs. the
+    candidates of each mention keep the order of their first
+    appearance. returns the opened index
+
+    :param pairs: iterable of (mention, candidate) pairs. a pair
+    with a candidate of None records a mention with no candidates
+    :param outdir: the directory to write the index to
+    '''
+    if not op.isdir(outdir):
+        os.makedirs(outdir)
+    grouped = {}
+    for mention, candidate in pairs:
+        candidates = grouped.setdefault(mention, {})
+        if candidate is not None:
+            candidates[candidate] = None
+
+    mentions = sorted(grouped, key=lambda m: m.encode('utf-8'))
+    titles = {c for candidates in grouped.values() for c in candidates}
+    title_ids = {title: i for i, title in enumerate(sorted(titles))}
+    indptr = np.zeros(len(mentions) + 1, dtype=np.int64)
+    indices = []
+    folded = {}
+    for i, mention in enumerate(mentions):
+        indices += [title_ids[c] for c in grouped[mention]]
+        indptr[i + 1] = len(indices)
+        folded.setdefault(fold(mention), []).append(i)
+    folded_keys = sorted(folded, key=lambda m: m.encode('utf-8'))
+    folded_indptr = np.zeros(len(folded_keys) + 1, dtype=np.int64)
+    folded_indptr[1:] = np.cumsum([len(folded[k]) for k in folded_keys])
+    folded_indices = [i for k in folded_keys for i in folded[k]]
+
+    TitleIndex.build(mentions).save(outdir, 'mentions')
+    TitleIndex.build(titles).save(outdir, 'candidates')
+    TitleIndex.build(folded_keys).save(outdir, 'folded')
+    np.save(op.join(outdir, 'indptr.npy'), indptr)
+    np.save(op.join(outdir, 'indices.npy'), np.array(indices, dtype=np.int32))
+    np.save(op.join(outdir, 'folded_indptr.npy'), folded_indptr)
+    np.save(op.join(outdir, 'folded_indices.npy'), np.array(folded_indices, dtype=np.int32))
+    return CandidateIndex(outdir)
+
+
+def pairs_from_tsv(filepath):
+    '''
+    read (mention, candidate) pairs from a two-column TSV
+    '''
+    with open(filepath, encoding='utf-8') as fr:
+        for line in fr:
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) == 2:
+                yield parts[0].replace('_', ' '), parts[1].replace('_', ' ')
+
+
+def pairs_from_link_store(store, disambiguation_titles):
+    '''
+    generate pairs the way get_candidates does, from a link store
+    and the titles of disambiguation pages. a mention's candidates
+    from its disambiguation page come first, followed by its
+    redirect target or the page itself
+
+    :param store: a LinkStore
+    :param disambiguation_titles: iterable of disambiguation page titles
+    '''
+    from wiki import filter_disambiguation_links
+
+    disambiguation_titles = set(t.replace('_', ' ') for t in disambiguation_titles)
+    for title in disambiguation_titles:
+        mention = title
+        if mention.endswith(DISAMBIGUATION_SUFFIX):
+            mention = mention[:-len(DISAMBIGUATION_SUFFIX)]
+        for candidate in filter_disambiguation_links(mention, store.links(title)):
+            yield mention, candidate
+    for i in range(len(store.titles)):
+        if not store.is_page[i]:
+            continue
+        title = store.titles[i]
+        if store.redirects[i] >= 0:
+            yield title, store.titles[store.redirects[i]]
+        elif title not in disambiguation_titles:
+            yield title, title
+
+
+def pairs_from_cache(cache):
+    '''
+    generate pairs for every mention whose candidate query is in
+    the request cache, by replaying get_candidates against it.
+    mentions whose queries are only partly cached are skipped
+
+    :param cache: a RequestCache
+    '''
+    import settings
+    from wiki import get_candidates
+
+    state = settings.REPLAYING, settings.OFFLINE, settings.CANDIDATE_INDEX
+    settings.REPLAYING, settings.OFFLINE, settings.CANDIDATE_INDEX = True, True, None
+    try:
+        for key in cache.keys():
+            params = json.loads(key)
+            if params.get('prop') != 'categories|links|info' or 'plcontinue' in params:
+                continue
+            mention, _, sibling = params.get('titles', '').partition('|')
+            if sibling != mention + DISAMBIGUATION_SUFFIX:
+                continue
+            try:
+                candidates = get_candidates(mention)
+            except LookupError:
+                continue
+            yield mention, None
+            for candidate in candidates:
+                yield mention, candidate
+    finally:
+        settings.REPLAYING, settings.OFFLINE, settings.CANDIDATE_INDEX = state
+
+
+def read_titles(filepath):
+    with open(filepath, encoding='utf-8') as fr:
+        return [line.rstrip('\n') for line in fr if line.strip()]
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('outdir', help='directory to write the candidate index to')
+    parser.add_argument('-p', '--pairs', help='path to a TSV of mention/candidate pairs')
+    parser.add_argument('-s', '--link-store', help='path to a link store built by linkstore.py')
+    parser.add_argument('-d', '--disambiguations',
+        help='path to a file of disambiguation page titles, one per line')
+    parser.add_argument('-c', '--from-cache', action='store_true',
+        help='build from the candidate queries in the request cache')
+    parser.add_argument('-l', '--language', help='language', default='en')
+    return parser
+
+
+def main():
+    parser = setup_parser()
+    args = parser.parse_args()
+    if args.pairs:
+        pairs = pairs_from_tsv(args.pairs)
+    elif args.link_store:
+        disambiguation_titles = read_titles(args.disambiguations) if args.disambiguations else []
+        pairs = pairs_from_link_store(LinkStore(args.link_store), disambiguation_titles)
+    elif args.from_cache:
+        import settings
+        settings.init(args.language, replaying=True)
+        pairs = pairs_from_cache(settings.CACHE)
+    else:
+        parser.error('one of --pairs, --link-store or --from-cache is required')
+    index = build_candidate_index(pairs, args.outdir)
+    index._load()
+    print('built candidate index of {0} mentions in {1}'.format(len(index.mentions), args.outdir))
+
+
+if __name__ == '__main__':
+    main()
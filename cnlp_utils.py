@@ -2,6 +2,22 @@ import json
 
 
 ##NOTE : MODIFY THIS TO ONLY HAVE LOCATION, PERSON, ORGANIZATION (look in the json files for details)
+NER_TYPES = ['PERSON', 'NATIONALITY', 'ORGANIZATION', 'LOCATION']
+
+
+def extract_entities(data):
+    '''
+    reads the named entities from the output of CoreNLP
+
+    :param data: the decoded CoreNLP json
+    '''
+    entities = set()
+    for sentence in data['sentences']:
+        for mention in sentence['entitymentions']:
+            if mention['ner'] in NER_TYPES:
+                entities.add(mention['text'])
+
+    return entities
 
 
 def get_entities(filename):
@@ -12,12 +28,21 @@ def get_entities(filename):
     :param filename: the name of the json file
     to open
     '''
-    entities = set()
     with open(filename) as fr:
-        sentences = json.load(fr)['sentences']
-        for sentence in sentences:
-            for mention in sentence['entitymentions']:
-                if mention['ner'] in ['PERSON', 'NATIONALITY', 'ORGANIZATION', 'LOCATION']:
-                    entities.add(mention['text'])
-    
-    return entities
+        return extract_entities(json.load(fr))
+
+
+def parse_mentions(data):
+    '''
+    read the mentions of a document, given as CoreNLP json, a dict
+    with a list of mentions, or a list of mentions
+
+    :param data: the decoded json of the document
+    '''
+    if isinstance(data, dict) and 'sentences' in data:
+        return sorted(extract_entities(data))
+    if isinstance(data, dict):
+        data = data.get('mentions')
+    if not isinstance(data, list) or not all(isinstance(m, str) for m in data):
+        raise ValueError('expected CoreNLP JSON or a list of mentions')
+    return list(dict.fromkeys(data))
@@ -0,0 +1,132 @@
+'''
+a two-phase runner for disambiguating a whole corpus
+
+the same mentions and candidates recur across the documents of a
+corpus, so rather than resolving them document by document, the
+first phase collects the unique mentions of every document and
+resolves their candidates, and the links of every unique candidate,
+into a shared store. links to pages which aren't a candidate anywhere
+in the corpus can never become edges, so only links between
+candidates are kept, as arrays of interned title ids.
+the second phase builds and analyses each document's graph from
+the store, without making any more requests for candidates or links.
+
+run like:
+
+python corpus.py docs.jsonl results.jsonl
+python corpus.py demo/tokenized/en results.jsonl -r
+'''
+import sys
+import json
+import argparse
+
+import numpy as np
+
+from ppr import fetch_candidates_dict, fetch_links_dict, build_graph, analyse_graphs, read_documents
+from wiki import chunks
+from titles import title_table, KnownTitles
+import settings
+
+
+#the number of titles whose links are fetched and filtered at once
+LINKS_CHUNK_SIZE = 500
+#the number of documents whose graphs are analysed together
+ANALYSIS_BATCH_SIZE = 64
+
+
+class CorpusStore:
+    '''
+    the candidates of every mention in a corpus and the links
+    between those candidates
+
+    :param candidates: dict of mention:candidates pairs, where
+    candidates is None for mentions with no candidates
+    :param links: dict of title:array pairs of the sorted ids in
+    table of the candidates each candidate links to
+    :param table: the TitleTable of the corpus
+    '''
+    def __init__(self, candidates, links, table):
+        self.candidates = candidates
+        self.links = links
+        self.table = table
+
+    @staticmethod
+    def build(documents, chunk_size=LINKS_CHUNK_SIZE):
+        '''
+        resolve the candidates and links of a corpus
+
+        :param documents: iterable of lists of mentions
+        :param chunk_size: the number of titles whose links are
+        fetched at once. links are mapped to ids through a view of
+        the table which knows only the candidates, and aren't kept in
+        the memory cache, so at most chunk_size pages of unfiltered
+        links are held at once
+        '''
+        mentions = list(dict.fromkeys(m for document in documents for m in document))
+        settings.logger.info('resolving candidates of {0} unique mentions'.format(len(mentions)))
+        candidates = {}
+        for mention, titles in fetch_candidates_dict(mentions).items():
+            candidates[mention] = None if titles is None else [sys.intern(t) for t in titles]
+        titles = list(dict.fromkeys(t for ts in candidates.values() if ts for t in ts))
+        table = title_table(settings.LINK_STORE)
+        title_ids = table.link_ids(titles)
+        candidate_table = KnownTitles(table)
+
+        settings.logger.info('fetching links of {0} unique candidates'.format(len(titles)))
+        links = {}
+        for chunk in chunks(titles, chunk_size):
+            for title, page_links in fetch_links_dict(chunk, candidate_table, titles, memoize=False).items():
+                links[title] = np.intersect1d(page_links, title_ids, assume_unique=True)
+        settings.METRICS.increment('corpus_mentions', len(mentions))
+        settings.METRICS.increment('corpus_titles', len(titles))
+        return CorpusStore(candidates, links, table)
+
+    def build_graph(self, mentions):
+        return build_graph(mentions, self.candidates, self.links, self.table)
+
+
+def run_corpus(documents, batch_size=ANALYSIS_BATCH_SIZE):
+    '''
+    disambiguate a corpus in two phases, yielding (id, disambiguations)
+    pairs in the order of the documents
+
+    :param documents: list of (id, mentions) pairs
+    :param batch_size: the number of documents analysed together
+    '''
+    store = CorpusStore.build(mentions for _, mentions in documents)
+    settings.logger.info('analysing {0} documents'.format(len(documents)))
+    for start in range(0, len(documents), batch_size):
+        batch = documents[start:start + batch_size]
+        graphs = [store.build_graph(mentions) for _, mentions in batch]
+        for (doc_id, _), disambiguations in zip(batch, analyse_graphs(graphs)):
+            yield doc_id, disambiguations
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('infile',
+        help='a JSONL file of documents, "-" for stdin or a directory of CoreNLP files')
+    parser.add_argument('outfile', help='the JSONL file to write results to')
+    parser.add_argument('-b', '--batch-size', type=int, default=ANALYSIS_BATCH_SIZE,
+        help='number of documents analysed together')
+    parser.add_argument('-l', '--language', help='language', default='en')
+    parser.add_argument('-r', '--replay', help='replay requests', action='store_true')
+    parser.add_argument('-s', '--links-source', default='api',
+        help='where to read page links from: "api" or the path of a link store built by linkstore.py')
+    parser.add_argument('-c', '--candidate-index',
+        help='path to a candidate index built by candidate_index.py')
+    return parser
+
+
+def main():
+    args = setup_parser().parse_args()
+    settings.init(args.language, args.replay, links_source=args.links_source,
+        candidate_index=args.candidate_index)
+    documents = list(read_documents(args.infile))
+    with open(args.outfile, 'w') as fw:
+        for doc_id, disambiguations in run_corpus(documents, args.batch_size):
+            fw.write(json.dumps({'id': doc_id, 'disambiguations': disambiguations}) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+'''
+an asyncio engine for fetching candidates and links concurrently
+
+blocking API calls are run in a thread pool, with a semaphore
+bounding how many are in flight at once. every call still goes
+through make_mw_request, so responses are written to the
+request cache as usual
+'''
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from wiki import get_candidates_batch, generate_links_dict, probe_links, chunks, MAX_TITLES
+import settings
+
+#the number of mentions or pages in each concurrent batch, which are
+#sent together in the same requests
+BATCH_SIZE = MAX_TITLES
+
+
+async def gather_bounded(f, args, concurrency):
+    '''
+    call f on every argument concurrently, with at most
+    concurrency calls running at once. returns a list of
+    results in the same order as the arguments
+
+    :param f: a blocking function of one argument
+    :param args: list of arguments
+    :param concurrency: the maximum number of calls in flight
+    '''
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        async def run(arg):
+            async with semaphore:
+                return await loop.run_in_executor(executor, f, arg)
+        return await asyncio.gather(*(run(arg) for arg in args))
+
+
+async def fetch_candidates(entities, concurrency, batch_size=BATCH_SIZE):
+    '''
+    resolve the candidates of all entities, running batches of
+    batch_size entities through get_candidates_batch concurrently.
+    returns a dict of entity:candidates pairs
+    '''
+    entities = list(dict.fromkeys(entities))
+    batches = list(chunks(entities, batch_size))
+    candidates_dict = {}
+    for batch_candidates in await gather_bounded(get_candidates_batch, batches, concurrency):
+        candidates_dict.update(batch_candidates)
+    return {entity: candidates_dict[entity] for entity in entities}
+
+
+async def fetch_links(titles, table, concurrency, batch_size=BATCH_SIZE, memoize=True):
+    '''
+    fetch the links of all titles, running batches of
+    batch_size titles concurrently. returns a links dict
+    in the same form as generate_links_dict
+    '''
+    titles = list(dict.fromkeys(titles))
+    batches = list(chunks(titles, batch_size))
+    links_dict = {}
+    fetch = partial(generate_links_dict, table=table, memoize=memoize)
+    for batch_links in await gather_bounded(fetch, batches, concurrency):
+        links_dict.update(batch_links)
+    return links_dict
+
+
+async def fetch_probes(titles, targets, table, concurrency, memoize=True):
+    '''
+    ask batches of MAX_TITLES pages concurrently which of the
+    targets they link to. returns a links dict in the same form
+    as probe_links
+    '''
+    titles = list(dict.fromkeys(titles))
+    batches = list(chunks(titles, BATCH_SIZE))
+    links_dict = {}
+    probe = partial(probe_links, targets=targets, table=table, memoize=memoize)
+    for batch_links in await gather_bounded(probe, batches, concurrency):
+        links_dict.update(batch_links)
+    return links_dict
+
+
+def get_candidates_concurrent(entities, concurrency=None):
+    '''
+    synchronous wrapper around fetch_candidates
+
+    :param entities: iterable of mentions
+    :param concurrency: the maximum number of requests in flight,
+    defaulting to settings.CONCURRENCY
+    '''
+    if concurrency is None:
+        concurrency = settings.CONCURRENCY
+    return asyncio.run(fetch_candidates(entities, concurrency))
+
+
+def generate_links_dict_concurrent(titles, table, concurrency=None, memoize=True):
+    '''
+    synchronous wrapper around fetch_links
+
+    :param titles: iterable of article titles
+    :param table: the TitleTable to intern links in
+    :param concurrency: the maximum number of requests in flight,
+    defaulting to settings.CONCURRENCY
+    :param memoize: whether to keep the links in memory, as in
+    generate_links_dict
+    '''
+    if settings.LINK_STORE is not None:
+        return generate_links_dict(titles, table)
+    if concurrency is None:
+        concurrency = settings.CONCURRENCY
+    return asyncio.run(fetch_links(titles, table, concurrency, memoize=memoize))
+
+
+def probe_links_concurrent(titles, targets, table, concurrency=None, memoize=True):
+    '''
+    synchronous wrapper around fetch_probes
+
+    :param titles: iterable of article titles
+    :param targets: the titles of the links to look for
+    :param table: the TitleTable to intern links in
+    :param concurrency: the maximum number of requests in flight,
+    defaulting to settings.CONCURRENCY
+    :param memoize: whether to keep the responses in memory
+    '''
+    if settings.LINK_STORE is not None:
+        return probe_links(titles, targets, table)
+    if concurrency is None:
+        concurrency = settings.CONCURRENCY
+    return asyncio.run(fetch_probes(titles, targets, table, concurrency, memoize))
@@ -0,0 +1,293 @@
+'''
+an offline store of Wikipedia's link graph, built from dumps
+
+the store is a directory holding a sorted title index and a CSR
+adjacency of page links, saved as NumPy arrays so they can be
+memory-mapped rather than read into memory.
+
+the builder reads tab-separated exports of the page, pagelinks
+and redirect tables, with one row per line and underscores or
+spaces in titles:
+
+page.tsv:       page_id    namespace    title    is_redirect
+pagelinks.tsv:  from_id    namespace    title
+redirect.tsv:   from_id    namespace    title
+
+only rows in the article namespace (0) are used.
+
+run like:
+
+python linkstore.py page.tsv pagelinks.tsv outdir -r redirect.tsv
+'''
+import os
+import os.path as op
+import csv
+import sys
+import argparse
+from array import array
+from bisect import bisect_left
+
+import numpy as np
+
+
+csv.field_size_limit(sys.maxsize)
+
+
+def clean_title(title):
+    return title.replace('_', ' ')
+
+
+def read_rows(filepath):
+    '''
+    yield the rows of a dump TSV which are in the article namespace
+    '''
+    with open(filepath, newline='', encoding='utf-8') as fr:
+        for row in csv.reader(fr, delimiter='\t', quoting=csv.QUOTE_NONE):
+            if len(row) >= 3 and row[1] == '0':
+                yield row
+
+
+class _TitleKeys:
+    '''
+    a sequence view of the encoded titles of an index, for bisect
+    '''
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        return self.index.key(i)
+
+
+class TitleIndex:
+    '''
+    a sorted list of titles stored as one UTF-8 blob plus an
+    array of offsets, so it can be memory-mapped and searched
+    without decoding every title
+
+    :param blob: uint8 array of the concatenated encoded titles
+    :param offsets: int64 array of the start of each title in the
+    blob, with a final entry for the end of the blob
+    '''
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def key(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def __getitem__(self, i):
+        return self.key(i).decode('utf-8')
+
+    def _keys(self):
+        return _TitleKeys(self)
+
+    def lookup(self, title):
+        '''
+        return the id of a title, or None if it isn't in the index
+        '''
+        key = title.encode('utf-8')
+        i = bisect_left(self._keys(), key)
+        if i < len(self) and self.key(i) == key:
+            return i
+        return None
+
+    def prefix_range(self, prefix):
+        '''
+        return the range of ids of titles starting with a prefix
+        '''
+        key = prefix.encode('utf-8')
+        keys = self._keys()
+        #0xff never appears in UTF-8, so it sorts after every continuation
+        return range(bisect_left(keys, key), bisect_left(keys, key + b'\xff'))
+
+    @staticmethod
+    def build(titles):
+        '''
+        build an index from an iterable of unique titles. UTF-8
+        byte order matches code point order, so the index is
+        sorted the same way as Python strings
+        '''
+        encoded = sorted(t.encode('utf-8') for t in titles)
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in encoded])
+        blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return TitleIndex(blob, offsets)
+
+    def save(self, directory, name='titles'):
+        np.save(op.join(directory, '{0}_blob.npy'.format(name)), self.blob)
+        np.save(op.join(directory, '{0}_offsets.npy'.format(name)), self.offsets)
+
+    @staticmethod
+    def load(directory, name='titles', mmap_mode='r'):
+        blob = np.load(op.join(directory, '{0}_blob.npy'.format(name)), mmap_mode=mmap_mode)
+        offsets = np.load(op.join(directory, '{0}_offsets.npy'.format(name)), mmap_mode=mmap_mode)
+        return TitleIndex(blob, offsets)
+
+
+class LinkStore:
+    '''
+    read-only access to a link store directory. the arrays are
+    memory-mapped, so opening a store is cheap and only the
+    pages that are looked up are read from disk
+
+    :param directory: the directory written by build_link_store
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        self.titles = TitleIndex.load(directory)
+        self.indptr = np.load(op.join(directory, 'indptr.npy'), mmap_mode='r')
+        self.indices = np.load(op.join(directory, 'indices.npy'), mmap_mode='r')
+        self.redirects = np.load(op.join(directory, 'redirects.npy'), mmap_mode='r')
+        self.is_page = np.load(op.join(directory, 'pages.npy'), mmap_mode='r')
+        self.indegree = np.load(op.join(directory, 'indegree.npy'), mmap_mode='r')
+
+    def title_id(self, title):
+        return self.titles.lookup(title)
+
+    def link_ids(self, title_id):
+        '''
+        return the sorted ids of the pages linked from a page
+        '''
+        return self.indices[self.indptr[title_id]:self.indptr[title_id + 1]]
+
+    def links(self, title):
+        '''
+        return the titles of the links on a page, or an empty
+        list if the page isn't in the store
+        '''
+        title_id = self.title_id(title)
+        if title_id is None:
+            return []
+        return [self.titles[i] for i in self.link_ids(title_id)]
+
+    def has_link(self, page_title, target_title):
+        '''
+        determine if a page links to a target page
+        '''
+        page_id = self.title_id(page_title)
+        target_id = self.title_id(target_title)
+        if page_id is None or target_id is None:
+            return False
+        link_ids = self.link_ids(page_id)
+        i = np.searchsorted(link_ids, target_id)
+        return bool(i < len(link_ids) and link_ids[i] == target_id)
+
+    def backlink_count(self, title):
+        '''
+        return the number of pages in the store linking to a title
+        '''
+        title_id = self.title_id(title)
+        if title_id is None:
+            return 0
+        return int(self.indegree[title_id])
+
+    def has_page(self, title):
+        '''
+        determine if a title is a page, rather than a missing
+        page that is only the target of links
+        '''
+        title_id = self.title_id(title)
+        return title_id is not None and bool(self.is_page[title_id])
+
+    def get_redirect(self, title):
+        '''
+        return the title a page redirects to, or None
+        '''
+        title_id = self.title_id(title)
+        if title_id is None or self.redirects[title_id] < 0:
+            return None
+        return self.titles[self.redirects[title_id]]
+
+
+def build_link_store(page_file, pagelinks_file, outdir, redirect_file=None):
+    '''
+    build a link store from TSV exports of the page, pagelinks
+    and (optionally) redirect tables. returns the opened store
+
+    :param page_file: path to the page TSV
+    :param pagelinks_file: path to the pagelinks TSV
+    :param outdir: the directory to write the store to
+    :param redirect_file: optional path to the redirect TSV
+    '''
+    if not op.isdir(outdir):
+        os.makedirs(outdir)
+
+    page_titles = {}
+    for row in read_rows(page_file):
+        page_titles[row[0]] = clean_title(row[2])
+
+    #first pass: every title that is a page or a link target
+    titles = set(page_titles.values())
+    for row in read_rows(pagelinks_file):
+        titles.add(clean_title(row[2]))
+    redirect_rows = []
+    if redirect_file is not None:
+        for row in read_rows(redirect_file):
+            if row[0] in page_titles:
+                target = clean_title(row[2])
+                titles.add(target)
+                redirect_rows.append((page_titles[row[0]], target))
+    index = TitleIndex.build(titles)
+    ids = {title: i for i, title in enumerate(sorted(titles))}
+
+    #second pass: the links as pairs of ids
+    sources = array('q')
+    targets = array('q')
+    for row in read_rows(pagelinks_file):
+        source = page_titles.get(row[0])
+        if source is not None:
+            sources.append(ids[source])
+            targets.append(ids[clean_title(row[2])])
+    sources = np.frombuffer(sources, dtype=np.int64)
+    targets = np.frombuffer(targets, dtype=np.int64)
+
+    n = len(index)
+    order = np.lexsort((targets, sources))
+    sources, targets = sources[order], targets[order]
+    if len(sources):
+        #drop duplicate links
+        keep = np.r_[True, (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])]
+        sources, targets = sources[keep], targets[keep]
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(sources, minlength=n))
+    redirects = np.full(n, -1, dtype=np.int32)
+    for source, target in redirect_rows:
+        redirects[ids[source]] = ids[target]
+    #titles which are pages rather than only the target of a link
+    is_page = np.zeros(n, dtype=bool)
+    is_page[[ids[title] for title in page_titles.values()]] = True
+
+    index.save(outdir)
+    np.save(op.join(outdir, 'indptr.npy'), indptr)
+    np.save(op.join(outdir, 'indices.npy'), targets.astype(np.int32))
+    np.save(op.join(outdir, 'redirects.npy'), redirects)
+    np.save(op.join(outdir, 'pages.npy'), is_page)
+    np.save(op.join(outdir, 'indegree.npy'), np.bincount(targets, minlength=n).astype(np.int32))
+    return LinkStore(outdir)
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('page_file', help='path to the page TSV')
+    parser.add_argument('pagelinks_file', help='path to the pagelinks TSV')
+    parser.add_argument('outdir', help='directory to write the link store to')
+    parser.add_argument('-r', '--redirects', help='path to the redirect TSV')
+    return parser
+
+
+def main():
+    parser = setup_parser()
+    args = parser.parse_args()
+    store = build_link_store(args.page_file, args.pagelinks_file, args.outdir, args.redirects)
+    print('built link store of {0} titles and {1} links in {2}'.format(
+        len(store.titles), len(store.indices), args.outdir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+'''
+counters and timers for instrumenting the NED pipeline
+
+settings.METRICS holds the active registry. it is a NullMetrics
+by default, whose methods do nothing, so instrumented code costs
+one method call when metrics are off. ned(..., return_metrics=True)
+collects the metrics of a single call, and a Metrics registry can
+be exported as JSON or in the Prometheus text format
+'''
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager, nullcontext
+
+
+#upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+#pairs of counters from which hit rates are derived
+HIT_RATES = {
+    'memory_cache': ('memory_cache_hits', 'memory_cache_misses'),
+    'disk_cache': ('disk_cache_hits', 'disk_cache_misses'),
+    'pageviews_cache': ('pageviews_cache_hits', 'pageviews_cache_misses'),
+}
+
+
+def metric_key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Histogram:
+    '''
+    a count of observations in cumulative buckets, with their sum
+    '''
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def cumulative(self):
+        total, cumulative = 0, []
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+
+class Metrics:
+    '''
+    a thread-safe registry of counters and histograms. each metric
+    has a name and optional labels, such as the stage a timer is for
+    '''
+    enabled = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name, value=1, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        '''
+        observe the seconds spent in a block in the histogram name
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter(self, name, **labels):
+        return self.counters.get(metric_key(name, labels), 0)
+
+    def total(self, name):
+        '''
+        the sum of a counter over all its labels
+        '''
+        return sum(value for (key, _), value in self.counters.items() if key == name)
+
+    def seconds(self, name, **labels):
+        histogram = self.histograms.get(metric_key(name, labels))
+        return histogram.sum if histogram is not None else 0.0
+
+    def merge(self, other):
+        '''
+        add the metrics of another registry to this one
+        '''
+        with self.lock:
+            for key, value in other.counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, histogram in other.histograms.items():
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(histogram.buckets)
+                self.histograms[key].merge(histogram)
+
+    def hit_rates(self):
+        rates = {}
+        for name, (hits, misses) in HIT_RATES.items():
+            total = self.counter(hits) + self.counter(misses)
+            if total:
+                rates[name] = self.counter(hits) / total
+        return rates
+
+    def to_dict(self):
+        '''
+        return the metrics as a dict of plain values. labelled
+        metrics are keyed by name and then by their label values
+        '''
+        def insert(out, key, value):
+            name, labels = key
+            if labels:
+                out = out.setdefault(name, {})
+                name = ','.join('{0}={1}'.format(k, v) for k, v in labels)
+            out[name] = value
+
+        counters, histograms = {}, {}
+        with self.lock:
+            for key in sorted(self.counters):
+                insert(counters, key, self.counters[key])
+            for key in sorted(self.histograms):
+                histogram = self.histograms[key]
+                insert(histograms, key, {
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'buckets': dict(zip(histogram.buckets, histogram.cumulative())),
+                })
+        return {'counters': counters, 'histograms': histograms, 'hit_rates': self.hit_rates()}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def to_prometheus(self, prefix='ned'):
+        '''
+        return the metrics in the Prometheus text exposition format
+        '''
+        def labels_text(labels, extra=()):
+            labels = list(labels) + list(extra)
+            if not labels:
+                return ''
+            return '{' + ','.join('{0}="{1}"'.format(k, v) for k, v in labels) + '}'
+
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                full_name = '{0}_{1}_total'.format(prefix, name)
+                if full_name not in typed:
+                    lines.append('# TYPE {0} counter'.format(full_name))
+                    typed.add(full_name)
+                lines.append('{0}{1} {2}'.format(full_name, labels_text(labels), value))
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                full_name = '{0}_{1}'.format(prefix, name)
+                if full_name not in typed:
+                    lines.append('# TYPE {0} histogram'.format(full_name))
+                    typed.add(full_name)
+                for bound, count in zip(histogram.buckets, histogram.cumulative()):
+                    lines.append('{0}_bucket{1} {2}'.format(
+                        full_name, labels_text(labels, [('le', bound)]), count))
+                lines.append('{0}_bucket{1} {2}'.format(
+                    full_name, labels_text(labels, [('le', '+Inf')]), histogram.count))
+                lines.append('{0}_sum{1} {2}'.format(full_name, labels_text(labels), histogram.sum))
+                lines.append('{0}_count{1} {2}'.format(full_name, labels_text(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+class NullMetrics:
+    '''
+    a registry which records nothing, used when metrics are off
+    '''
+    enabled = False
+    _timer = nullcontext()
+
+    def increment(self, name, value=1, **labels):
+        pass
+
+    def observe(self, name, value, **labels):
+        pass
+
+    def timer(self, name, **labels):
+        return self._timer
+
+
+@contextmanager
+def collecting():
+    '''
+    install a fresh Metrics registry as settings.METRICS for the
+    duration of a block, then merge what it collected into the
+    previous registry. yields the fresh registry. the registry is
+    global, so blocks running at once in different threads mix
+    their metrics together
+    '''
+    import settings
+
+    previous = settings.METRICS
+    metrics = Metrics()
+    settings.METRICS = metrics
+    try:
+        yield metrics
+    finally:
+        settings.METRICS = previous
+        if previous.enabled:
+            previous.merge(metrics)
@@ -0,0 +1,228 @@
+'''
+sparse personalized PageRank engines
+
+the score matrix S returned by each engine has one column per
+personalization node, so S[i, j] is the score of node i when
+the random walk restarts at node j
+'''
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+
+#the number of components above which they are solved in parallel
+PARALLEL_COMPONENTS = 16
+#the most score cells (rows times columns) in one block_ppr solve.
+#small batches stay in cache and stop early more often
+BLOCK_BATCH_CELLS = 2 ** 15
+#graphs with fewer nodes are solved by power iteration even with the
+#push engine, which only beats it on larger graphs
+PUSH_MIN_NODES = 256
+
+
+def transition_matrix(A):
+    '''
+    normalise an adjacency matrix so each column sums to 1.
+    columns of nodes without edges are left as zeros
+
+    :param A: a square scipy sparse adjacency matrix
+    '''
+    A = sp.csr_matrix(A, dtype=float)
+    col_sums = np.asarray(A.sum(axis=0)).ravel()
+    inv = np.zeros_like(col_sums)
+    nonzero = col_sums != 0
+    inv[nonzero] = 1 / col_sums[nonzero]
+    return sp.csr_matrix(A @ sp.diags(inv))
+
+
+def power_ppr(M, d=0.85, tol=1e-6, max_iterations=100, sources=None):
+    '''
+    run personalized PageRank by power iteration for every
+    personalization vector at once, as a single sparse-times-dense
+    product per iteration. iteration stops once no score changes
+    by more than tol. returns the score matrix and the number
+    of iterations run
+
+    :param M: a column-stochastic scipy sparse matrix
+    :param d: the damping factor
+    :param tol: the convergence tolerance
+    :param max_iterations: the maximum number of iterations
+    :param sources: optional array of the nodes to personalize on,
+    defaulting to every node
+    '''
+    n = M.shape[0]
+    if sources is None:
+        sources = np.arange(n)
+    sources = np.asarray(sources)
+    columns = np.arange(len(sources))
+    V = np.full((n, len(sources)), 1 / n) if n else np.zeros((0, len(sources)))
+    iterations = 0
+    for iterations in range(1, max_iterations + 1):
+        V_next = d * (M @ V)
+        V_next[sources, columns] += 1 - d
+        delta = np.abs(V_next - V).max() if V.size else 0
+        V = V_next
+        if delta < tol:
+            break
+    return V, iterations
+
+
+def component_ppr(A, d=0.85, tol=1e-6, max_iterations=100, workers=None):
+    '''
+    run personalized PageRank separately on each connected component
+    of a graph and assemble the scores. a walk never leaves its
+    component, so scores between components are zero, and an
+    isolated node keeps 1 - d of its own restart mass. returns the
+    score matrix and the most iterations run on any component
+
+    :param A: a square symmetric scipy sparse adjacency matrix
+    :param d: the damping factor
+    :param tol: the convergence tolerance
+    :param max_iterations: the maximum number of iterations
+    :param workers: the number of threads to solve components with,
+    defaulting to one per CPU once there are more than
+    PARALLEL_COMPONENTS components to solve
+    '''
+    A = sp.csr_matrix(A)
+    n = A.shape[0]
+    S = np.zeros((n, n))
+    if n == 0:
+        return S, 0
+    _, labels = connected_components(A, directed=False)
+    order = np.argsort(labels, kind='stable')
+    starts = np.flatnonzero(np.r_[True, labels[order][1:] != labels[order][:-1]])
+    components = np.split(order, starts[1:])
+
+    isolated = np.array([c[0] for c in components if len(c) == 1], dtype=np.int64)
+    S[isolated, isolated] = 1 - d
+    components = [c for c in components if len(c) > 1]
+
+    def solve(nodes):
+        M = transition_matrix(A[nodes][:, nodes])
+        return nodes, power_ppr(M, d, tol, max_iterations)
+
+    if workers is None:
+        workers = os.cpu_count() if len(components) > PARALLEL_COMPONENTS else 1
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(solve, components))
+    else:
+        results = [solve(nodes) for nodes in components]
+
+    iterations = 0
+    for nodes, (S_component, component_iterations) in results:
+        S[np.ix_(nodes, nodes)] = S_component
+        iterations = max(iterations, component_iterations)
+    return S, iterations
+
+
+def push_ppr(A, d=0.85, epsilon=1e-4, sources=None):
+    '''
+    approximate personalized PageRank by forward push
+    (Andersen, Chung and Lang). each source starts with all its
+    restart mass as residual, and a node keeps 1 - d of its residual
+    and pushes the rest to its neighbours until every residual is
+    below epsilon times the node's degree. the work done for each
+    source depends on epsilon rather than on the size of the graph,
+    and every score is an underestimate of the exact score by at
+    most epsilon times the node's degree. returns the score matrix
+    and the total number of pushes
+
+    every residual above its threshold, across all sources, is pushed
+    at once in each round, as one product of the transition matrix
+    with a sparse matrix of the pushed residuals, so the rounds stay
+    in NumPy and SciPy and only touch the nodes being pushed
+
+    :param A: a square symmetric scipy sparse adjacency matrix
+    :param d: the damping factor
+    :param epsilon: the residual tolerance per unit of degree
+    :param sources: optional array of the nodes to personalize on,
+    defaulting to every node
+    '''
+    A = sp.csr_matrix(A, dtype=float)
+    n = A.shape[0]
+    if sources is None:
+        sources = np.arange(n)
+    sources = np.asarray(sources, dtype=np.int64)
+    width = len(sources)
+    M = transition_matrix(A)
+    degrees = np.asarray(A.sum(axis=1)).ravel()
+    thresholds = epsilon * np.maximum(degrees, 1)
+    S = np.zeros((n, width))
+    R = np.zeros((n, width))
+    #every source is pushed once, whatever its threshold
+    rows, columns = sources, np.arange(width)
+    R[rows, columns] = 1.0
+    pushes = 0
+    while len(rows):
+        residuals = R[rows, columns]
+        R[rows, columns] = 0
+        S[rows, columns] += (1 - d) * residuals
+        pushes += len(rows)
+        pushed = sp.csr_matrix((d * residuals, (rows, columns)), shape=(n, width))
+        spread = (M @ pushed).tocoo()
+        R[spread.row, spread.col] += spread.data
+        active = R[spread.row, spread.col] >= thresholds[spread.row]
+        rows, columns = spread.row[active], spread.col[active]
+    return S, pushes
+
+
+def block_ppr(adjacencies, d=0.85, tol=1e-6, max_iterations=100):
+    '''
+    run personalized PageRank on many graphs in one solve. the
+    graphs are stacked into a block-diagonal matrix and column c of
+    the scores personalizes on node c of every graph at once, so
+    the number of columns is the size of the largest graph rather
+    than the total. returns a list of score matrices, one per graph,
+    and the number of iterations run
+
+    :param adjacencies: list of square scipy sparse adjacency matrices
+    :param d: the damping factor
+    :param tol: the convergence tolerance
+    :param max_iterations: the maximum number of iterations
+    '''
+    sizes = np.array([A.shape[0] for A in adjacencies], dtype=np.int64)
+    offsets = np.r_[0, np.cumsum(sizes)]
+    n, width = offsets[-1], sizes.max() if len(sizes) else 0
+    if n == 0:
+        return [np.zeros((0, 0)) for _ in adjacencies], 0
+    M = transition_matrix(sp.block_diag(adjacencies, format='csr'))
+    #node offset + c of each graph is the restart node of column c
+    graph_ids = np.repeat(np.arange(len(sizes)), sizes)
+    columns = np.arange(n) - offsets[graph_ids]
+    #start each graph from the uniform vector in its own columns
+    graph_sizes = sizes[graph_ids][:, None]
+    V = np.where(np.arange(width)[None, :] < graph_sizes, 1 / graph_sizes, 0.0)
+    iterations = 0
+    for iterations in range(1, max_iterations + 1):
+        V_next = d * (M @ V)
+        V_next[np.arange(n), columns] += 1 - d
+        delta = np.abs(V_next - V).max()
+        V = V_next
+        if delta < tol:
+            break
+    return [V[offsets[k]:offsets[k + 1], :sizes[k]] for k in range(len(sizes))], iterations
+
+
+def block_batches(sizes, max_cells=BLOCK_BATCH_CELLS):
+    '''
+    group graphs of similar size for block_ppr, so little of each
+    solve is spent on the padding columns of smaller graphs. returns
+    lists of graph indices, covering every graph once
+
+    :param sizes: the number of nodes in each graph
+    :param max_cells: the most score cells in a batch
+    '''
+    batches, batch, rows = [], [], 0
+    for i in sorted(range(len(sizes)), key=lambda i: sizes[i]):
+        if batch and (rows + sizes[i]) * sizes[i] > max_cells:
+            batches.append(batch)
+            batch, rows = [], 0
+        batch.append(i)
+        rows += sizes[i]
+    if batch:
+        batches.append(batch)
+    return batches
@@ -1,20 +1,29 @@
 import networkx as nx
 import numpy as np
+import scipy.sparse as sp
 from matplotlib import pyplot as plt
+import os
+import os.path as op
+import sys
 import pprint
 import argparse
+import itertools
 import json
 
-from wiki import (get_candidates, edge_between, find_most_linked,
-generate_links_dict, check_edge, get_pageviews, trim_candidates,
-create_backlinks_count_dict, parallelise_requests)
+from wiki import (get_candidates_batch, edge_between, find_most_linked, generate_links_dict,
+get_pageviews_batch, get_backlink_counts, prune_candidates, probe_links, choose_edge_mode)
+from fetch import get_candidates_concurrent, generate_links_dict_concurrent, probe_links_concurrent
+from metrics import collecting
+from pagerank import component_ppr, push_ppr, block_ppr, block_batches, PUSH_MIN_NODES
+from titles import title_table
 import settings
 
-from cnlp_utils import get_entities
+from cnlp_utils import get_entities, parse_mentions
 
-def add_candidates(title, candidates, G):
+def add_candidates(title, candidates, G, table):
     for candidate in candidates:
-        G.add_node(G.number_of_nodes(), mention=title, candidate=candidate)
+        G.add_node(G.number_of_nodes(), mention=title, candidate=candidate,
+            candidate_id=table.id(candidate))
 
 
 def add_edges_uncached(G):
@@ -26,13 +35,62 @@ def add_edges_uncached(G):
                         G.add_edge(u, v)
 
 
-def add_edges(G, titles, links_dict):
-    for u in G.nodes():    
-        for v in G.nodes():
-            if G.nodes[u]['mention'] != G.nodes[v]['mention']:
-                if check_edge(G.nodes[u]['candidate'], G.nodes[v]['candidate'], links_dict):
-                    G.add_edge(u, v)
-    
+def build_adjacency(G, links_dict):
+    '''
+    build the symmetric adjacency matrix of the knowledge graph
+    as a scipy sparse matrix. each candidate's link ids are
+    intersected once with the sorted ids of every candidate in
+    the graph to find the links which point at other candidates
+
+    :param G: the graph of candidate nodes
+    :param links_dict: dictionary of pages and the sorted ids
+    of their contained links
+    '''
+    n = G.number_of_nodes()
+    mention_ids, _ = get_mention_ids(G)
+    candidate_ids = np.array([G.nodes[i]['candidate_id'] for i in range(n)], dtype=np.int32)
+    graph_ids = np.unique(candidate_ids)
+    nodes_by_id = {}
+    titles_by_id = {}
+    for i in range(n):
+        nodes_by_id.setdefault(candidate_ids[i], []).append(i)
+        titles_by_id[candidate_ids[i]] = G.nodes[i]['candidate']
+
+    rows, cols = [], []
+    for title_id, sources in nodes_by_id.items():
+        links = links_dict.get(titles_by_id[title_id])
+        if links is None:
+            continue
+        for target_id in np.intersect1d(links, graph_ids, assume_unique=True):
+            for u in sources:
+                for v in nodes_by_id[target_id]:
+                    if mention_ids[u] != mention_ids[v]:
+                        rows.append(u)
+                        cols.append(v)
+    #an edge is added if either page links to the other
+    data = np.ones(2 * len(rows))
+    A = sp.csr_matrix((data, (rows + cols, cols + rows)), shape=(n, n))
+    A.data[:] = 1
+    return A
+
+
+def add_edges(G, titles, links_dict, add_to_graph=True):
+    '''
+    add an edge between candidates of different mentions when
+    either links to the other. the sparse adjacency matrix is
+    returned and stored as G.graph['adjacency']
+
+    :param G: the graph of candidate nodes
+    :param titles: the candidate titles
+    :param links_dict: dictionary of pages and their contained links
+    :param add_to_graph: whether to also add the edges to G itself
+    '''
+    A = build_adjacency(G, links_dict)
+    if add_to_graph:
+        G.add_edges_from(zip(*A.nonzero()))
+    G.graph['adjacency'] = A
+    return A
+
 
 def ppr(G):
     personalization = {}
@@ -72,43 +130,134 @@ def manual_ppr(G, iterations, d):
     return G, S
 
 
-def compute_final_scores_pageviews(G, S):
-    n = S.shape[0]
+def sparse_ppr(G, d, tol=1e-6, max_iterations=100):
+    '''
+    compute the same scores as manual_ppr using a sparse
+    transition matrix, iterating all personalization vectors
+    at once until they converge. each connected component
+    of the graph is solved separately
+
+    :param G: the knowledge graph
+    :param d: the damping factor
+    :param tol: the convergence tolerance
+    :param max_iterations: the maximum number of iterations
+    '''
+    n = G.number_of_nodes()
+    if n == 0:
+        return G, np.zeros((0, 0))
+    A = G.graph.get('adjacency')
+    if A is None:
+        A = nx.to_scipy_sparse_array(G)
+    S, iterations = component_ppr(A, d, tol, max_iterations)
+    settings.logger.info('PPR converged after {0} iterations'.format(iterations))
+    settings.METRICS.increment('ppr_iterations', iterations)
+    return G, S
 
-    pageviews = []
-    for i in range(n):
-        pageviews.append(get_pageviews(G.nodes[i]['candidate']))
-    for i in range(n):
-        mention_max_scores = {}
-        u = G.nodes[i]
-        for j in range(n):
-            if i != j:
-                v = G.nodes[j]
-                mention = v['mention']
-                if mention != u['mention']:
-                    score = S[i, j] * pageviews[j]
-                    if mention not in mention_max_scores or score > mention_max_scores[mention][1]:
-                        mention_max_scores[mention] = (v['candidate'], score)
-        u['score'] = sum([val[1] for val in mention_max_scores.values()])
 
+def push_graph_ppr(G, d, epsilon=1e-3):
+    '''
+    approximate the scores of sparse_ppr by forward push, which
+    is faster on graphs of more than a few hundred nodes when
+    epsilon is not too small
 
+    :param G: the knowledge graph
+    :param d: the damping factor
+    :param epsilon: the residual tolerance per unit of degree
+    '''
+    A = G.graph.get('adjacency')
+    if A is None:
+        A = nx.to_scipy_sparse_array(G)
+    S, pushes = push_ppr(A, d, epsilon)
+    settings.logger.info('approximate PPR finished after {0} pushes'.format(pushes))
+    settings.METRICS.increment('ppr_pushes', pushes)
+    return G, S
 
-def compute_final_scores(G, S, links_dict, backlinks_count_dict):
-    n = S.shape[0]
 
+def run_ppr(G, d, engine=None, epsilon=None, push_min_nodes=PUSH_MIN_NODES):
+    '''
+    run PPR on a knowledge graph with the chosen engine
+
+    :param G: the knowledge graph
+    :param d: the damping factor
+    :param engine: 'power' or 'push', defaulting to settings.PPR_ENGINE
+    :param epsilon: the tolerance of the push engine, defaulting
+    to settings.PPR_EPSILON
+    :param push_min_nodes: graphs with fewer nodes use 'power' even
+    with the push engine, since power iteration is faster on them.
+    empty graphs always do
+    '''
+    if engine is None:
+        engine = settings.PPR_ENGINE
+    if engine == 'power' or (engine == 'push' and G.number_of_nodes() < max(push_min_nodes, 1)):
+        return sparse_ppr(G, d)
+    if engine == 'push':
+        if epsilon is None:
+            epsilon = settings.PPR_EPSILON
+        return push_graph_ppr(G, d, epsilon)
+    raise ValueError('unknown PPR engine: {0}'.format(engine))
+
+
+def get_mention_ids(G):
+    '''
+    number the mentions of a graph in order of first appearance.
+    returns an integer array giving the mention id of each node,
+    along with the list of mentions indexed by id
+    '''
+    mentions = {}
+    mention_ids = np.array(
+        [mentions.setdefault(G.nodes[i]['mention'], len(mentions)) for i in G.nodes()],
+        dtype=np.int64
+    )
+    return mention_ids, list(mentions)
+
+
+def mention_segments(mention_ids):
+    '''
+    sort nodes by mention id. returns the sorting order, the start
+    of each mention's segment in that order and the mention id of
+    each segment
+    '''
+    order = np.argsort(mention_ids, kind='stable')
+    sorted_ids = mention_ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    return order, starts, sorted_ids[starts]
+
+
+def final_scores(S, mention_ids):
+    '''
+    score every node as the sum, over every other mention, of the
+    highest score it gives to one of that mention's candidates
+
+    :param S: the score matrix, where S[i, j] is the score of
+    node i when personalizing on node j
+    :param mention_ids: integer array of the mention id of each node
+    '''
+    n = len(mention_ids)
+    if n == 0:
+        return np.zeros(0)
+    order, starts, segment_ids = mention_segments(mention_ids)
+    #per_mention[i, m] is the highest of S[i, j] over the nodes j of mention m
+    per_mention = np.maximum.reduceat(S[:, order], starts, axis=1)
+    per_mention[mention_ids[:, None] == segment_ids[None, :]] = 0
+    return per_mention.sum(axis=1)
+
+
+def compute_final_scores_pageviews(G, S):
+    n = S.shape[0]
+    pageviews_dict = get_pageviews_batch([G.nodes[i]['candidate'] for i in range(n)])
+    pageviews = np.array([pageviews_dict[G.nodes[i]['candidate']] for i in range(n)], dtype=float)
+    mention_ids, _ = get_mention_ids(G)
+    scores = final_scores(S * pageviews[None, :], mention_ids)
     for i in range(n):
-        mention_max_scores = {}
-        u = G.nodes[i]
-        for j in range(n):
-            if i != j:
-                v = G.nodes[j]
-                mention = v['mention']
-                if mention != u['mention']:
-                    #multiply by the count of the backlinks
-                    score = S[i, j] #* (backlinks_count_dict[v['candidate']]) #+ len(links_dict[v['candidate']]))
-                    if mention not in mention_max_scores or score > mention_max_scores[mention][1]:
-                        mention_max_scores[mention] = (v['candidate'], score)
-        u['score'] = sum([val[1] for val in mention_max_scores.values()])
+        G.nodes[i]['score'] = scores[i]
+
+
+def compute_final_scores(G, S, links_dict, backlinks_count_dict):
+    mention_ids, _ = get_mention_ids(G)
+    #the columns of S could be weighted by backlinks_count_dict here
+    scores = final_scores(S, mention_ids)
+    for i in range(S.shape[0]):
+        G.nodes[i]['score'] = scores[i]
 
 
 def collect_results(G, ppr_scores):
@@ -148,124 +297,470 @@ def get_disambiguations(mentions):
 def resolve_ties(disambiguations):
     '''
     resolve any candidates with tied scores, and convert values
-    from lists of candidates to strings
+    from lists of candidates to strings. the backlink counts of
+    all tied candidates are looked up together
     '''
+    tied = [c for candidates in disambiguations.values() if len(candidates) > 1 for c in candidates]
+    counts = get_backlink_counts(tied) if tied else {}
     for mention, candidates in disambiguations.items():
         if len(candidates) == 1: #convert from list of size 1 to string
             disambiguations[mention] = candidates[0]
         else:
-            disambiguations[mention] = find_most_linked(candidates)
+            disambiguations[mention] = find_most_linked(candidates, counts)
     return disambiguations
 
 
-def build_graph(entities):
+def fetch_candidates_dict(entities):
+    '''
+    get the candidates of all entities in batches, which run
+    concurrently when settings.CONCURRENCY is above 1.
+    candidates are pruned when settings.PRUNE_K is set
+    '''
+    with settings.METRICS.timer('stage_seconds', stage='candidates'):
+        if settings.CONCURRENCY > 1:
+            candidates_dict = get_candidates_concurrent(entities)
+        else:
+            candidates_dict = get_candidates_batch(entities)
+    if settings.PRUNE_K is not None:
+        before = sum(len(c) for c in candidates_dict.values() if c)
+        with settings.METRICS.timer('stage_seconds', stage='pruning'):
+            candidates_dict = prune_candidates(candidates_dict, settings.PRUNE_K, settings.PRUNE_PRIOR)
+        after = sum(len(c) for c in candidates_dict.values() if c)
+        settings.logger.info('pruned candidates from {0} to {1} ({2:.0f}% of the graph)'.format(
+            before, after, 100 * after / before if before else 100))
+    return candidates_dict
+
+
+def fetch_links_dict(titles, table, targets=None, mode=None, memoize=True):
     '''
-    this function is the same as the top part of the ned function
+    get the links of all titles, concurrently when
+    settings.CONCURRENCY is above 1 and in batches otherwise.
+    in 'probe' mode only the links to targets are fetched, which
+    is all that's needed to find edges between candidates, and in
+    'adaptive' mode whichever is expected to be cheaper is used.
+    with an offline link store, links are always read from the store
+
+    :param titles: list of article titles
+    :param table: the TitleTable to intern links in, as made
+    by titles.title_table
+    :param targets: the titles of the links which matter,
+    defaulting to the titles themselves
+    :param mode: 'links', 'probe' or 'adaptive', defaulting
+    to settings.EDGE_MODE
+    :param memoize: whether to keep the responses and full link
+    lists in memory, as in generate_links_dict
     '''
+    if targets is None:
+        targets = titles
+    if mode is None:
+        mode = settings.EDGE_MODE
+    if settings.LINK_STORE is not None:
+        mode = 'links'
+    elif mode == 'adaptive':
+        mode = choose_edge_mode(titles, targets)
+    settings.METRICS.increment('links_fetches', mode=mode)
+    with settings.METRICS.timer('stage_seconds', stage='links'):
+        if mode == 'probe':
+            if settings.CONCURRENCY > 1:
+                return probe_links_concurrent(titles, targets, table, memoize=memoize)
+            return probe_links(titles, targets, table, memoize)
+        if settings.CONCURRENCY > 1:
+            return generate_links_dict_concurrent(titles, table, memoize=memoize)
+        return generate_links_dict(titles, table, memoize)
+
+
+def build_graph(entities, candidates_dict=None, links_dict=None, table=None):
+    '''
+    generate candidates for all entities, fetch their links and
+    build the knowledge graph. candidates and links are fetched
+    concurrently when settings.CONCURRENCY is above 1, and in
+    batches across all entities otherwise
+
+    :param entities: iterable of mentions
+    :param candidates_dict: optional dict of the (pruned) candidates
+    of every entity, fetched together for several documents
+    :param links_dict: optional dict of the links of every candidate
+    :param table: the TitleTable the ids in links_dict are from,
+    which is kept as G.graph['titles']. a new one is made if not given
+    '''
+    entities = list(entities)
     all_candidates = []
-    G = nx.Graph()
+    if table is None:
+        table = title_table(settings.LINK_STORE)
+    G = nx.Graph(titles=table)
     total = 0
+    if candidates_dict is None:
+        candidates_dict = fetch_candidates_dict(entities)
     for e in entities:
-        candidates = get_candidates(e)
-        #candidates = trim_candidates(candidates, 3, 0.4)
+        candidates = candidates_dict[e]
         if candidates is not None:
             settings.logger.info('adding candidates for {0}'.format(e))
             if settings.VERBOSE:
                 for candidate in candidates:
-                    settings.logger.info('  {0}'.format(candidate))
+                    settings.logger.info('    {0}'.format(candidate))
             all_candidates += candidates
-            add_candidates(e, candidates, G)
+            add_candidates(e, candidates, G, table)
             total += len(candidates)
     settings.logger.info('total nodes: {0}'.format(total))
-    settings.logger.info('fetching links for all candidates')
-    links_dict = generate_links_dict(all_candidates)
+    settings.logger.info('fetching outgoing links for all candidate articles')
+    if links_dict is None:
+        links_dict = fetch_links_dict(all_candidates, table)
     #backlinks_count_dict = create_backlinks_count_dict(all_candidates)
     backlinks_count_dict = {}
     settings.logger.info('adding edges to knowledge graph')
-    add_edges(G, all_candidates, links_dict)
-    return G, links_dict, {}
+    with settings.METRICS.timer('stage_seconds', stage='edges'):
+        A = add_edges(G, all_candidates, links_dict)
+    settings.METRICS.increment('documents')
+    settings.METRICS.increment('mentions', len(entities))
+    settings.METRICS.increment('nodes', G.number_of_nodes())
+    settings.METRICS.increment('edges', A.nnz // 2)
+    return G, links_dict, backlinks_count_dict
 
 
-def analyse_graph(G, links_dict, backlinks_count_dict):
+def analyse_graph(G, links_dict, backlinks_count_dict, engine=None):
     '''
-    this function is the bottom part of the ned function
+    run PPR on a knowledge graph and pick the best
+    candidate for each mention
+
+    :param engine: the PPR engine, 'power' or 'push', defaulting
+    to settings.PPR_ENGINE
     '''
-    G, S = manual_ppr(G, 20, 0.85)
-    compute_final_scores(G, S, links_dict, backlinks_count_dict)
-    disambiguations = collect_disambiguations(G)
+    with settings.METRICS.timer('stage_seconds', stage='ppr'):
+        G, S = run_ppr(G, 0.85, engine)
+    with settings.METRICS.timer('stage_seconds', stage='scoring'):
+        compute_final_scores(G, S, links_dict, backlinks_count_dict)
+        disambiguations = collect_disambiguations(G)
     return disambiguations
 
 
-def ned(entities):
-    all_candidates = []
-    G = nx.Graph()
-    total = 0
-    for e in entities:
-        candidates = get_candidates(e)
-        #candidates = trim_candidates(candidates, 3, 0.4)
-        if candidates is not None:
-            settings.logger.info('adding candidates for {0}'.format(e))
-            if settings.VERBOSE:
-                for candidate in candidates:
-                    settings.logger.info('    {0}'.format(candidate))
-            all_candidates += candidates
-            add_candidates(e, candidates, G)
-            total += len(candidates)
-    settings.logger.info('total nodes: {0}'.format(total))
-    settings.logger.info('fetching outgoing links for all candidate articles')
-    links_dict = generate_links_dict(all_candidates)
-    #backlinks_count_dict = create_backlinks_count_dict(all_candidates)
-    backlinks_count_dict = {}
-    settings.logger.info('adding edges to knowledge graph')
-    add_edges(G, all_candidates, links_dict)
-    if settings.VERBOSE:
-        pos = nx.spring_layout(G)
-        nx.draw(G, pos, node_size=20, font_size=8)
-        plt.savefig('plots/knowledge_graph.png', format='PNG')
-
-    settings.logger.info('running PPR on knowledge graph')
-    G, S = manual_ppr(G, 20, 0.85)
-    compute_final_scores(G, S, links_dict, backlinks_count_dict)
-    disambiguations = collect_disambiguations(G)
-    return disambiguations
+def analyse_graphs(graphs, engine=None):
+    '''
+    analyse many knowledge graphs at once. with the power engine,
+    graphs of similar size are stacked into block-diagonal matrices
+    and solved together, which saves the per-call overhead of small
+    graphs. returns a list of disambiguations in the same order as
+    the graphs
+
+    :param graphs: list of (G, links_dict, backlinks_count_dict)
+    tuples as returned by build_graph
+    :param engine: the PPR engine, 'power' or 'push', defaulting
+    to settings.PPR_ENGINE
+    '''
+    if engine is None:
+        engine = settings.PPR_ENGINE
+    if engine != 'power':
+        return [analyse_graph(G, links_dict, backlinks_count_dict, engine)
+            for G, links_dict, backlinks_count_dict in graphs]
+
+    adjacencies = []
+    for G, _, _ in graphs:
+        A = G.graph.get('adjacency')
+        adjacencies.append(nx.to_scipy_sparse_array(G) if A is None else A)
+    scores = [None] * len(graphs)
+    with settings.METRICS.timer('stage_seconds', stage='ppr'):
+        for batch in block_batches([A.shape[0] for A in adjacencies]):
+            batch_scores, iterations = block_ppr([adjacencies[k] for k in batch], 0.85)
+            settings.logger.info('PPR on {0} graphs converged after {1} iterations'.format(
+                len(batch), iterations))
+            settings.METRICS.increment('ppr_iterations', iterations)
+            for k, S in zip(batch, batch_scores):
+                scores[k] = S
+
+    all_disambiguations = []
+    with settings.METRICS.timer('stage_seconds', stage='scoring'):
+        for (G, links_dict, backlinks_count_dict), S in zip(graphs, scores):
+            compute_final_scores(G, S, links_dict, backlinks_count_dict)
+            all_disambiguations.append(collect_disambiguations(G))
+    return all_disambiguations
+
+
+def ned(entities, engine=None, return_metrics=False):
+    '''
+    disambiguate a list of mentions
+
+    :param entities: iterable of mentions
+    :param engine: the PPR engine, 'power' or 'push', defaulting
+    to settings.PPR_ENGINE
+    :param return_metrics: also return a Metrics registry of the
+    timings and counts of this call
+    '''
+    if return_metrics:
+        with collecting() as metrics:
+            disambiguations = ned(entities, engine)
+        return disambiguations, metrics
+
+    with settings.METRICS.timer('ned_seconds'):
+        G, links_dict, backlinks_count_dict = build_graph(entities)
+        if settings.VERBOSE:
+            pos = nx.spring_layout(G)
+            nx.draw(G, pos, node_size=20, font_size=8)
+            plt.savefig('plots/knowledge_graph.png', format='PNG')
+
+        settings.logger.info('running PPR on knowledge graph')
+        return analyse_graph(G, links_dict, backlinks_count_dict, engine)
+
+
+def ned_batch(documents, engine=None):
+    '''
+    disambiguate several documents together. the candidates and
+    links of every document are fetched at once, so those shared
+    between documents are only fetched once, and the graphs are
+    analysed together. returns a list of disambiguations in the
+    same order as the documents. the titles of the batch are
+    interned in a title table of their own
+
+    :param documents: list of lists of mentions
+    :param engine: the PPR engine, 'power' or 'push', defaulting
+    to settings.PPR_ENGINE
+    '''
+    all_mentions = list(dict.fromkeys(m for mentions in documents for m in mentions))
+    candidates_dict = fetch_candidates_dict(all_mentions)
+    titles = [c for candidates in candidates_dict.values() if candidates for c in candidates]
+    table = title_table(settings.LINK_STORE)
+    links_dict = fetch_links_dict(titles, table)
+    graphs = [build_graph(mentions, candidates_dict, links_dict, table) for mentions in documents]
+    return analyse_graphs(graphs, engine)
+
+
+def read_documents(source):
+    '''
+    lazily read (id, mentions) pairs from a JSONL file, with '-'
+    for stdin, or from a directory of CoreNLP json files. each
+    JSONL line is a CoreNLP document or a dict of mentions, with an
+    optional "id" which defaults to the line number. the documents
+    of a directory are read in order of filename, which is their id
+    '''
+    if op.isdir(source):
+        for filename in sorted(os.listdir(source)):
+            if filename.endswith('.json'):
+                with open(op.join(source, filename)) as fr:
+                    yield filename, parse_mentions(json.load(fr))
+        return
+    fr = sys.stdin if source == '-' else open(source)
+    try:
+        for line_number, line in enumerate(fr, 1):
+            if line.strip():
+                data = json.loads(line)
+                doc_id = data.get('id', line_number) if isinstance(data, dict) else line_number
+                yield str(doc_id), parse_mentions(data)
+    finally:
+        if fr is not sys.stdin:
+            fr.close()
+
+
+def completed_ids(outfile):
+    '''
+    return the ids of the documents already written to a JSONL
+    output file. a partly written last line, left by a crash, is
+    cut off so that appending carries on from a whole line, and so
+    is everything from the first line which can't be read
+    '''
+    done = set()
+    if not op.isfile(outfile):
+        return done
+    with open(outfile, 'rb+') as f:
+        end = 0
+        for number, line in enumerate(f, 1):
+            if not line.endswith(b'\n'):
+                settings.logger.warning('cutting off the partly written line {0} of {1}'.format(number, outfile))
+                break
+            try:
+                result = json.loads(line)
+                doc_id = result['id']
+            except (ValueError, KeyError, TypeError) as e:
+                settings.logger.warning('cutting off {0} from line {1}, which could not be read: {2}'.format(
+                    outfile, number, e))
+                break
+            end += len(line)
+            if 'error' not in result:
+                done.add(doc_id)
+        f.truncate(end)
+    return done
+
+
+def ned_stream(source, outfile, batch_size=16):
+    '''
+    disambiguate a stream of documents in batches of batch_size,
+    appending one JSON line per document to outfile as each batch
+    finishes. documents already in outfile are skipped, so a run
+    which crashed can be resumed. documents which fail are written
+    with an error and retried on the next run
+
+    :param source: a JSONL file, '-' for stdin or a directory of
+    CoreNLP json files
+    :param outfile: the path of the JSONL output
+    :param batch_size: the number of documents disambiguated at once
+    '''
+    done = completed_ids(outfile)
+    documents = ((doc_id, mentions) for doc_id, mentions in read_documents(source)
+        if doc_id not in done)
+    with open(outfile, 'a') as fw:
+        while True:
+            batch = list(itertools.islice(documents, batch_size))
+            if not batch:
+                break
+            try:
+                results = [{'disambiguations': d} for d in ned_batch([m for _, m in batch])]
+            except Exception:
+                settings.logger.exception('batch failed, retrying its documents one at a time')
+                results = []
+                for _, mentions in batch:
+                    try:
+                        results.append({'disambiguations': ned(mentions)})
+                    except Exception as e:
+                        results.append({'error': str(e)})
+            for (doc_id, _), result in zip(batch, results):
+                fw.write(json.dumps(dict(id=doc_id, **result)) + '\n')
+            fw.flush()
+            settings.logger.info('wrote {0} documents to {1}'.format(len(batch), outfile))
 
 
 def collect_disambiguations(G):
+    '''
+    pick the highest scoring candidate for each mention,
+    resolving ties by the number of backlinks
+    '''
     settings.logger.info('aggregating final scores')
-    disambiguations = {}
-    scores = {}
-    for i in G.nodes():
-        u = G.nodes[i]
-        if u['mention'] not in disambiguations or u['score'] > scores[u['mention']]:
-                disambiguations[u['mention']] = u['candidate']
-                scores[u['mention']] = u['score']
-        elif scores[u['mention']] == u['score']: #resolve a tie
-            disambiguations[u['mention']] = find_most_linked([disambiguations[u['mention']], u['candidate']])
-    return disambiguations
+    n = G.number_of_nodes()
+    if n == 0:
+        return {}
+    mention_ids, mentions = get_mention_ids(G)
+    scores = np.array([G.nodes[i]['score'] for i in range(n)], dtype=float)
+    candidates = [G.nodes[i]['candidate'] for i in range(n)]
+    return resolve_ties(tied_candidates(scores, mention_ids, mentions, candidates))
+
+
+def tied_candidates(scores, mention_ids, mentions, candidates):
+    '''
+    return a dict of each mention and its list of highest
+    scoring candidates
+
+    :param scores: array of the final score of each node
+    :param mention_ids: integer array of the mention id of each node
+    :param mentions: list of mentions indexed by id
+    :param candidates: list of the candidate title of each node
+    '''
+    best = np.full(len(mentions), -np.inf)
+    np.maximum.at(best, mention_ids, scores)
+    winners = np.flatnonzero(scores == best[mention_ids])
+    tied = {mention: [] for mention in mentions}
+    for i in winners:
+        tied[mentions[mention_ids[i]]].append(candidates[i])
+    return {mention: list(dict.fromkeys(candidates)) for mention, candidates in tied.items()}
+
+
+def graph_arrays(G):
+    '''
+    pack a knowledge graph into plain arrays and lists, which are
+    much cheaper to send to another process than the graph itself.
+    returns a tuple of the CSR indptr and indices of the adjacency
+    matrix, the mention id of each node, the mentions and the
+    candidate title of each node
+    '''
+    A = G.graph.get('adjacency')
+    if A is None:
+        A = nx.to_scipy_sparse_array(G)
+    A = sp.csr_matrix(A)
+    mention_ids, mentions = get_mention_ids(G)
+    candidates = [G.nodes[i]['candidate'] for i in range(G.number_of_nodes())]
+    return A.indptr, A.indices, mention_ids, mentions, candidates
+
+
+def analyse_arrays(batch, engine='power', epsilon=1e-3, d=0.85):
+    '''
+    score a batch of graphs packed by graph_arrays and return the
+    tied candidates of each, leaving resolve_ties to the caller.
+    this doesn't use settings, so it can run in a worker process
+
+    :param batch: list of tuples returned by graph_arrays
+    :param engine: the PPR engine, 'power' or 'push'
+    :param epsilon: the tolerance of the push engine
+    :param d: the damping factor
+    '''
+    adjacencies = []
+    for indptr, indices, mention_ids, _, _ in batch:
+        n = len(mention_ids)
+        adjacencies.append(sp.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(n, n)))
+    if engine == 'power':
+        scores = [None] * len(adjacencies)
+        for block in block_batches([A.shape[0] for A in adjacencies]):
+            for k, S in zip(block, block_ppr([adjacencies[k] for k in block], d)[0]):
+                scores[k] = S
+    else:
+        scores = [push_ppr(A, d, epsilon)[0] if A.shape[0] >= PUSH_MIN_NODES else component_ppr(A, d)[0]
+            for A in adjacencies]
+
+    results = []
+    for (_, _, mention_ids, mentions, candidates), S in zip(batch, scores):
+        if len(mention_ids) == 0:
+            results.append({})
+            continue
+        final = final_scores(S, mention_ids)
+        results.append(tied_candidates(final, mention_ids, mentions, candidates))
+    return results
 
 
 def setup_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('infile',
-        help='path to the input file (JSON, CSV or TSV) to extract entities from')
+        help='path to the input file (JSON, CSV or TSV) to extract entities from, '
+        'or with --stream a JSONL file, "-" for stdin or a directory of CoreNLP files')
     parser.add_argument('outfile',
-        help='path to the output JSON file to save disambiguations')
+        help='path to the output JSON file to save disambiguations, or with --stream '
+        'the JSONL file to append results to')
+    parser.add_argument('--stream', action='store_true',
+        help='disambiguate a stream of documents, resuming from the ids already in outfile')
+    parser.add_argument('-b', '--batch-size', type=int, default=16,
+        help='number of documents disambiguated at once with --stream')
     parser.add_argument('-l', '--language', help='language', default='en')
     parser.add_argument('-r', '--replay', help='replay requests', action='store_true')
+    parser.add_argument('-s', '--links-source', default='api',
+        help='where to read page links from: "api" or the path of a link store built by linkstore.py')
+    parser.add_argument('-c', '--candidate-index',
+        help='path to a candidate index built by candidate_index.py')
+    parser.add_argument('-k', '--top-k', type=int,
+        help='keep only the top k candidates of each mention')
+    parser.add_argument('-p', '--prior', default='pageviews',
+        choices=['pageviews', 'backlinks', 'similarity', 'pageviews+similarity', 'backlinks+similarity'],
+        help='how to rank candidates when pruning to the top k')
+    parser.add_argument('-e', '--engine', default='power', choices=['power', 'push'],
+        help='PPR engine: exact power iteration or approximate forward push')
+    parser.add_argument('--epsilon', type=float, default=1e-3,
+        help='residual tolerance of the push engine')
+    parser.add_argument('-E', '--edge-mode', default='adaptive', choices=['links', 'probe', 'adaptive'],
+        help='how edges are found: from full link lists, by asking pages about the other '
+        'candidates, or whichever is expected to take fewer requests')
+    parser.add_argument('-m', '--metrics',
+        help='path to save metrics to, in Prometheus text format if it ends in .prom and JSON otherwise')
     return parser
 
 
 def main():
     parser = setup_parser()
     args = parser.parse_args()
-    settings.init(args.language, args.replay)
-
-    entities = get_entities(args.infile)
-    #get disambiguations and format them into a printable string
-    disambiguations = pprint.pformat(ned(entities))
-    settings.logger.info(disambiguations)
-    with open(args.outfile, 'w') as fw:
-        json.dump(disambiguations, fw)
+    settings.init(args.language, args.replay, links_source=args.links_source,
+        candidate_index=args.candidate_index)
+    settings.PRUNE_K = args.top_k
+    settings.PRUNE_PRIOR = args.prior
+    settings.PPR_ENGINE = args.engine
+    settings.PPR_EPSILON = args.epsilon
+    settings.EDGE_MODE = args.edge_mode
+
+    if args.stream:
+        with collecting() as metrics:
+            ned_stream(args.infile, args.outfile, args.batch_size)
+    else:
+        entities = get_entities(args.infile)
+        disambiguations, metrics = ned(entities, return_metrics=True)
+        settings.logger.info(pprint.pformat(disambiguations))
+        with open(args.outfile, 'w') as fw:
+            json.dump(disambiguations, fw, indent=2)
+    if args.metrics:
+        with open(args.metrics, 'w') as fw:
+            if args.metrics.endswith('.prom'):
+                fw.write(metrics.to_prometheus())
+            else:
+                fw.write(metrics.to_json(indent=2))
     
 
 if __name__ == '__main__':
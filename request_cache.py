@@ -0,0 +1,286 @@
+'''
+a persistent, keyed store for MediaWiki API responses
+
+responses are stored in a SQLite database keyed on the JSON
+encoding of the request params, so lookups and inserts are
+indexed rather than requiring the whole cache to be read and
+rewritten on every request.
+
+values derived from requests, such as pageview and backlink
+counts, are stored as responses under params of their own, so
+everything in the database can be moved to and from the JSON cache.
+
+run like:
+
+python request_cache.py fixtures/cached_requests/all.json
+
+to import an existing JSON cache into the database, or
+
+python request_cache.py fixtures/cached_requests/all.json --export
+
+to write the database out as a JSON cache
+'''
+import sqlite3
+import threading
+import time
+import json
+import os
+import os.path as op
+import argparse
+from collections import OrderedDict
+
+
+DEFAULT_PATH = 'fixtures/cached_requests/all.sqlite'
+LEGACY_PATH = 'fixtures/cached_requests/all.json'
+
+
+def make_key(params):
+    '''
+    create the lookup key for a set of request params. this
+    matches the keys used by the old JSON cache so existing
+    entries can be imported unchanged
+
+    :param params: the dict of params sent to the API
+    '''
+    return json.dumps(params)
+
+
+def memory_key(lang, params):
+    '''
+    create the key for the in-memory cache. params are encoded
+    with sorted keys so equivalent requests share an entry
+
+    :param lang: the language of the wiki being queried
+    :param params: the dict of params sent to the API
+    '''
+    return (lang, json.dumps(params, sort_keys=True))
+
+
+class MemoryCache:
+    '''
+    a bounded in-process LRU cache with a time-to-live for each entry
+
+    :param maxsize: the maximum number of entries to keep
+    :param ttl: the number of seconds an entry stays valid, or None
+    to keep entries until they are evicted
+    '''
+    def __init__(self, maxsize=50000, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        return the value stored for a key, or None if it is
+        missing or has expired
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored = entry
+                if self.ttl is None or time.monotonic() - stored < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        '''
+        return a dict of the cache's size and hit/miss counts
+        '''
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RequestCache:
+    '''
+    a thread-safe on-disk cache of API responses
+
+    a single connection is shared between threads and guarded
+    by a lock; separate processes can write to the same file
+    since SQLite handles locking between them
+    '''
+    def __init__(self, filepath=DEFAULT_PATH, timeout=30):
+        directory = op.dirname(filepath)
+        if directory and not op.isdir(directory):
+            os.makedirs(directory)
+        self.filepath = filepath
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filepath, timeout=timeout, check_same_thread=False)
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS requests '
+                '(key TEXT PRIMARY KEY, response TEXT NOT NULL)'
+            )
+            self._conn.commit()
+
+    def get(self, params):
+        '''
+        return the cached response for some params, or None
+        if the request has not been cached
+
+        :param params: the dict of params sent to the API
+        '''
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT response FROM requests WHERE key = ?',
+                (make_key(params),)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put(self, params, response):
+        '''
+        store a response, replacing any previous response
+        for the same params
+
+        :param params: the dict of params sent to the API
+        :param response: the decoded JSON response
+        '''
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO requests (key, response) VALUES (?, ?)',
+                (make_key(params), json.dumps(response))
+            )
+            self._conn.commit()
+
+    def put_many(self, items, replace=True):
+        '''
+        store many (key, response) pairs in a single transaction
+
+        :param items: iterable of (key, response) pairs where
+        key is already encoded with make_key
+        :param replace: whether to replace responses which are
+        already stored, rather than keep them
+        '''
+        verb = 'INSERT OR REPLACE' if replace else 'INSERT OR IGNORE'
+        with self._lock:
+            self._conn.executemany(
+                verb + ' INTO requests (key, response) VALUES (?, ?)',
+                ((key, json.dumps(response)) for key, response in items)
+            )
+            self._conn.commit()
+
+    def keys(self):
+        '''
+        return a list of the keys of every cached request
+        '''
+        with self._lock:
+            return [row[0] for row in self._conn.execute('SELECT key FROM requests')]
+
+    def items(self):
+        '''
+        return a list of (key, response) pairs of every cached request
+        '''
+        with self._lock:
+            rows = self._conn.execute('SELECT key, response FROM requests').fetchall()
+        return [(key, json.loads(response)) for key, response in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM requests').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def import_json(cache, filepath=LEGACY_PATH, replace=True):
+    '''
+    import every request from an old whole-file JSON cache.
+    returns the number of requests imported
+
+    :param cache: the RequestCache to import into
+    :param filepath: path to the JSON cache file
+    :param replace: whether imported responses replace those
+    already in the cache
+    '''
+    with open(filepath, 'r') as fr:
+        all_reqs = json.load(fr)
+    cache.put_many(all_reqs.items(), replace)
+    return len(all_reqs)
+
+
+def export_json(cache, filepath=LEGACY_PATH):
+    '''
+    write every cached request to a whole-file JSON cache, in the
+    format import_json reads. returns the number of requests exported
+
+    :param cache: the RequestCache to export
+    :param filepath: path to the JSON cache file
+    '''
+    all_reqs = dict(cache.items())
+    with open(filepath, 'w') as fw:
+        json.dump(all_reqs, fw)
+    return len(all_reqs)
+
+
+def open_cache(filepath=DEFAULT_PATH, legacy_filepath=LEGACY_PATH, seed=False):
+    '''
+    open the request cache, importing the legacy JSON cache
+    the first time the database is created
+
+    :param seed: also import the requests of the legacy cache
+    which an existing database is missing
+    '''
+    exists = op.isfile(filepath)
+    cache = RequestCache(filepath)
+    if (seed or not exists) and op.isfile(legacy_filepath):
+        import_json(cache, legacy_filepath, replace=not exists)
+    return cache
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('infile', nargs='?', default=LEGACY_PATH,
+        help='path to the JSON cache file to import, or to export to with --export')
+    parser.add_argument('-o', '--outfile', default=DEFAULT_PATH,
+        help='path to the SQLite cache to import into or export from')
+    parser.add_argument('-e', '--export', action='store_true',
+        help='export the SQLite cache to the JSON file instead')
+    return parser
+
+
+def main():
+    parser = setup_parser()
+    args = parser.parse_args()
+    cache = RequestCache(args.outfile)
+    if args.export:
+        count = export_json(cache, args.infile)
+        print('exported {0} requests to {1}'.format(count, args.infile))
+    else:
+        count = import_json(cache, args.infile)
+        print('imported {0} requests into {1}'.format(count, args.outfile))
+    cache.close()
+
+
+if __name__ == '__main__':
+    main()
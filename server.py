@@ -0,0 +1,187 @@
+'''
+a long-running disambiguation server
+
+settings, the HTTP sessions and the request caches are set up once
+and stay warm between requests. requests arriving at about the same
+time are collected into a micro-batch: the candidates of all their
+mentions and the links of all their candidates are fetched together,
+so shared ones are fetched once, and their graphs are analysed
+together with analyse_graphs.
+
+POST /disambiguate with either CoreNLP JSON, {"mentions": [...]} or
+a JSON list of mentions, and the response is {"disambiguations": {...}}.
+GET /metrics returns the server's metrics in the Prometheus text
+format, and GET /health returns "ok".
+
+run like:
+
+python server.py --port 8080 -r
+'''
+import json
+import queue
+import argparse
+import threading
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from ppr import ned_batch
+from cnlp_utils import parse_mentions
+from metrics import Metrics
+import settings
+
+
+#the most documents analysed in one batch
+MAX_BATCH_SIZE = 32
+#the seconds to wait for more documents after the first of a batch arrives
+BATCH_WAIT = 0.01
+
+
+class Batcher:
+    '''
+    collect documents submitted from many threads into batches,
+    which a single worker thread disambiguates in turn
+
+    :param max_batch_size: the most documents in a batch
+    :param wait: the seconds to wait for more documents once
+    the first document of a batch has arrived
+    '''
+    def __init__(self, max_batch_size=MAX_BATCH_SIZE, wait=BATCH_WAIT):
+        self.max_batch_size = max_batch_size
+        self.wait = wait
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, mentions):
+        '''
+        queue a document's mentions, returning a future of its
+        disambiguations
+        '''
+        future = Future()
+        self.queue.put((mentions, future))
+        return future
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self.queue.get(timeout=self.wait))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            settings.METRICS.increment('batches')
+            settings.METRICS.increment('batched_documents', len(batch))
+            try:
+                with settings.METRICS.timer('batch_seconds'):
+                    results = ned_batch([mentions for mentions, _ in batch])
+            except Exception as e:
+                settings.logger.exception('failed to disambiguate a batch')
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    self.run_alone(batch)
+                continue
+            for (_, future), disambiguations in zip(batch, results):
+                future.set_result(disambiguations)
+
+    def run_alone(self, batch):
+        '''
+        disambiguate each document of a failed batch on its own, so
+        only the documents which fail themselves get the exception
+        '''
+        settings.METRICS.increment('batch_retries')
+        for mentions, future in batch:
+            try:
+                disambiguations = ned_batch([mentions])[0]
+            except Exception as e:
+                settings.logger.exception('failed to disambiguate a document')
+                future.set_exception(e)
+                continue
+            future.set_result(disambiguations)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    batcher = None
+
+    def send_body(self, status, body, content_type='application/json'):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        self.send_body(status, json.dumps({'error': message}))
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_body(200, 'ok', 'text/plain')
+        elif self.path == '/metrics':
+            self.send_body(200, settings.METRICS.to_prometheus(), 'text/plain; version=0.0.4')
+        else:
+            self.send_error_json(404, 'not found')
+
+    def do_POST(self):
+        if self.path != '/disambiguate':
+            self.send_error_json(404, 'not found')
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            mentions = parse_mentions(json.loads(self.rfile.read(length)))
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_error_json(400, 'could not read mentions: {0}'.format(e))
+            return
+        with settings.METRICS.timer('request_seconds'):
+            try:
+                disambiguations = self.batcher.submit(mentions).result()
+            except Exception as e:
+                self.send_error_json(500, str(e))
+                return
+        self.send_body(200, json.dumps({'disambiguations': disambiguations}))
+
+    def log_message(self, format, *args):
+        settings.logger.debug(format % args)
+
+
+def serve(host, port, max_batch_size=MAX_BATCH_SIZE, wait=BATCH_WAIT):
+    RequestHandler.batcher = Batcher(max_batch_size, wait)
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    settings.logger.info('serving on http://{0}:{1}'.format(host, server.server_port))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on')
+    parser.add_argument('-b', '--batch-size', type=int, default=MAX_BATCH_SIZE,
+        help='the most documents disambiguated together')
+    parser.add_argument('-w', '--batch-wait', type=float, default=BATCH_WAIT,
+        help='seconds to wait for more documents before starting a batch')
+    parser.add_argument('-l', '--language', help='language', default='en')
+    parser.add_argument('-r', '--replay', help='replay requests', action='store_true')
+    parser.add_argument('-s', '--links-source', default='api',
+        help='where to read page links from: "api" or the path of a link store built by linkstore.py')
+    parser.add_argument('-c', '--candidate-index',
+        help='path to a candidate index built by candidate_index.py')
+    return parser
+
+
+def main():
+    args = setup_parser().parse_args()
+    settings.init(args.language, args.replay, links_source=args.links_source,
+        candidate_index=args.candidate_index)
+    settings.METRICS = Metrics()
+    serve(args.host, args.port, args.batch_size, args.batch_wait)
+
+
+if __name__ == '__main__':
+    main()
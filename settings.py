@@ -4,6 +4,11 @@ import colorlog
 import vcr
 import requests
 
+from request_cache import open_cache, MemoryCache
+from linkstore import LinkStore
+from candidate_index import CandidateIndex
+from metrics import NullMetrics
+
 
 def setup_logger():
     handler = colorlog.StreamHandler()
@@ -43,15 +48,28 @@ class DateHandler:
         self._start = start
 
 
-def init(language='en', replaying=False, verbose=False):
+def init(language='en', replaying=False, verbose=False, links_source='api', candidate_index=None):
     global date_handler
     global logger
     global LANG
     global VCR
     global SESSION
     global REPLAYING
-    global PARALLEL
     global VERBOSE
+    global CACHE
+    global MEMORY_CACHE
+    global CONCURRENCY
+    global HOST_CONCURRENCY
+    global LINK_STORE
+    global CANDIDATE_INDEX
+    global OFFLINE
+    global PAGEVIEWS_SESSION
+    global PRUNE_K
+    global PRUNE_PRIOR
+    global PPR_ENGINE
+    global PPR_EPSILON
+    global METRICS
+    global EDGE_MODE
 
     date_handler = DateHandler()
     logger = setup_logger()
@@ -62,5 +80,26 @@ def init(language='en', replaying=False, verbose=False):
     )
     SESSION = requests.session()
     REPLAYING = replaying
-    PARALLEL = False #only set true when parallelising requests
-    VERBOSE = verbose
\ No newline at end of file
+    VERBOSE = verbose
+    CACHE = open_cache()
+    MEMORY_CACHE = MemoryCache()
+    CONCURRENCY = 16 #max requests in flight when fetching candidates and links
+    HOST_CONCURRENCY = 8 #max requests in flight to any one host
+    #where page links are read from: 'api' or the path of a link store
+    LINK_STORE = None if links_source == 'api' else LinkStore(links_source)
+    #an offline index of mentions to candidates, loaded when first used
+    CANDIDATE_INDEX = None if candidate_index is None else CandidateIndex(candidate_index)
+    OFFLINE = False #only set true to stop cache misses going to the network
+    PAGEVIEWS_SESSION = requests.session()
+    PAGEVIEWS_SESSION.mount('https://', requests.adapters.HTTPAdapter(
+        pool_connections=HOST_CONCURRENCY, pool_maxsize=HOST_CONCURRENCY))
+    PRUNE_K = None #keep only the top k candidates of each mention when set
+    PRUNE_PRIOR = 'pageviews'
+    PPR_ENGINE = 'power' #'power' for exact scores, 'push' for approximate ones
+    PPR_EPSILON = 1e-3 #residual tolerance of the push engine
+    #where pipeline metrics are recorded, set to Metrics() to collect them
+    METRICS = NullMetrics()
+    #how edges are found: 'links' reads every link on each candidate,
+    #'probe' asks each candidate which of the others it links to, and
+    #'adaptive' picks whichever should take fewer requests
+    EDGE_MODE = 'adaptive'
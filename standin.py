@@ -0,0 +1,258 @@
+'''
+a stand-in for the MediaWiki API, answering queries from the
+responses in the legacy JSON request cache
+
+all.json holds the responses of the original pipeline, which asked
+about one title at a time, so the batched and combined queries made
+now never match its keys. the stand-in instead reads the facts about
+each page out of those responses - whether it exists, its categories,
+its links, where it redirects and which pages link to it - and builds
+the response to any query the pipeline makes from them, including
+continuations. it is used in place of settings.SESSION, so requests
+still go through get_json and the request cache as they would online.
+
+a fact the original pipeline never asked for is answered as absent,
+which leaves the candidates and links of the mentions it did ask
+about unchanged. pages it never asked about at all are answered as
+missing and are counted in unknown_titles, and covers() reports
+whether the original pipeline asked about every mention of a document
+'''
+import json
+import threading
+
+from request_cache import LEGACY_PATH
+
+#the first id given to pages whose ids aren't in the responses
+MADE_UP_IDS = 10 ** 9
+
+
+class StandInResponse:
+    '''
+    the parts of a requests response used by get_json
+    '''
+    def __init__(self, data):
+        self.status_code = 200
+        self.headers = {}
+        self._data = data
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        pass
+
+
+class StandInAPI:
+    '''
+    the pages recorded in a set of cached responses, answering
+    MediaWiki queries about them
+    '''
+    def __init__(self):
+        self.normalized = {}
+        self.pages = {}
+        self.categories = {}
+        self.redirects = {}
+        self.backlinks = {}
+        self.asked = set()
+        self.unknown_titles = set()
+        self._link_chunks = {}
+        self._links = None
+        self._made_up_ids = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def load(filepath=LEGACY_PATH):
+        '''
+        build a stand-in from a JSON cache of params:response pairs
+        '''
+        api = StandInAPI()
+        with open(filepath) as fr:
+            for key, response in json.load(fr).items():
+                api.add(json.loads(key), response)
+        #number the pages whose ids were never returned in a fixed order
+        backlinks = [b for titles in api.backlinks.values() for b in titles]
+        for title in sorted(set(api.pages) | set(backlinks)):
+            api.page_id(title)
+        return api
+
+    def add(self, params, response):
+        '''
+        record the facts in the response to a single-title request
+        '''
+        self._links = None
+        if params.get('list') == 'backlinks':
+            backlinks = response.get('query', {}).get('backlinks', [])
+            self.backlinks.setdefault(params['bltitle'], []).extend(b['title'] for b in backlinks)
+            return
+        if params.get('action') != 'query' or 'titles' not in params:
+            return
+        query = response.get('query', {})
+        for item in query.get('normalized', []):
+            self.normalized[item['from']] = item['to']
+        title = params['titles']
+        self.asked.add(title)
+        resolved = self.normalized.get(title, title)
+        if 'redirects' in params:
+            redirects = query.get('redirects', [])
+            for item in redirects:
+                self.redirects[item['from']] = item['to']
+                self.pages.setdefault(item['from'], {'ns': 0, 'title': item['from']})
+            if not redirects:
+                self.redirects.setdefault(resolved, None)
+        props = params.get('prop', '').split('|')
+        for page in query.get('pages', {}).values():
+            stub = {k: page[k] for k in ('pageid', 'ns', 'title', 'missing') if k in page}
+            self.pages.setdefault(page['title'], {}).update(stub)
+            if 'missing' in page:
+                continue
+            if 'categories' in props:
+                self.categories[page['title']] = page.get('categories', [])
+            if 'links' in props:
+                links = [link['title'] for link in page.get('links', [])]
+                next_chunk = response.get('continue', {}).get('plcontinue')
+                self._link_chunks.setdefault(page['title'], {})[params.get('plcontinue')] = (links, next_chunk)
+
+    @property
+    def links(self):
+        '''
+        the links of every page, joining the recorded continuations
+        of each in order
+        '''
+        with self._lock:
+            if self._links is None:
+                self._links = {}
+                for title, chunks in self._link_chunks.items():
+                    links = []
+                    cont = None
+                    seen = set()
+                    while cont in chunks and cont not in seen:
+                        seen.add(cont)
+                        chunk_links, cont = chunks[cont]
+                        links += chunk_links
+                    self._links[title] = links
+            return self._links
+
+    def covers(self, titles):
+        '''
+        determine if the original pipeline asked about every title
+        '''
+        return all(t in self.asked for t in titles)
+
+    def page_id(self, title):
+        '''
+        the recorded id of a page, or a made-up one above every
+        recorded id for pages whose id was never returned
+        '''
+        page_id = self.pages.get(title, {}).get('pageid')
+        if page_id is None:
+            with self._lock:
+                page_id = self._made_up_ids.setdefault(title, MADE_UP_IDS + len(self._made_up_ids))
+        return page_id
+
+    def query(self, params):
+        '''
+        return the response to a query, as the API would
+        '''
+        if params.get('action') != 'query' or 'titles' not in params:
+            raise LookupError('the stand-in API only answers title queries: {0}'.format(json.dumps(params)))
+        titles = params['titles'].split('|')
+        props = params.get('prop', '').split('|')
+        query = {}
+        resolved = []
+        for title in titles:
+            target = self.normalized.get(title, title)
+            if target != title:
+                query.setdefault('normalized', []).append({'from': title, 'to': target})
+            if 'redirects' in params:
+                seen = set()
+                while self.redirects.get(target) is not None and target not in seen:
+                    seen.add(target)
+                    query.setdefault('redirects', []).append({'from': target, 'to': self.redirects[target]})
+                    target = self.redirects[target]
+            resolved.append(target)
+
+        pages = {}
+        for i, title in enumerate(dict.fromkeys(resolved)):
+            page = self.pages.get(title)
+            if page is None:
+                with self._lock:
+                    self.unknown_titles.add(title)
+                page = {'ns': 0, 'title': title, 'missing': ''}
+            page = dict(page)
+            if 'missing' in page:
+                pages[str(-1 - i)] = page
+                continue
+            page['pageid'] = self.page_id(title)
+            if 'categories' in props:
+                wanted = set(params.get('clcategories', '').split('|'))
+                categories = [c for c in self.categories.get(title, []) if c['title'] in wanted]
+                if categories:
+                    page['categories'] = categories
+            pages[str(page['pageid'])] = page
+
+        data = {'batchcomplete': ''}
+        ordered = sorted((p for p in pages.values() if 'pageid' in p), key=lambda p: p['pageid'])
+        if 'links' in props:
+            self.add_links(params, ordered, data)
+        if 'linkshere' in props:
+            self.add_backlinks(params, ordered, data)
+        query['pages'] = pages
+        data['query'] = query
+        return data
+
+    def add_links(self, params, pages, data):
+        '''
+        add a page of the links of pages to a response, in order of
+        page id then title, continuing with plcontinue
+        '''
+        targets = set(params['pltitles'].split('|')) if 'pltitles' in params else None
+        items = []
+        for page in pages:
+            for link in self.links.get(page['title'], []):
+                if targets is None or link in targets:
+                    items.append((page['pageid'], link, page))
+        self.add_items(items, params.get('plcontinue'), int(params.get('pllimit', 10)),
+            'plcontinue', lambda item: '{0}|0|{1}'.format(item[0], item[1]),
+            lambda item: item[2].setdefault('links', []).append({'ns': 0, 'title': item[1]}), data)
+
+    def add_backlinks(self, params, pages, data):
+        '''
+        add a page of the ids of the pages linking to pages to a
+        response, in order of page id, continuing with lhcontinue
+        '''
+        items = []
+        for page in pages:
+            for backlink_id in sorted(self.page_id(b) for b in self.backlinks.get(page['title'], [])):
+                items.append((page['pageid'], backlink_id, page))
+        self.add_items(items, params.get('lhcontinue'), int(params.get('lhlimit', 10)),
+            'lhcontinue', lambda item: '{0}|{1}'.format(item[0], item[1]),
+            lambda item: item[2].setdefault('linkshere', []).append({'pageid': item[1]}), data)
+
+    @staticmethod
+    def add_items(items, cont, limit, cont_name, cont_value, add, data):
+        start = 0
+        if cont is not None:
+            values = [cont_value(item) for item in items]
+            start = values.index(cont) if cont in values else len(items)
+        for item in items[start:start + limit]:
+            add(item)
+        if start + limit < len(items):
+            data['continue'] = {cont_name: cont_value(items[start + limit]), 'continue': '||'}
+            data.pop('batchcomplete', None)
+
+
+class StandInSession:
+    '''
+    a stand-in for a requests session, answering MediaWiki API
+    requests with a StandInAPI and refusing any other request
+
+    :param api: the StandInAPI to answer with
+    '''
+    def __init__(self, api):
+        self.api = api
+
+    def get(self, url=None, params=None, **kwargs):
+        if not url.endswith('/w/api.php'):
+            raise LookupError('the stand-in API only answers MediaWiki requests: {0}'.format(url))
+        params = {k: v for k, v in (params or {}).items() if k != 'maxlag'}
+        return StandInResponse(self.api.query(params))
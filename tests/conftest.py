@@ -0,0 +1,56 @@
+import os.path as op
+import sys
+import logging
+
+import pytest
+
+ROOT = op.dirname(op.dirname(op.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import settings
+from linkstore import build_link_store
+from candidate_index import build_candidate_index
+
+
+LINKSTORE_FIXTURES = op.join(ROOT, 'fixtures', 'linkstore')
+#the candidates of mentions of pages in the fixture link store
+CANDIDATE_PAIRS = [
+    ('Paris', 'Paris'),
+    ('Paris', 'Paris (band)'),
+    ('Paris', 'Paris, Texas'),
+    ('London', 'London'),
+    ('France', 'France'),
+    ('Berlin', 'Berlin'),
+    ('UK', 'United Kingdom'),
+    ('Nowhere', None),
+]
+
+
+@pytest.fixture
+def link_store(tmp_path):
+    return build_link_store(
+        op.join(LINKSTORE_FIXTURES, 'page.tsv'),
+        op.join(LINKSTORE_FIXTURES, 'pagelinks.tsv'),
+        str(tmp_path / 'linkstore'),
+        op.join(LINKSTORE_FIXTURES, 'redirect.tsv'),
+    )
+
+
+@pytest.fixture
+def candidate_index(tmp_path):
+    return build_candidate_index(CANDIDATE_PAIRS, str(tmp_path / 'candidates'))
+
+
+@pytest.fixture
+def offline(tmp_path, monkeypatch):
+    '''
+    settings for a run which can't reach the network, with a new,
+    empty request cache. requests which aren't cached raise LookupError
+    '''
+    monkeypatch.chdir(tmp_path)
+    settings.init()
+    settings.logger.setLevel(logging.WARNING)
+    settings.REPLAYING = True
+    settings.OFFLINE = True
+    yield settings
+    settings.CACHE.close()
@@ -0,0 +1,37 @@
+import os.path as op
+
+import pytest
+
+import benchmark
+from cnlp_utils import get_entities
+from conftest import ROOT
+
+
+@pytest.fixture
+def standin(offline, monkeypatch):
+    #the stand-in reads all.json from the repository
+    monkeypatch.chdir(ROOT)
+    return offline
+
+
+def test_standin_replays_a_document(standin):
+    entities = sorted(get_entities(op.join(ROOT, 'demo', 'tokenized', 'en', 'Soundex.json')))
+    results, metrics = benchmark.run_benchmark([('soundex', entities)], memory=False)
+    document = results['documents'][0]
+    assert 'skipped' not in document
+    assert document['nodes'] > 0 and document['edges'] > 0
+    assert document['requests'] >= document['network_requests'] > 0
+    assert all(document['stages'][stage] > 0 for stage in benchmark.STAGES)
+    assert document['nodes'] == metrics.counter('nodes')
+    assert results['totals']['documents'] == 1
+
+
+def test_documents_without_responses_are_skipped(standin):
+    entities = sorted(get_entities(op.join(ROOT, 'demo', 'tokenized', 'en', 'Soundex.json')))
+    results, _ = benchmark.run_benchmark([('soundex', entities), ('unknown', ['Nowhere'])], memory=False)
+    assert results['documents'][1]['skipped'] == 'all.json has no responses for 1 of its 1 mentions'
+
+
+def test_fails_when_every_document_is_skipped(standin):
+    with pytest.raises(RuntimeError, match='every document was skipped'):
+        benchmark.run_benchmark([('unknown', ['Nowhere'])], memory=False)
@@ -0,0 +1,43 @@
+from candidate_index import CandidateIndex, build_candidate_index, pairs_from_link_store
+import wiki
+
+
+def test_candidates(candidate_index):
+    assert candidate_index.candidates('Paris') == ['Paris', 'Paris (band)', 'Paris, Texas']
+    assert candidate_index.candidates('UK') == ['United Kingdom']
+    assert candidate_index.candidates('Madrid') is None
+
+
+def test_mention_without_candidates(candidate_index):
+    assert candidate_index.candidates('Nowhere') == []
+    assert 'Nowhere' in candidate_index
+    assert 'Madrid' not in candidate_index
+
+
+def test_lookup_ignores_case(candidate_index):
+    assert candidate_index.candidates('PARIS') == ['Paris', 'Paris (band)', 'Paris, Texas']
+    assert candidate_index.candidates('uk') == ['United Kingdom']
+
+
+def test_prefix(candidate_index):
+    assert candidate_index.prefix('par') == {'paris': ['Paris', 'Paris (band)', 'Paris, Texas']}
+    assert list(candidate_index.prefix('', limit=2)) == ['berlin', 'france']
+
+
+def test_reopen(candidate_index):
+    index = CandidateIndex(candidate_index.directory)
+    assert index.candidates('London') == ['London']
+
+
+def test_candidates_from_link_store(link_store, tmp_path):
+    index = build_candidate_index(pairs_from_link_store(link_store, []), str(tmp_path / 'from_store'))
+    assert index.candidates('French Republic') == ['France']
+    assert index.candidates('Paris, Texas') == ['Paris, Texas']
+    #only pages get candidates, not titles which are just link targets
+    assert index.candidates('Rock music') is None
+
+
+def test_get_candidates_uses_index(offline, candidate_index):
+    offline.CANDIDATE_INDEX = candidate_index
+    assert wiki.get_candidates('Paris') == ['Paris', 'Paris (band)', 'Paris, Texas']
+    assert wiki.get_candidates_batch(['London', 'UK']) == {'London': ['London'], 'UK': ['United Kingdom']}
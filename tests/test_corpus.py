@@ -0,0 +1,42 @@
+import pytest
+
+import corpus
+import settings
+from wiki import known_links
+from standin import StandInAPI, StandInSession
+
+
+def links_response(title, links, page_id):
+    return {'query': {'pages': {str(page_id): {'pageid': page_id, 'ns': 0, 'title': title,
+        'links': [{'ns': 0, 'title': link} for link in links]}}}}
+
+
+@pytest.fixture
+def standin(offline, monkeypatch):
+    api = StandInAPI()
+    params = {'action': 'query', 'format': 'json', 'prop': 'links', 'pllimit': '500'}
+    api.add(dict(params, titles='Paris'), links_response('Paris', ['Berlin', 'France', 'London'], 1))
+    api.add(dict(params, titles='London'), links_response('London', ['Paris', 'Thames'], 2))
+    api.add(dict(params, titles='Paris (band)'), links_response('Paris (band)', ['Rock music'], 3))
+    settings.OFFLINE = False
+    settings.REPLAYING = False
+    settings.SESSION = StandInSession(api)
+    candidates = {'paris': ['Paris', 'Paris (band)'], 'london': ['London'], 'nowhere': None}
+    monkeypatch.setattr(corpus, 'fetch_candidates_dict', lambda mentions: {m: candidates[m] for m in mentions})
+    return api
+
+
+@pytest.mark.parametrize('mode', ['links', 'probe'])
+def test_corpus_store_holds_only_candidates(standin, mode):
+    settings.EDGE_MODE = mode
+    store = corpus.CorpusStore.build([['paris', 'london'], ['london', 'nowhere']], chunk_size=1)
+    table = store.table
+    #links to pages which aren't candidates are never interned
+    assert len(table) == 3
+    assert table.titles(store.links['Paris']) == ['London']
+    assert table.titles(store.links['London']) == ['Paris']
+    assert table.titles(store.links['Paris (band)']) == []
+    assert store.candidates['nowhere'] is None
+    #and the raw link lists and responses aren't kept in memory
+    assert known_links('Paris') is None
+    assert settings.MEMORY_CACHE.stats()['size'] == 0
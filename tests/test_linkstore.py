@@ -0,0 +1,52 @@
+import numpy as np
+
+from linkstore import LinkStore, TitleIndex
+
+
+def test_title_index_lookup():
+    index = TitleIndex.build(['Paris', 'Berlin', 'París', 'Paris, Texas'])
+    assert [index[i] for i in range(len(index))] == ['Berlin', 'Paris', 'Paris, Texas', 'París']
+    assert index.lookup('Paris, Texas') == 2
+    assert index.lookup('London') is None
+    assert [index[i] for i in index.prefix_range('Paris')] == ['Paris', 'Paris, Texas']
+
+
+def test_links(link_store):
+    assert link_store.links('Paris') == ['Berlin', 'France', 'French Republic', 'London']
+    assert link_store.links('Paris (band)') == ['London', 'Rock music']
+    assert link_store.links('Rock music') == []
+    assert link_store.links('Missing page') == []
+
+
+def test_link_ids_are_sorted(link_store):
+    for i in range(len(link_store.titles)):
+        ids = np.asarray(link_store.link_ids(i))
+        assert np.all(ids[1:] > ids[:-1])
+
+
+def test_has_link(link_store):
+    assert link_store.has_link('Paris', 'London')
+    assert link_store.has_link('London', 'Paris')
+    assert not link_store.has_link('Paris (band)', 'Paris')
+    assert not link_store.has_link('Paris', 'Missing page')
+
+
+def test_other_namespaces_are_skipped(link_store):
+    assert link_store.title_id('Capitals in Europe') is None
+    #the only link from the category page is to Paris
+    assert link_store.backlink_count('Paris') == 3
+
+
+def test_pages_and_redirects(link_store):
+    assert link_store.backlink_count('France') == 4
+    assert link_store.backlink_count('Missing page') == 0
+    assert link_store.has_page('Paris, Texas')
+    assert not link_store.has_page('Rock music')
+    assert link_store.get_redirect('French Republic') == 'France'
+    assert link_store.get_redirect('UK') == 'United Kingdom'
+    assert link_store.get_redirect('Paris') is None
+
+
+def test_reopen(link_store):
+    store = LinkStore(link_store.directory)
+    assert store.links('London') == ['Paris', 'United Kingdom']
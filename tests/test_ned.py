@@ -0,0 +1,108 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+import settings
+import wiki
+import ppr
+from titles import title_table
+
+
+MENTIONS = ['Paris', 'London', 'France', 'UK', 'Nowhere']
+TITLES = ['Title {0}'.format(i) for i in range(12)]
+
+
+@pytest.fixture
+def offline_stores(offline, link_store, candidate_index):
+    '''
+    offline settings which read links and candidates from the
+    fixture link store and candidate index, so ned makes no requests
+    '''
+    settings.LINK_STORE = link_store
+    settings.CANDIDATE_INDEX = candidate_index
+    return settings
+
+
+@pytest.mark.parametrize('concurrency', [1, 4])
+@pytest.mark.parametrize('mode', ['links', 'probe', 'adaptive'])
+def test_ned_in_each_edge_mode(offline_stores, mode, concurrency):
+    settings.EDGE_MODE = mode
+    settings.CONCURRENCY = concurrency
+    disambiguations = ppr.ned(MENTIONS)
+    settings.EDGE_MODE = 'links'
+    assert disambiguations == ppr.ned(MENTIONS)
+    assert disambiguations['Paris'] == 'Paris'
+    assert disambiguations['UK'] == 'United Kingdom'
+
+
+def test_probe_links_reads_the_link_store(offline_stores):
+    table = title_table(settings.LINK_STORE)
+    links_dict = wiki.probe_links(['Paris', 'Paris (band)', 'Paris, Texas'], ['London', 'France', 'Nowhere'], table)
+    assert set(table.titles(links_dict['Paris'])) == {'London', 'France'}
+    assert table.titles(links_dict['Paris (band)']) == ['London']
+    assert len(links_dict['Paris, Texas']) == 0
+
+
+def random_graph(rng, table):
+    '''
+    a graph of up to six mentions with random candidates, which
+    mentions may share, and random links between the candidates
+    and to pages outside the graph
+    '''
+    G = nx.Graph()
+    for m in range(rng.integers(1, 7)):
+        candidates = rng.choice(TITLES, rng.integers(1, 6), replace=False).tolist()
+        ppr.add_candidates('mention {0}'.format(m), candidates, G, table)
+    outside = ['Elsewhere {0}'.format(i) for i in range(5)]
+    links_dict = {}
+    for title in TITLES:
+        links = rng.choice(TITLES + outside, rng.integers(0, 8), replace=False).tolist()
+        links_dict[title] = table.link_ids(links)
+    return G, links_dict
+
+
+def loop_edges(G, links_dict, table):
+    #the pairwise loop add_edges used before build_adjacency
+    edges = set()
+    for u in G.nodes():
+        for v in G.nodes():
+            if G.nodes[u]['mention'] != G.nodes[v]['mention']:
+                if wiki.check_edge(G.nodes[u]['candidate'], G.nodes[v]['candidate'], links_dict, table):
+                    edges.add((u, v))
+    return edges
+
+
+def loop_scores(G, S):
+    #the loop compute_final_scores used before final_scores
+    scores = []
+    for i in range(S.shape[0]):
+        mention_max_scores = {}
+        for j in range(S.shape[0]):
+            mention = G.nodes[j]['mention']
+            if mention != G.nodes[i]['mention']:
+                if mention not in mention_max_scores or S[i, j] > mention_max_scores[mention]:
+                    mention_max_scores[mention] = S[i, j]
+        scores.append(sum(mention_max_scores.values()))
+    return np.array(scores)
+
+
+def test_vectorized_graph_matches_loops(offline):
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        table = title_table()
+        G, links_dict = random_graph(rng, table)
+        A = ppr.build_adjacency(G, links_dict)
+        assert set(zip(*A.nonzero())) == loop_edges(G, links_dict, table)
+        assert np.all(A.data == 1)
+
+        S = rng.random((G.number_of_nodes(), G.number_of_nodes()))
+        mention_ids, _ = ppr.get_mention_ids(G)
+        assert np.allclose(ppr.final_scores(S, mention_ids), loop_scores(G, S))
+
+
+@pytest.mark.parametrize('engine', ['power', 'push'])
+@pytest.mark.parametrize('mentions', [MENTIONS, MENTIONS[:1], []])
+def test_analyse_arrays_matches_analyse_graph(offline_stores, engine, mentions):
+    G, links_dict, backlinks_count_dict = ppr.build_graph(mentions)
+    tied = ppr.analyse_arrays([ppr.graph_arrays(G)], engine)[0]
+    assert ppr.resolve_ties(tied) == ppr.analyse_graph(G, links_dict, backlinks_count_dict, engine)
@@ -0,0 +1,73 @@
+import numpy as np
+import scipy.sparse as sp
+import pytest
+
+from pagerank import transition_matrix, power_ppr, component_ppr, push_ppr, block_ppr, block_batches
+
+
+def adjacency(n, edges):
+    rows = [u for u, v in edges] + [v for u, v in edges]
+    cols = [v for u, v in edges] + [u for u, v in edges]
+    return sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+
+
+#a triangle with a tail, a separate pair and an isolated node
+EDGES = [(0, 1), (1, 2), (2, 0), (2, 3), (4, 5)]
+A = adjacency(7, EDGES)
+
+
+def exact_ppr(A, sources=None):
+    S, _ = power_ppr(transition_matrix(A), 0.85, tol=1e-12, max_iterations=1000, sources=sources)
+    return S
+
+
+def test_power_ppr_columns_are_restart_distributions():
+    S = exact_ppr(A)
+    assert np.allclose(S.sum(axis=0)[:6], 1)
+    assert S[6, 6] == pytest.approx(0.15)
+    assert S[0, 0] > S[1, 0] > 0
+    assert S[4, 0] == pytest.approx(0, abs=1e-9)
+
+
+def test_component_ppr_matches_power_ppr():
+    S, iterations = component_ppr(A, 0.85, tol=1e-12, max_iterations=1000)
+    assert np.allclose(S, exact_ppr(A), atol=1e-10)
+    assert iterations > 1
+
+
+def test_component_ppr_in_threads():
+    S, _ = component_ppr(A, 0.85, tol=1e-12, max_iterations=1000, workers=4)
+    assert np.allclose(S, exact_ppr(A), atol=1e-10)
+
+
+@pytest.mark.parametrize('epsilon', [1e-2, 1e-3, 1e-5])
+def test_push_ppr_underestimates_power_ppr(epsilon):
+    exact = exact_ppr(A)
+    S, pushes = push_ppr(A, 0.85, epsilon)
+    degrees = np.asarray(A.sum(axis=1)).ravel()
+    assert pushes >= A.shape[0]
+    assert np.all(S <= exact + 1e-12)
+    assert np.all(exact - S <= epsilon * np.maximum(degrees, 1)[:, None])
+
+
+def test_push_ppr_sources():
+    S, _ = push_ppr(A, 0.85, 1e-6, sources=[3, 0])
+    assert np.allclose(S, exact_ppr(A, sources=[3, 0]), atol=1e-5)
+
+
+def test_block_ppr_matches_power_ppr():
+    adjacencies = [A, adjacency(3, [(0, 1), (1, 2)]), adjacency(0, []), adjacency(1, [])]
+    scores, _ = block_ppr(adjacencies, 0.85, tol=1e-12, max_iterations=1000)
+    assert [S.shape for S in scores] == [(7, 7), (3, 3), (0, 0), (1, 1)]
+    for S, B in zip(scores, adjacencies):
+        if B.shape[0]:
+            assert np.allclose(S, exact_ppr(B), atol=1e-10)
+
+
+def test_block_batches_cover_every_graph():
+    sizes = [5, 300, 2, 40, 40, 1]
+    batches = block_batches(sizes, max_cells=2000)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(sizes)))
+    for batch in batches:
+        if len(batch) > 1:
+            assert sum(sizes[i] for i in batch) * max(sizes[i] for i in batch) <= 2000
@@ -0,0 +1,81 @@
+import pytest
+
+from request_cache import RequestCache, MemoryCache, import_json, export_json, open_cache
+import wiki
+
+
+def test_put_and_get(tmp_path):
+    cache = RequestCache(str(tmp_path / 'cache.sqlite'))
+    params = {'action': 'query', 'titles': 'Paris'}
+    assert cache.get(params) is None
+    cache.put(params, {'query': {'pages': {}}})
+    assert cache.get(params) == {'query': {'pages': {}}}
+    assert len(cache) == 1
+
+
+def test_json_round_trip(tmp_path):
+    cache = RequestCache(str(tmp_path / 'cache.sqlite'))
+    cache.put({'action': 'query', 'titles': 'Paris'}, {'batchcomplete': ''})
+    cache.put({'backlinks': 'Paris', 'lang': 'en'}, 3)
+    assert export_json(cache, str(tmp_path / 'all.json')) == 2
+
+    copy = open_cache(str(tmp_path / 'copy.sqlite'), str(tmp_path / 'all.json'))
+    assert dict(copy.items()) == dict(cache.items())
+
+
+def test_import_json_replace(tmp_path):
+    paris = {'action': 'query', 'titles': 'Paris'}
+    london = {'action': 'query', 'titles': 'London'}
+    source = RequestCache(str(tmp_path / 'source.sqlite'))
+    source.put(paris, {'new': True})
+    source.put(london, {'new': True})
+    export_json(source, str(tmp_path / 'all.json'))
+
+    cache = RequestCache(str(tmp_path / 'cache.sqlite'))
+    cache.put(paris, {'new': False})
+    assert import_json(cache, str(tmp_path / 'all.json'), replace=False) == 2
+    assert cache.get(paris) == {'new': False}
+    assert cache.get(london) == {'new': True}
+    import_json(cache, str(tmp_path / 'all.json'), replace=True)
+    assert cache.get(paris) == {'new': True}
+
+
+def test_memory_cache_evicts_least_recent():
+    cache = MemoryCache(maxsize=2, ttl=None)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_derived_values_replay_from_json(offline, tmp_path):
+    offline.CACHE.put({'pageviews': wiki.pageviews_url('Paris')}, 120)
+    offline.CACHE.put({'backlinks': 'Paris', 'lang': 'en', 'limit': wiki.MAX_BACKLINKS}, 7)
+    export_json(offline.CACHE, str(tmp_path / 'all.json'))
+    offline.CACHE.close()
+
+    offline.CACHE = open_cache(str(tmp_path / 'replay.sqlite'), str(tmp_path / 'all.json'))
+    offline.MEMORY_CACHE.clear()
+    assert wiki.get_pageviews_batch(['Paris']) == {'Paris': 120}
+    assert wiki.get_backlink_counts(['Paris']) == {'Paris': 7}
+    with pytest.raises(LookupError):
+        wiki.get_pageviews_batch(['London'])
+
+
+def test_seed_keeps_newer_responses(tmp_path):
+    legacy = RequestCache(str(tmp_path / 'legacy.sqlite'))
+    legacy.put({'titles': 'Paris'}, 'old')
+    legacy.put({'titles': 'London'}, 'old')
+    export_json(legacy, str(tmp_path / 'all.json'))
+
+    cache = RequestCache(str(tmp_path / 'cache.sqlite'))
+    cache.put({'titles': 'Paris'}, 'new')
+    cache.close()
+    #an existing database is only seeded when asked to be
+    assert len(open_cache(str(tmp_path / 'cache.sqlite'), str(tmp_path / 'all.json'))) == 1
+    cache = open_cache(str(tmp_path / 'cache.sqlite'), str(tmp_path / 'all.json'), seed=True)
+    assert cache.get({'titles': 'Paris'}) == 'new'
+    assert cache.get({'titles': 'London'}) == 'old'
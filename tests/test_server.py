@@ -0,0 +1,38 @@
+import logging
+
+import pytest
+
+import settings
+import server
+from metrics import Metrics
+
+
+def fake_ned_batch(documents):
+    '''
+    disambiguate each mention as itself, failing on a mention of "bad"
+    '''
+    if any('bad' in mentions for mentions in documents):
+        raise ValueError('bad mention')
+    return [{m: m for m in mentions} for mentions in documents]
+
+
+@pytest.fixture
+def batcher(monkeypatch):
+    monkeypatch.setattr(server, 'ned_batch', fake_ned_batch)
+    monkeypatch.setattr(settings, 'METRICS', Metrics())
+    settings.logger.setLevel(logging.CRITICAL)
+    return server.Batcher(max_batch_size=3, wait=1)
+
+
+def test_batch(batcher):
+    futures = [batcher.submit(['a']), batcher.submit(['b', 'c'])]
+    assert [f.result(timeout=5) for f in futures] == [{'a': 'a'}, {'b': 'b', 'c': 'c'}]
+
+
+def test_failed_batch_only_fails_bad_documents(batcher):
+    futures = [batcher.submit(['a']), batcher.submit(['bad']), batcher.submit(['c'])]
+    assert futures[0].result(timeout=5) == {'a': 'a'}
+    with pytest.raises(ValueError):
+        futures[1].result(timeout=5)
+    assert futures[2].result(timeout=5) == {'c': 'c'}
+    assert settings.METRICS.total('batch_retries') == 1
@@ -0,0 +1,83 @@
+import pytest
+
+import settings
+import wiki
+from standin import StandInAPI, StandInSession
+
+
+def links_response(title, links, page_id, cont=None):
+    data = {'query': {'pages': {str(page_id): {'pageid': page_id, 'ns': 0, 'title': title,
+        'links': [{'ns': 0, 'title': link} for link in links]}}}}
+    if cont is not None:
+        data['continue'] = {'plcontinue': cont, 'continue': '||'}
+    return data
+
+
+@pytest.fixture
+def api():
+    api = StandInAPI()
+    links = {'action': 'query', 'format': 'json', 'prop': 'links', 'pllimit': '500'}
+    api.add(dict(links, titles='Paris'), links_response('Paris', ['Berlin', 'France'], 1, '1|0|London'))
+    api.add(dict(links, titles='Paris', plcontinue='1|0|London'), links_response('Paris', ['London'], 1))
+    api.add(dict(links, titles='london'), {'query': {'normalized': [{'from': 'london', 'to': 'London'}],
+        'pages': {'2': {'pageid': 2, 'ns': 0, 'title': 'London', 'links': [{'ns': 0, 'title': 'Paris'}]}}}})
+    api.add({'action': 'query', 'format': 'json', 'redirects': '', 'titles': 'UK'}, {'query': {
+        'redirects': [{'from': 'UK', 'to': 'United Kingdom'}],
+        'pages': {'3': {'pageid': 3, 'ns': 0, 'title': 'United Kingdom'}}}})
+    api.add({'action': 'query', 'format': 'json', 'prop': 'categories', 'titles': 'Paris (band)',
+        'clcategories': 'Category:Disambiguation pages'}, {'query': {'pages': {'4': {'pageid': 4, 'ns': 0,
+        'title': 'Paris (band)', 'categories': [{'ns': 14, 'title': 'Category:Disambiguation pages'}]}}}})
+    api.add({'action': 'query', 'format': 'json', 'list': 'backlinks', 'bltitle': 'Paris', 'bllimit': '500'},
+        {'query': {'backlinks': [{'title': 'London'}, {'title': 'Berlin'}, {'title': 'France'}]}})
+    return api
+
+
+@pytest.fixture
+def standin(offline, api, monkeypatch):
+    settings.OFFLINE = False
+    settings.REPLAYING = False
+    settings.SESSION = StandInSession(api)
+    return api
+
+
+def test_continuations_are_joined(api):
+    assert api.links['Paris'] == ['Berlin', 'France', 'London']
+
+
+def test_batched_links(standin):
+    pages, resolved = wiki.query_pages(['Paris', 'london', 'Nowhere'], {'prop': 'links', 'pllimit': '2'})
+    assert [l['title'] for l in pages['Paris']['links']] == ['Berlin', 'France', 'London']
+    assert [l['title'] for l in pages['London']['links']] == ['Paris']
+    assert resolved['london'] == 'London'
+    assert 'missing' in pages['Nowhere']
+    assert standin.unknown_titles == {'Nowhere'}
+
+
+def test_probed_links(standin):
+    params = {'action': 'query', 'format': 'json', 'prop': 'links', 'pllimit': '500',
+        'titles': 'Paris|London', 'pltitles': 'London|Paris'}
+    pages = standin.query(params)['query']['pages']
+    assert pages['1']['links'] == [{'ns': 0, 'title': 'London'}]
+    assert pages['2']['links'] == [{'ns': 0, 'title': 'Paris'}]
+
+
+def test_redirects_and_categories(standin):
+    assert wiki.get_redirects(['UK', 'Paris']) == {'UK': 'United Kingdom', 'Paris': None}
+    assert wiki.are_disambiguation_pages(['Paris (band)', 'Paris']) == {'Paris (band)': True, 'Paris': False}
+
+
+def test_backlink_counts(standin):
+    assert wiki.count_backlinks_batch(['Paris', 'London']) == {'Paris': 3, 'London': 0}
+    assert wiki.count_backlinks_batch(['Paris'], limit=2) == {'Paris': 2}
+
+
+def test_covers(api):
+    assert api.covers(['Paris', 'UK'])
+    assert not api.covers(['Paris', 'Berlin'])
+
+
+def test_other_requests_are_refused(api):
+    with pytest.raises(LookupError):
+        api.query({'action': 'parse', 'page': 'Paris'})
+    with pytest.raises(LookupError):
+        StandInSession(api).get(url='https://wikimedia.org/api/rest_v1/metrics')
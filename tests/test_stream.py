@@ -0,0 +1,57 @@
+import json
+import logging
+
+import settings
+from ppr import completed_ids
+
+
+def write_lines(path, lines):
+    with open(path, 'w') as fw:
+        fw.write(''.join(lines))
+
+
+def line(result):
+    return json.dumps(result) + '\n'
+
+
+def test_missing_file(tmp_path):
+    assert completed_ids(str(tmp_path / 'results.jsonl')) == set()
+
+
+def test_failed_documents_are_not_completed(tmp_path):
+    path = str(tmp_path / 'results.jsonl')
+    lines = [line({'id': 'a', 'disambiguations': {}}), line({'id': 'b', 'error': 'failed'})]
+    write_lines(path, lines)
+    assert completed_ids(path) == {'a'}
+    with open(path) as fr:
+        assert fr.read() == ''.join(lines)
+
+
+def test_partly_written_line_is_cut_off(tmp_path):
+    path = str(tmp_path / 'results.jsonl')
+    first = line({'id': 'a', 'disambiguations': {}})
+    write_lines(path, [first, '{"id": "b", "disamb'])
+    assert completed_ids(path) == {'a'}
+    with open(path) as fr:
+        assert fr.read() == first
+
+
+def test_unreadable_line_is_cut_off(tmp_path, caplog, monkeypatch):
+    path = str(tmp_path / 'results.jsonl')
+    first = line({'id': 'a', 'disambiguations': {}})
+    write_lines(path, [first, '{"id": "b", "disamb\n', line({'id': 'c', 'disambiguations': {}})])
+    monkeypatch.setattr(settings.logger, 'propagate', True)
+    with caplog.at_level(logging.WARNING, logger=settings.logger.name):
+        assert completed_ids(path) == {'a'}
+    assert 'line 2' in caplog.text
+    with open(path) as fr:
+        assert fr.read() == first
+
+
+def test_line_without_an_id_is_cut_off(tmp_path):
+    path = str(tmp_path / 'results.jsonl')
+    first = line({'id': 'a', 'disambiguations': {}})
+    write_lines(path, [first, line({'disambiguations': {}}), line(['c'])])
+    assert completed_ids(path) == {'a'}
+    with open(path) as fr:
+        assert fr.read() == first
@@ -0,0 +1,46 @@
+import numpy as np
+
+from titles import TitleTable, StoreTitleTable, KnownTitles, title_table, has_id
+
+
+def test_title_table():
+    table = TitleTable()
+    assert table.ids(['b', 'a', 'b']).tolist() == [0, 1, 0]
+    assert table.lookup('a') == 1
+    assert table.lookup('c') is None
+    assert table.titles([1, 0]) == ['a', 'b']
+    assert table.link_ids(['b', 'a', 'b']).tolist() == [0, 1]
+    assert len(table) == 2
+
+
+def test_known_titles_ignores_new_titles():
+    table = TitleTable()
+    table.ids(['b', 'a'])
+    known = KnownTitles(table)
+    assert known.link_ids(['c', 'a', 'b', 'a']).tolist() == [0, 1]
+    assert known.link_ids(['c']).tolist() == []
+    assert known.lookup('c') is None
+    assert len(known) == len(table) == 2
+
+
+def test_store_title_table_uses_store_ids(link_store):
+    table = title_table(link_store)
+    assert isinstance(table, StoreTitleTable)
+    paris = link_store.title_id('Paris')
+    assert table.id('Paris') == table.lookup('Paris') == paris
+    assert table.title(paris) == 'Paris'
+    #the store's link arrays are already in the table's ids
+    assert table.titles(link_store.link_ids(paris)) == link_store.links('Paris')
+
+
+def test_store_title_table_titles_outside_the_store(link_store):
+    table = title_table(link_store)
+    assert table.lookup('Nowhere') is None
+    nowhere = table.id('Nowhere')
+    assert nowhere < 0
+    assert table.id('Nowhere') == table.lookup('Nowhere') == nowhere
+    assert table.title(nowhere) == 'Nowhere'
+    assert table.id('Elsewhere') == nowhere - 1
+    ids = table.link_ids(['London', 'Nowhere'])
+    assert has_id(ids, nowhere) and has_id(ids, link_store.title_id('London'))
+    assert np.all(ids[1:] > ids[:-1])
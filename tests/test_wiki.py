@@ -0,0 +1,408 @@
+import math
+import threading
+import time
+
+import pytest
+import requests
+
+import settings
+import wiki
+import ppr
+from titles import title_table
+
+API_URL = 'https://en.wikipedia.org/w/api.php'
+
+
+class LinksHere:
+    '''
+    answers prop=linkshere queries for pages with a given number
+    of backlinks, continuing in order of page id as the API does
+    '''
+    def __init__(self, backlinks):
+        self.backlinks = backlinks
+        self.page_ids = {title: i + 1 for i, title in enumerate(sorted(backlinks))}
+        self.requests = []
+
+    def __call__(self, params):
+        self.requests.append(params)
+        limit = int(params['lhlimit'])
+        titles = sorted(params['titles'].split('|'), key=lambda t: self.page_ids.get(t, 0))
+        rows = [(self.page_ids[t], j) for t in titles if t in self.page_ids for j in range(self.backlinks[t])]
+        start = 0
+        if 'lhcontinue' in params:
+            start = rows.index(tuple(int(x) for x in params['lhcontinue'].split('|')))
+        pages = {}
+        for i, title in enumerate(titles):
+            if title in self.page_ids:
+                pages[str(self.page_ids[title])] = {'pageid': self.page_ids[title], 'title': title}
+            else:
+                pages[str(-1 - i)] = {'title': title, 'missing': ''}
+        by_id = {page.get('pageid'): page for page in pages.values()}
+        for page_id, j in rows[start:start + limit]:
+            by_id[page_id].setdefault('linkshere', []).append({'pageid': 1000 + j})
+        data = {'query': {'pages': pages}}
+        if start + limit < len(rows):
+            data['continue'] = {'lhcontinue': '{0}|{1}'.format(*rows[start + limit]), 'continue': '||'}
+        return data
+
+
+def test_count_backlinks_batch(monkeypatch):
+    api = LinksHere({'Paris': 1200, 'Texas': 3, 'Berlin': 0})
+    monkeypatch.setattr(wiki, 'make_mw_request', api)
+    counts = wiki.count_backlinks_batch(['Paris', 'Texas', 'Berlin', 'Nowhere'])
+    assert counts == {'Paris': 1200, 'Texas': 3, 'Berlin': 0, 'Nowhere': 0}
+
+
+def test_count_backlinks_batch_stops_at_limit(monkeypatch):
+    api = LinksHere({'Berlin': 10, 'France': 100000, 'Paris': 20, 'Texas': 700})
+    monkeypatch.setattr(wiki, 'make_mw_request', api)
+    counts = wiki.count_backlinks_batch(['Berlin', 'France', 'Paris', 'Texas'], limit=1000)
+    assert counts == {'Berlin': 10, 'France': 1000, 'Paris': 20, 'Texas': 700}
+    #France is dropped once it reaches the limit, and the query restarted for Paris and Texas
+    assert len(api.requests) == 5
+    assert api.requests[-2]['titles'] == 'Paris|Texas'
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, data=None, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._data = data
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(str(self.status_code))
+
+
+class FakeSession:
+    '''
+    returns the given responses in order, recording the
+    most requests it was sent at once
+    '''
+    def __init__(self, responses=(), delay=0):
+        self.responses = list(responses)
+        self.delay = delay
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def get(self, url=None, params=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        if self.delay:
+            time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+        if self.responses:
+            return self.responses.pop(0)
+        return FakeResponse(data={'ok': True})
+
+
+@pytest.fixture
+def sleeps(offline, monkeypatch):
+    delays = []
+    monkeypatch.setattr(wiki.time, 'sleep', delays.append)
+    return delays
+
+
+def test_get_json_retries(sleeps):
+    session = FakeSession([
+        FakeResponse(429, headers={'Retry-After': '3'}),
+        FakeResponse(503),
+        FakeResponse(data={'error': {'code': 'maxlag'}}),
+        FakeResponse(data={'ok': True}),
+    ])
+    assert wiki.get_json(API_URL, session=session) == {'ok': True}
+    assert session.calls == 4
+    #Retry-After is obeyed, and otherwise the delay doubles
+    assert sleeps == [3.0, wiki.BACKOFF_SECONDS * 2, wiki.BACKOFF_SECONDS * 4]
+
+
+def test_get_json_retry_after_is_capped(sleeps):
+    session = FakeSession([FakeResponse(429, headers={'Retry-After': '3600'}),
+        FakeResponse(429, headers={'Retry-After': 'soon'})])
+    wiki.get_json(API_URL, session=session)
+    assert sleeps == [wiki.MAX_BACKOFF_SECONDS, wiki.BACKOFF_SECONDS * 2]
+
+
+def test_get_json_gives_up(sleeps):
+    session = FakeSession([FakeResponse(502)] * (wiki.MAX_RETRIES + 2))
+    with pytest.raises(requests.HTTPError):
+        wiki.get_json(API_URL, session=session)
+    assert session.calls == wiki.MAX_RETRIES + 1
+    assert len(sleeps) == wiki.MAX_RETRIES
+
+
+def test_get_json_missing(sleeps):
+    session = FakeSession([FakeResponse(404)] * 2)
+    assert wiki.get_json(API_URL, session=session, allow_missing=True) is None
+    with pytest.raises(requests.HTTPError):
+        wiki.get_json(API_URL, session=session)
+    assert sleeps == []
+
+
+@pytest.mark.parametrize('limit', [2, 3])
+def test_host_concurrency(offline, limit):
+    offline.HOST_CONCURRENCY = limit
+    session = FakeSession(delay=0.05)
+    results = wiki.parallelise_requests(lambda i: wiki.get_json(API_URL, {'i': i}, session), range(12),
+        max_workers=8)
+    assert len(results) == 12
+    assert session.max_in_flight == limit
+    #other hosts have semaphores of their own
+    session = FakeSession(delay=0.05)
+    urls = [API_URL, 'https://wikimedia.org/api/rest_v1/metrics'] * 4
+    wiki.parallelise_requests(lambda url: wiki.get_json(url, session=session), urls, max_workers=8)
+    assert session.max_in_flight == 2 * limit
+
+
+class Wiki:
+    '''
+    answers title queries about a small wiki, returning links in order
+    of page id then title and continuing with plcontinue as the API
+    does, and only the links to pltitles when they are given
+
+    :param links: dict of title:links pairs of every article
+    :param redirects: dict of title:target pairs of every redirect
+    :param disambiguation: the titles of disambiguation pages
+    '''
+    def __init__(self, links, redirects, disambiguation):
+        self.links = links
+        self.redirects = redirects
+        self.disambiguation = disambiguation
+        self.page_ids = {title: i + 1 for i, title in enumerate(sorted(set(links) | set(redirects)))}
+        self.requests = []
+
+    def page_links(self, title):
+        #the only link on a redirect page is its target
+        if title in self.redirects:
+            return [self.redirects[title]]
+        return sorted(self.links[title])
+
+    def __call__(self, params, memoize=True):
+        self.requests.append(params)
+        query = {}
+        resolved = []
+        for title in params['titles'].split('|'):
+            target = title[:1].upper() + title[1:]
+            if target != title:
+                query.setdefault('normalized', []).append({'from': title, 'to': target})
+            while 'redirects' in params and target in self.redirects:
+                query.setdefault('redirects', []).append({'from': target, 'to': self.redirects[target]})
+                target = self.redirects[target]
+            resolved.append(target)
+        pages = {}
+        for i, title in enumerate(dict.fromkeys(resolved)):
+            if title in self.page_ids:
+                pages[title] = {'pageid': self.page_ids[title], 'ns': 0, 'title': title}
+            else:
+                pages[title] = {'ns': 0, 'title': title, 'missing': ''}
+        props = params.get('prop', '').split('|')
+        if 'categories' in props:
+            for title in self.disambiguation & set(pages):
+                pages[title]['categories'] = [{'ns': 14, 'title': 'Category:Disambiguation pages'}]
+        data = {'batchcomplete': ''}
+        if 'links' in props:
+            found = sorted((page['pageid'], page['title']) for page in pages.values() if 'missing' not in page)
+            rows = [(page_id, title, link) for page_id, title in found for link in self.page_links(title)]
+            if 'pltitles' in params:
+                targets = set(params['pltitles'].split('|'))
+                rows = [row for row in rows if row[2] in targets]
+            start = 0
+            if 'plcontinue' in params:
+                page_id, _, link = params['plcontinue'].split('|', 2)
+                start = [(r[0], r[2]) for r in rows].index((int(page_id), link))
+            limit = int(params.get('pllimit', 10))
+            for _, title, link in rows[start:start + limit]:
+                pages[title].setdefault('links', []).append({'ns': 0, 'title': link})
+            if start + limit < len(rows):
+                data['continue'] = {'plcontinue': '{0}|0|{2}'.format(*rows[start + limit]), 'continue': '||'}
+                del data['batchcomplete']
+        query['pages'] = {str(page.get('pageid', -1 - i)): page for i, page in enumerate(pages.values())}
+        data['query'] = query
+        return data
+
+
+def old_get_candidates(title):
+    '''
+    get_candidates as it was before its queries were combined,
+    asking about one page and one property at a time
+    '''
+    params = {'action': 'query', 'format': 'json', 'titles': title, 'prop': 'categories',
+        'clcategories': wiki.DISAMBIGUATION_CATEGORIES}
+    pages = wiki.make_mw_request(params)['query']['pages']
+    matches_title = any('categories' in page for page in pages.values())
+    search_title = title if matches_title else '{0} (disambiguation)'.format(title)
+    params = {'action': 'query', 'format': 'json', 'prop': 'links', 'titles': search_title, 'pllimit': '500'}
+    pages = wiki.make_mw_request(params)['query']['pages']
+    all_candidates = []
+    for page in pages.values():
+        if 'missing' not in page:
+            for link in page['links']:
+                if title.lower() in link['title'].lower() and 'disambiguation' not in link['title'].lower():
+                    all_candidates.append(link['title'])
+    params = {'action': 'query', 'format': 'json', 'redirects': '', 'titles': title}
+    redirects = wiki.make_mw_request(params)['query'].get('redirects', [])
+    if redirects:
+        all_candidates += [redirects[0]['to']]
+    elif not matches_title:
+        params = {'action': 'query', 'format': 'json', 'titles': title}
+        pages = wiki.make_mw_request(params)['query']['pages']
+        if not any('missing' in page for page in pages.values()) and title not in all_candidates:
+            all_candidates += [title]
+    return all_candidates
+
+
+@pytest.fixture
+def small_wiki(offline, monkeypatch):
+    many = lambda name, n: ['{0} {1:03d}'.format(name, i) for i in range(n)]
+    links = {
+        #articles sorting before their disambiguation page, with enough
+        #links that the combined query has to continue to reach it
+        'Paris': many('Link', 700),
+        'Paris (disambiguation)': ['Berlin', 'Paris', 'Paris (band)', 'Paris, Texas',
+            'Paris (disambiguation) list', 'Plaster of Paris'],
+        'London': many('Link', 520),
+        #more links than are read from a disambiguation page
+        'London (disambiguation)': many('London', 600),
+        'Jordan': ['Jordan (country)', 'Jordan (river)', 'Michael Jordan', 'Sport'],
+        'Mercury': many('Link', 3),
+        'Germany': many('Link', 40),
+        'Germany (disambiguation)': ['East Germany', 'Germany (band)'],
+        'Britain': ['Germany'],
+        'Berlin': ['Germany'],
+    }
+    for title in ['Paris (band)', 'Paris, Texas', 'Plaster of Paris', 'Jordan (country)',
+            'Jordan (river)', 'Michael Jordan', 'Mercury (element)', 'East Germany', 'Germany (band)']:
+        links[title] = []
+    redirects = {
+        'Jordan (disambiguation)': 'Jordan',
+        'Mercury (disambiguation)': 'Mercury (element)',
+        'Deutschland': 'Germany',
+        'UK': 'United Kingdom',
+        'United Kingdom': 'Britain',
+    }
+    api = Wiki(links, redirects, {'Paris (disambiguation)', 'London (disambiguation)', 'Jordan'})
+    monkeypatch.setattr(wiki, 'make_mw_request', api)
+    return api
+
+
+MENTIONS = ['Paris', 'paris', 'London', 'Jordan', 'Jordan (disambiguation)', 'Mercury',
+    'Deutschland', 'Germany', 'UK', 'Berlin', 'Nowhere', 'Paris (band)']
+
+
+def test_get_candidates_matches_old_queries(small_wiki):
+    expected = {mention: old_get_candidates(mention) for mention in MENTIONS}
+    assert expected['Paris'] == ['Paris', 'Paris (band)', 'Paris, Texas', 'Plaster of Paris']
+    #the first links of the disambiguation page, then the exact match
+    assert len(expected['London']) == wiki.DISAMBIGUATION_LINK_LIMIT + 1
+    assert expected['London'][-1] == 'London'
+    assert expected['UK'] == ['United Kingdom']
+    small_wiki.requests.clear()
+    assert {mention: wiki.get_candidates(mention) for mention in MENTIONS} == expected
+    #continuations were followed to reach the disambiguation pages
+    assert any('plcontinue' in params for params in small_wiki.requests)
+
+
+def test_get_candidates_batch_matches_old_queries(small_wiki):
+    expected = {mention: old_get_candidates(mention) for mention in MENTIONS}
+    assert wiki.get_candidates_batch(MENTIONS) == expected
+
+
+def test_top_k_candidates_keeps_order_and_breaks_ties_by_position():
+    popularity = {'Paris (band)': 10, 'Paris': 10, 'Paris, Texas': 10, 'Plaster of Paris': 1}
+    candidates = ['Plaster of Paris', 'Paris (band)', 'Paris', 'Paris, Texas']
+    assert wiki.top_k_candidates('Paris', candidates, 2, popularity=popularity) == ['Paris (band)', 'Paris']
+    assert wiki.top_k_candidates('Paris', candidates, 3, popularity=popularity) == candidates[1:]
+    #candidates without a popularity rank last
+    assert wiki.top_k_candidates('Paris', candidates + ['Paris (film)'], 4, popularity=popularity) == candidates
+
+
+def test_top_k_candidates_with_few_candidates(monkeypatch):
+    def get_popularity(titles, prior):
+        raise AssertionError('popularity is only needed when candidates are dropped')
+    monkeypatch.setattr(wiki, 'get_popularity', get_popularity)
+    assert wiki.top_k_candidates('Paris', ['Paris', 'Paris (band)'], 2) == ['Paris', 'Paris (band)']
+    assert wiki.top_k_candidates('Paris', ['Paris'], 5) == ['Paris']
+    assert wiki.top_k_candidates('Paris', [], 5) == []
+
+
+def test_top_k_candidates_by_similarity():
+    candidates = ['Plaster of Paris', 'Paris, Texas', 'Paris']
+    assert wiki.top_k_candidates('Paris', candidates, 1, prior='similarity') == ['Paris']
+    popularity = {'Plaster of Paris': 10 ** 6, 'Paris, Texas': 10, 'Paris': 10}
+    kept = wiki.top_k_candidates('Paris', candidates, 1, prior='pageviews+similarity', popularity=popularity)
+    assert kept == ['Plaster of Paris']
+
+
+def test_prune_candidates_with_the_configured_prior(offline, monkeypatch):
+    candidates = {
+        'Paris': ['Paris (band)', 'Paris', 'Paris, Texas'],
+        'London': ['London'],
+        'Nowhere': None,
+    }
+    requested = []
+    def get_backlink_counts(titles):
+        requested.append(list(titles))
+        return {'Paris (band)': 50, 'Paris': 9000, 'Paris, Texas': 400}
+    def get_pageviews_batch(titles):
+        raise AssertionError('the backlinks prior never needs pageviews')
+    monkeypatch.setattr(wiki, 'get_backlink_counts', get_backlink_counts)
+    monkeypatch.setattr(wiki, 'get_pageviews_batch', get_pageviews_batch)
+    monkeypatch.setattr(ppr, 'get_candidates_batch', lambda mentions: {m: candidates[m] for m in mentions})
+    settings.CONCURRENCY = 1
+    settings.PRUNE_K = 2
+    settings.PRUNE_PRIOR = 'backlinks'
+    pruned = ppr.fetch_candidates_dict(list(candidates))
+    assert pruned == {'Paris': ['Paris', 'Paris, Texas'], 'London': ['London'], 'Nowhere': None}
+    #popularity is fetched once, for the mentions with candidates to drop
+    assert requested == [['Paris (band)', 'Paris', 'Paris, Texas']]
+
+
+def test_probe_links_follows_continuations(small_wiki, monkeypatch):
+    monkeypatch.setattr(wiki, 'LINKS_PER_REQUEST', 1)
+    monkeypatch.setattr(wiki, 'MAX_PLTITLES', 2)
+    titles = ['Paris (disambiguation)', 'Jordan', 'Germany', 'Deutschland', 'Nowhere']
+    targets = ['Paris', 'Paris (band)', 'Plaster of Paris', 'Berlin', 'Michael Jordan', 'Link 001', 'Germany']
+    table = title_table()
+    links_dict = wiki.probe_links(titles, targets, table)
+    for title in titles:
+        links = small_wiki.page_links(title) if title in small_wiki.page_ids else []
+        assert sorted(table.titles(links_dict[title])) == sorted(set(links) & set(targets))
+    assert table.titles(links_dict['Paris (disambiguation)']) != []
+    assert all(len(params['pltitles'].split('|')) <= 2 for params in small_wiki.requests)
+    assert any('plcontinue' in params for params in small_wiki.requests)
+
+
+def test_probe_links_skips_known_pages(small_wiki):
+    table = title_table()
+    wiki.generate_links_dict(['Jordan'], table)
+    small_wiki.requests.clear()
+    links_dict = wiki.probe_links(['Jordan', 'Germany'], ['Michael Jordan', 'Link 001'], table)
+    assert table.titles(links_dict['Jordan']) == ['Michael Jordan']
+    assert table.titles(links_dict['Germany']) == ['Link 001']
+    assert [params['titles'] for params in small_wiki.requests] == ['Germany']
+
+
+def test_choose_edge_mode(small_wiki):
+    titles = ['Title {0}'.format(i) for i in range(10)]
+    targets = ['Target {0}'.format(i) for i in range(1000)]
+    #fetching every link of the pages is estimated to take this many
+    #requests, and probing takes one for each MAX_PLTITLES targets
+    full_requests = math.ceil(len(titles) * wiki.ESTIMATED_LINKS_PER_PAGE / wiki.LINKS_PER_REQUEST)
+    cutoff = wiki.MAX_PLTITLES * (full_requests - 1)
+    assert wiki.choose_edge_mode(titles, targets[:cutoff]) == 'probe'
+    assert wiki.choose_edge_mode(titles, targets[:cutoff + 1]) == 'links'
+
+    #pages whose links are already known don't count
+    known = ['Paris', 'London', 'Jordan', 'Germany', 'Berlin', 'Britain']
+    wiki.generate_links_dict(known, title_table())
+    assert wiki.choose_edge_mode(known, ['Berlin']) == 'links'
+    assert wiki.choose_edge_mode(known + ['Mercury'], ['Berlin']) == 'links'
+    assert wiki.choose_edge_mode(known + titles, ['Berlin']) == 'probe'
@@ -0,0 +1,151 @@
+'''
+a table interning article titles as integer ids
+
+link lists are stored as sorted arrays of these ids rather than
+lists of strings, so a title linked from many pages is held once,
+and testing whether a page links to a title is a binary search.
+a table is made for each document or batch of documents, so titles
+are only held while they're needed. with an offline link store, the
+store's own ids are used, so its link lists need no interning
+'''
+import threading
+
+import numpy as np
+
+
+class TitleTable:
+    '''
+    a thread-safe mapping between titles and ids, which are
+    assigned in order as titles are first seen
+    '''
+    def __init__(self):
+        self._ids = {}
+        self._titles = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._titles)
+
+    def id(self, title):
+        '''
+        return the id of a title, assigning one if it's new
+        '''
+        i = self._ids.get(title)
+        if i is None:
+            with self._lock:
+                i = self._ids.get(title)
+                if i is None:
+                    i = len(self._titles)
+                    self._titles.append(title)
+                    self._ids[title] = i
+        return i
+
+    def lookup(self, title):
+        '''
+        return the id of a title, or None if it has never been seen
+        '''
+        return self._ids.get(title)
+
+    def title(self, i):
+        return self._titles[i]
+
+    def titles(self, ids):
+        return [self.title(i) for i in ids]
+
+    def ids(self, titles):
+        '''
+        return an array of the ids of titles, in the same order
+        '''
+        titles = list(titles)
+        return np.fromiter((self.id(t) for t in titles), dtype=np.int32, count=len(titles))
+
+    def link_ids(self, titles):
+        '''
+        return the sorted, unique ids of titles, the form link
+        lists are stored in
+        '''
+        return np.unique(self.ids(titles))
+
+
+class StoreTitleTable(TitleTable):
+    '''
+    a title table using the ids of a link store, so the link id
+    arrays of the store can be used as they are. titles which
+    aren't in the store are given negative ids as they are first seen
+
+    :param store: a LinkStore
+    '''
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+
+    def __len__(self):
+        return len(self.store.titles) + len(self._titles)
+
+    def id(self, title):
+        i = self.store.title_id(title)
+        if i is None:
+            i = -1 - super().id(title)
+        return i
+
+    def lookup(self, title):
+        i = self.store.title_id(title)
+        if i is None:
+            i = super().lookup(title)
+            if i is not None:
+                i = -1 - i
+        return i
+
+    def title(self, i):
+        if i < 0:
+            return self._titles[-1 - i]
+        return self.store.titles[i]
+
+
+class KnownTitles:
+    '''
+    a read-only view of a title table which knows only the titles
+    already in it. link_ids leaves out every other title rather than
+    interning it, so links outside a fixed set of titles, such as the
+    candidates of a corpus, are never held
+
+    :param table: the TitleTable to look titles up in
+    '''
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return len(self.table)
+
+    def lookup(self, title):
+        return self.table.lookup(title)
+
+    def title(self, i):
+        return self.table.title(i)
+
+    def titles(self, ids):
+        return self.table.titles(ids)
+
+    def link_ids(self, titles):
+        '''
+        return the sorted, unique ids of the known titles among titles
+        '''
+        ids = (self.table.lookup(t) for t in titles)
+        return np.unique(np.fromiter((i for i in ids if i is not None), dtype=np.int32))
+
+
+def title_table(store=None):
+    '''
+    return a new title table, using the ids of a link store if given
+    '''
+    if store is None:
+        return TitleTable()
+    return StoreTitleTable(store)
+
+
+def has_id(ids, i):
+    '''
+    determine if a sorted array of ids contains an id
+    '''
+    j = np.searchsorted(ids, i)
+    return bool(j < len(ids) and ids[j] == i)
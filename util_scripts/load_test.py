@@ -0,0 +1,98 @@
+'''
+script that sends documents to a running server.py from many
+threads at once, and reports the latency and throughput
+
+documents are read from CoreNLP json files, or from a text file
+with the mentions of one document per line, separated by tabs
+
+run like:
+python load_test.py demo/tokenized/en/*.json -n 200 -c 16
+python load_test.py mentions.txt --url http://127.0.0.1:8080
+'''
+import sys
+import json
+import time
+import argparse
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def read_documents(paths):
+    '''
+    return a list of request bodies, one per document
+    '''
+    documents = []
+    for path in paths:
+        if path.endswith('.json'):
+            with open(path) as fr:
+                documents.append(json.load(fr))
+        else:
+            with open(path) as fr:
+                for line in fr:
+                    mentions = [m for m in line.rstrip('\n').split('\t') if m]
+                    if mentions:
+                        documents.append({'mentions': mentions})
+    return documents
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def run(url, documents, requests_count, concurrency):
+    '''
+    send requests_count requests, cycling through the documents,
+    with concurrency requests in flight. returns the latencies of
+    the successful requests, the number of failures and the wall time
+    '''
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(
+        pool_connections=concurrency, pool_maxsize=concurrency))
+
+    def send(document):
+        start = time.perf_counter()
+        r = session.post(url, json=document)
+        return r.status_code == 200, time.perf_counter() - start
+
+    bodies = list(itertools.islice(itertools.cycle(documents), requests_count))
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as e:
+        results = list(e.map(send, bodies))
+    seconds = time.perf_counter() - start
+    latencies = [latency for ok, latency in results if ok]
+    return latencies, len(results) - len(latencies), seconds
+
+
+def setup_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+',
+        help='CoreNLP json files, or text files of tab-separated mentions')
+    parser.add_argument('--url', default='http://127.0.0.1:8080',
+        help='the address of the server')
+    parser.add_argument('-n', '--requests', type=int, default=100,
+        help='the number of requests to send')
+    parser.add_argument('-c', '--concurrency', type=int, default=8,
+        help='the number of requests in flight at once')
+    return parser
+
+
+def main():
+    args = setup_parser().parse_args()
+    documents = read_documents(args.paths)
+    if not documents:
+        sys.exit('no documents found')
+    latencies, failures, seconds = run(args.url.rstrip('/') + '/disambiguate',
+        documents, args.requests, args.concurrency)
+    print('{0} requests in {1:.2f}s ({2:.1f} requests/s), {3} failed'.format(
+        len(latencies) + failures, seconds, (len(latencies) + failures) / seconds, failures))
+    for p in [50, 90, 99]:
+        print('p{0} latency: {1:.1f}ms'.format(p, 1000 * percentile(latencies, p)))
+
+
+if __name__ == '__main__':
+    main()
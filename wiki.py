@@ -2,37 +2,131 @@ import requests
 import os.path as op
 import vcr
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse, quote
+import threading
+import time
+import math
+import heapq
+from difflib import SequenceMatcher
 import json
-import re
+
+import numpy as np
 
 import settings
+from request_cache import memory_key, make_key
+from titles import has_id
+
+#the most titles the API accepts in a single query
+MAX_TITLES = 50
+#the number of links read from a disambiguation page
+DISAMBIGUATION_LINK_LIMIT = 500
+DISAMBIGUATION_CATEGORIES = (
+    'Category:Disambiguation pages|'
+    'Category:All article disambiguation pages|'
+    'Categoría:Wikipedia:Desambiguación'
+)
+#retry settings for failed or throttled requests
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+#seconds of replication lag after which the API asks clients to wait
+MAXLAG = 5
+#backlinks are counted up to this many, which is enough to rank
+#candidates without paging through every backlink of a hub
+MAX_BACKLINKS = 5000
+#the most links returned by a request, and the most pltitles it accepts
+LINKS_PER_REQUEST = 500
+MAX_PLTITLES = 50
+#a rough number of links on an article, used to estimate the
+#cost of fetching full link lists before they are known
+ESTIMATED_LINKS_PER_PAGE = 250
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def host_semaphore(url):
+    '''
+    get the semaphore limiting concurrent requests to the host of a
+    url. semaphores are kept for each limit, so changes to
+    settings.HOST_CONCURRENCY apply to the requests made after them
+    '''
+    key = (urlparse(url).netloc, settings.HOST_CONCURRENCY)
+    with _host_semaphores_lock:
+        if key not in _host_semaphores:
+            _host_semaphores[key] = threading.BoundedSemaphore(settings.HOST_CONCURRENCY)
+        return _host_semaphores[key]
 
-def cache_request(filepath, params, response):
-    if op.isfile(filepath):
-        with open(filepath, 'r') as fr:
-            all_reqs = json.load(fr)
-            all_reqs[json.dumps(params)] = response
-        with open(filepath, 'w') as fw:
-            json.dump(all_reqs, fw)
-    else:
-        all_reqs = {json.dumps(params): response}
-        with open(filepath, 'w') as fw:
-            json.dump(all_reqs, fw)
 
-    
-def retrieve_response(filepath, params):
-    with open(filepath, 'r') as fr:
-        all_reqs = json.load(fr)
-    search_string = json.dumps(params)
-    if search_string in all_reqs:
-        return all_reqs[search_string]
-    return None
+def retry_delay(response, attempt):
+    '''
+    the number of seconds to wait before retrying a request,
+    taken from the Retry-After header if the server sent one
+    and otherwise backing off exponentially
+    '''
+    retry_after = response.headers.get('Retry-After')
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), MAX_BACKOFF_SECONDS)
+        except ValueError:
+            pass
+    return min(BACKOFF_SECONDS * 2 ** attempt, MAX_BACKOFF_SECONDS)
 
 
-def make_mw_request(params):
-    savefile = 'fixtures/cached_requests/all.json'
+def get_json(url, params=None, session=None, allow_missing=False):
+    '''
+    make a GET request and decode the JSON response. at most
+    settings.HOST_CONCURRENCY requests are sent to a host at once,
+    and requests are retried with exponential backoff on 429 and
+    5xx responses and on MediaWiki maxlag errors
+
+    :param url: the url to request
+    :param params: dict of query params
+    :param session: the session to send the request with,
+    defaulting to settings.SESSION
+    :param allow_missing: return None for a 404 response
+    rather than raising an error
+    '''
+    if session is None:
+        session = settings.SESSION
+    semaphore = host_semaphore(url)
+    host = urlparse(url).netloc
+    attempt = 0
+    while True:
+        with semaphore, settings.METRICS.timer('http_request_seconds', host=host):
+            r = session.get(url=url, params=params)
+        settings.METRICS.increment('http_requests', host=host, status=r.status_code)
+        retry = r.status_code == 429 or r.status_code >= 500
+        data = None
+        if allow_missing and r.status_code == 404:
+            return None
+        if not retry:
+            r.raise_for_status()
+            data = r.json()
+            retry = isinstance(data, dict) and data.get('error', {}).get('code') == 'maxlag'
+        if not retry or attempt >= MAX_RETRIES:
+            break
+        delay = retry_delay(r, attempt)
+        settings.logger.warning('retrying request to {0} in {1:.1f}s'.format(url, delay))
+        settings.METRICS.increment('http_retries', host=host)
+        time.sleep(delay)
+        attempt += 1
+    if data is None:
+        r.raise_for_status()
+    return data
+
+
+def make_mw_request(params, memoize=True):
     '''
     make a request to the MediaWiki API
+
+    responses are memoized in memory for the current run,
+    written to the persistent request cache, and read back
+    from it when replaying requests
+
+    :param params: the request params
+    :param memoize: whether to keep the response in memory,
+    which callers reading each response once can turn off
     '''
     '''
     with settings.VCR.use_cassette('fixtures/cassettes/all.yaml'):
@@ -40,51 +134,259 @@ def make_mw_request(params):
         r = settings.SESSION.get(url=url, params=params)
         return r.json()
     '''
+    settings.METRICS.increment('mw_requests')
+    key = memory_key(settings.LANG, params)
+    response = settings.MEMORY_CACHE.get(key)
+    if response is not None:
+        settings.METRICS.increment('memory_cache_hits')
+        return response
+    settings.METRICS.increment('memory_cache_misses')
     url = 'https://{0}.wikipedia.org/w/api.php'.format(settings.LANG)
     if settings.REPLAYING:
-        response = retrieve_response(savefile, params)
+        response = settings.CACHE.get(params)
         if response is not None:
+            settings.METRICS.increment('disk_cache_hits')
+            if memoize:
+                settings.MEMORY_CACHE.put(key, response)
             return response
-    response = settings.SESSION.get(url=url, params=params).json()
-    if (not settings.REPLAYING) and (not settings.PARALLEL):
-        cache_request(savefile, params, response)
+        settings.METRICS.increment('disk_cache_misses')
+    if settings.OFFLINE:
+        raise LookupError('request is not cached: {0}'.format(json.dumps(params)))
+    request_params = dict(params)
+    request_params['maxlag'] = MAXLAG
+    response = get_json(url, request_params)
+    if 'error' not in response:
+        settings.CACHE.put(params, response)
+        if memoize:
+            settings.MEMORY_CACHE.put(key, response)
     return response
 
 
-def parallelise_requests(f, *args):
+def get_cached_values(params_dict):
+    '''
+    look up values derived from requests, such as pageview and
+    backlink counts. these are stored in the request cache under
+    params of their own, alongside the API responses, so they are
+    imported and exported with them. returns a dict of the
+    title:value pairs which are cached in memory or on disk
+
+    :param params_dict: dict of title:params pairs
+    '''
+    values = {}
+    for title, params in params_dict.items():
+        key = memory_key(settings.LANG, params)
+        value = settings.MEMORY_CACHE.get(key)
+        if value is None:
+            value = settings.CACHE.get(params)
+            if value is not None:
+                settings.MEMORY_CACHE.put(key, value)
+        if value is not None:
+            values[title] = value
+    return values
+
+
+def put_cached_values(params_dict, values):
+    '''
+    store values derived from requests in memory and on disk
+
+    :param params_dict: dict of title:params pairs
+    :param values: dict of title:value pairs
+    '''
+    settings.CACHE.put_many((make_key(params_dict[title]), value) for title, value in values.items())
+    for title, value in values.items():
+        settings.MEMORY_CACHE.put(memory_key(settings.LANG, params_dict[title]), value)
+
+
+def chunks(items, size=MAX_TITLES):
+    '''
+    split a list into consecutive lists of at most size items
+    '''
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def merge_pages(pages, new_pages):
+    '''
+    merge pages into a dict of page title:page pairs, extending
+    list properties (links, categories...) of pages already seen
+    in earlier continuations or batches
+
+    :param pages: the dict of page title:page pairs to merge into
+    :param new_pages: iterable of the pages to merge
+    '''
+    for page in new_pages:
+        merged = pages.setdefault(page['title'], {})
+        for key, value in page.items():
+            if isinstance(value, list):
+                merged.setdefault(key, []).extend(value)
+            else:
+                merged[key] = value
+
+
+def run_query(params, needs_continue=None, memoize=True):
+    '''
+    run a query, following continuations and merging the pages
+    of each response. returns the merged pages along with the
+    normalized and redirects mappings from the responses
+
+    :param params: the full query params
+    :param needs_continue: optional function taking the pages,
+    normalized and redirects mappings collected so far and the
+    continue dict of the latest response, returning False if the
+    rest of the results are not needed
+    :param memoize: whether to keep the responses in memory
+    '''
+    pages = {}
+    normalized = {}
+    redirects = {}
+    while True:
+        data = make_mw_request(params, memoize)
+        query = data.get('query', {})
+        for item in query.get('normalized', []):
+            normalized[item['from']] = item['to']
+        for item in query.get('redirects', []):
+            #keep only the first hop of a redirect chain
+            redirects.setdefault(item['from'], item['to'])
+        merge_pages(pages, query.get('pages', {}).values())
+        if 'continue' not in data:
+            break
+        if needs_continue is not None and not needs_continue(pages, normalized, redirects, data['continue']):
+            break
+        params = dict(params)
+        params.update(data['continue'])
+    return pages, normalized, redirects
+
+
+def resolve_title(title, normalized, redirects):
+    '''
+    follow normalization and redirects to find the title
+    of the page a requested title resolved to
+    '''
+    target = normalized.get(title, title)
+    seen = set()
+    while target in redirects and target not in seen:
+        seen.add(target)
+        target = redirects[target]
+    return target
+
+
+def query_pages(titles, params, memoize=True):
+    '''
+    run a query for many titles at once, sending at most MAX_TITLES
+    titles per request and following continuations until every
+    page in each batch is complete.
+
+    returns a dict of page title:page pairs with list properties
+    (links, categories...) merged across continuations, along with
+    a dict mapping each requested title to the title of the page
+    it resolved to after normalization and any redirects
+
+    :param titles: iterable of page titles
+    :param params: the query params, excluding titles
+    :param memoize: whether to keep the responses in memory
+    '''
+    #titles containing a pipe can't be batched and aren't valid titles
+    unique_titles = [t for t in dict.fromkeys(titles) if t and '|' not in t]
+    pages = {}
+    resolved = {}
+    for batch in chunks(unique_titles):
+        batch_params = {'action': 'query', 'format': 'json'}
+        batch_params.update(params)
+        batch_params['titles'] = '|'.join(batch)
+        batch_pages, normalized, redirects = run_query(batch_params, memoize=memoize)
+        merge_pages(pages, batch_pages.values())
+        for title in batch:
+            resolved[title] = resolve_title(title, normalized, redirects)
+    return pages, resolved
+
+
+def parallelise_requests(f, *args, max_workers=None):
+    '''
+    call f concurrently in a thread pool, once for each set of
+    arguments. returns a dict of results keyed by the argument,
+    or by the tuple of arguments when f takes more than one
+
+    :param f: the function to call, usually one making API requests
+    :param args: one iterable of arguments for each parameter of f
+    :param max_workers: the number of threads, defaulting to
+    settings.CONCURRENCY
+    '''
+    if max_workers is None:
+        max_workers = settings.CONCURRENCY
     results = {}
-    with ThreadPoolExecutor(max_workers=10) as e:
-        params = zip(args)
-        futures_dict = {e.submit(f(*tup)) for tup in params}
+    with ThreadPoolExecutor(max_workers=max_workers) as e:
+        futures_dict = {e.submit(f, *tup): tup for tup in zip(*args)}
         for future in as_completed(futures_dict):
-            results[futures_dict[future[0]]] = future.result()
+            tup = futures_dict[future]
+            key = tup[0] if len(tup) == 1 else tup
+            results[key] = future.result()
     return results
 
 
-def get_pageviews(title):
+def pageviews_url(title):
     '''
-    make a request to the Wikimedia API to get
-    the pageviews of a page by title
+    the Wikimedia REST API url for the monthly pageviews
+    of a page over the settings.date_handler window
     '''
-    url=(
+    return (
         'https://wikimedia.org/api/rest_v1/'
         'metrics/'
         'pageviews/'
         'per-article/'
-        'en.wikipedia/'
+        '{0}.wikipedia/'
         'all-access/'
         'all-agents/'
-        '{0}/'
-        'monthly/'
         '{1}/'
-        '{2}'
-    ).format(title, settings.date_handler.start, settings.date_handler.end)
+        'monthly/'
+        '{2}/'
+        '{3}'
+    ).format(settings.LANG, quote(title.replace(' ', '_'), safe=''),
+        settings.date_handler.start, settings.date_handler.end)
+
+
+def fetch_pageviews(title):
+    '''
+    make a request to the Wikimedia API to get the views of
+    a page in the last month of the window. pages with no
+    recorded views count as 0
+    '''
+    data = get_json(pageviews_url(title), session=settings.PAGEVIEWS_SESSION, allow_missing=True)
+    if data is None or not data.get('items'):
+        return 0
+    return int(data['items'][-1]['views'])
 
-    r = requests.get(url=url)
-    data = r.json()
-    monthly_views = data['items']
-    prev_month_views = int(monthly_views[-1]['views'])
-    return prev_month_views
+
+def get_pageviews_batch(titles):
+    '''
+    get the pageviews of many pages. views are cached in memory
+    and in the request cache, keyed by the url they are fetched
+    from, which holds the title and the DateHandler window, and
+    missing pages are fetched concurrently over a pooled session.
+    returns a dict of title:views pairs
+
+    :param titles: iterable of page titles
+    '''
+    titles = list(dict.fromkeys(titles))
+    params_dict = {title: {'pageviews': pageviews_url(title)} for title in titles}
+    views = get_cached_values(params_dict)
+    missing = [t for t in titles if t not in views]
+    if missing:
+        if settings.OFFLINE:
+            raise LookupError('pageviews are not cached: {0}'.format(json.dumps(missing)))
+        fetched = parallelise_requests(fetch_pageviews, missing)
+        put_cached_values(params_dict, fetched)
+        views.update(fetched)
+    settings.METRICS.increment('pageviews_cache_hits', len(titles) - len(missing))
+    settings.METRICS.increment('pageviews_cache_misses', len(missing))
+    return {title: views[title] for title in titles}
+
+
+def get_pageviews(title):
+    '''
+    make a request to the Wikimedia API to get
+    the pageviews of a page by title
+    '''
+    return get_pageviews_batch([title])[title]
 
 
 def request_links(title, plcontinue=None):
@@ -119,28 +421,124 @@ def request_links(title, plcontinue=None):
     return links, plcontinue
 
 
-def generate_links_dict(titles):
+def generate_links_dict(titles, table, memoize=True):
     '''
-    create a dictionary of title:list pairs
-    where each list contains the titles of all
-    links on a page
+    create a dictionary of title:array pairs
+    where each array holds the sorted ids in
+    table of all links on a page. links are
+    read from the offline link store if one is configured,
+    and otherwise fetched for up to MAX_TITLES pages per request
 
     :param titles: a list of article titles
+    :param table: the TitleTable to intern links in, which
+    must use the ids of the link store if one is configured
+    :param memoize: whether to keep the responses and the link
+    titles of each page in memory, for known_links
     '''
+    if settings.LINK_STORE is not None:
+        return {title: store_link_ids(title) for title in titles}
     links_dict = {}
     for title in titles:
-        links = [] #list of links for a single title
-        plcontinue = None
-        while True:
-            new_links, plcontinue = request_links(title, plcontinue)
-            links += new_links
-            if plcontinue is None:
-                break
-        links_dict[title] = links
-    return links_dict
-        
+        links = known_links(title)
+        if links is not None:
+            links_dict[title] = table.link_ids(links)
+    missing = [title for title in dict.fromkeys(titles) if title not in links_dict]
+    if missing:
+        params = {
+            'prop': 'links',
+            'pllimit': str(LINKS_PER_REQUEST),
+        }
+        pages, resolved = query_pages(missing, params, memoize)
+        for title in missing:
+            page = pages.get(resolved.get(title, title), {})
+            links = [link['title'] for link in page.get('links', [])]
+            if memoize:
+                settings.MEMORY_CACHE.put(('links', settings.LANG, title), links)
+            links_dict[title] = table.link_ids(links)
+    return {title: links_dict[title] for title in titles}
+
+
+def store_link_ids(title):
+    '''
+    return the sorted ids in settings.LINK_STORE of every link on
+    a page, which are empty if the page isn't in the store
+    '''
+    title_id = settings.LINK_STORE.title_id(title)
+    if title_id is None:
+        return np.zeros(0, dtype=np.int32)
+    return settings.LINK_STORE.link_ids(title_id)
 
-def lookup_link(page_title, target_title, links_dict):
+
+def known_links(title):
+    '''
+    return the titles of every link on a page if they have already
+    been fetched by generate_links_dict, and otherwise None
+    '''
+    return settings.MEMORY_CACHE.get(('links', settings.LANG, title))
+
+
+def probe_links(titles, targets, table, memoize=True):
+    '''
+    create a dictionary of title:array pairs where each array holds
+    the sorted ids of the targets a page links to. rather than reading
+    every link on the pages, each request asks up to MAX_TITLES
+    pages whether they link to up to MAX_PLTITLES targets. pages
+    whose full link lists are already known aren't requested, and
+    with an offline link store nothing is requested at all
+
+    :param titles: a list of article titles
+    :param targets: the titles of the links to look for
+    :param table: the TitleTable to intern links in
+    :param memoize: whether to keep the responses in memory
+    '''
+    targets = [t for t in dict.fromkeys(targets) if t and '|' not in t]
+    target_ids = table.link_ids(targets)
+    if settings.LINK_STORE is not None:
+        return {title: np.intersect1d(links, target_ids, assume_unique=True)
+            for title, links in generate_links_dict(titles, table).items()}
+    links_dict = {}
+    for title in titles:
+        links = known_links(title)
+        if links is not None:
+            links_dict[title] = np.intersect1d(table.link_ids(links), target_ids, assume_unique=True)
+    missing = [title for title in dict.fromkeys(titles) if title not in links_dict]
+    probed = {title: [] for title in missing}
+    for target_batch in chunks(targets, MAX_PLTITLES) if missing else []:
+        params = {
+            'prop': 'links',
+            'pllimit': str(LINKS_PER_REQUEST),
+            'pltitles': '|'.join(target_batch),
+        }
+        pages, resolved = query_pages(missing, params, memoize)
+        for title in missing:
+            page = pages.get(resolved.get(title, title), {})
+            probed[title] += [link['title'] for link in page.get('links', [])]
+    for title, links in probed.items():
+        links_dict[title] = table.link_ids(links)
+    return {title: links_dict[title] for title in titles}
+
+
+def choose_edge_mode(titles, targets):
+    '''
+    return 'probe' if asking pages about the targets is expected to
+    take fewer requests than fetching their full link lists, and
+    'links' otherwise. only pages whose links aren't known count
+
+    :param titles: a list of article titles
+    :param targets: the titles of the links to look for
+    '''
+    if settings.LINK_STORE is not None:
+        return 'links'
+    unknown = sum(1 for title in set(titles) if known_links(title) is None)
+    if unknown == 0:
+        return 'links'
+    batches = math.ceil(unknown / MAX_TITLES)
+    probe_requests = batches * math.ceil(len(set(targets)) / MAX_PLTITLES)
+    full_requests = max(batches, math.ceil(unknown * ESTIMATED_LINKS_PER_PAGE / LINKS_PER_REQUEST))
+    return 'probe' if probe_requests < full_requests else 'links'
+
+
+def lookup_link(page_title, target_title, links_dict, table):
     '''
     determine if a page links to a target page using a
     dictionary of pages and their contained links.
@@ -150,11 +548,15 @@ def lookup_link(page_title, target_title, links_dict):
     :param target_title: title of the link to look
     for on the page
     :param links_dict: the dictionary to search
+    :param table: the TitleTable of the ids in links_dict
     '''
-    return target_title in links_dict[page_title]
+    if settings.LINK_STORE is not None:
+        return settings.LINK_STORE.has_link(page_title, target_title)
+    target_id = table.lookup(target_title)
+    return target_id is not None and has_id(links_dict[page_title], target_id)
 
 
-def check_edge(title1, title2, links_dict):
+def check_edge(title1, title2, links_dict, table):
     '''
     determines whether to add an undirected edge between
     two pages
@@ -163,8 +565,9 @@ def check_edge(title1, title2, links_dict):
     :param title2: the title of the second page
     :param links_dict: dictionary of pages and their
     contained links to use for lookup
+    :param table: the TitleTable of the ids in links_dict
     '''
-    return lookup_link(title1, title2, links_dict) or lookup_link (title2, title1, links_dict)
+    return lookup_link(title1, title2, links_dict, table) or lookup_link (title2, title1, links_dict, table)
 
 
 def link_between(page_title, target_title):
@@ -209,30 +612,96 @@ def edge_between(title1, title2):
     return link_between(title1, title2) or link_between (title2, title1)
 
 
-def count_backlinks(title, blcontinue=None):
+def continued_page_id(cont):
     '''
-    count the number of pages that link to a page
+    return the id of the page a linkshere continuation resumes in,
+    or None if it can't be read
+    '''
+    try:
+        return int(cont.get('lhcontinue', '').split('|')[0])
+    except ValueError:
+        return None
+
 
-    :param title: the title of the page
-    :param blcontinue: the continuation marker from
-    the previous query if it exists
+def count_backlinks_batch(titles, limit=MAX_BACKLINKS):
     '''
-    params = {
-        'action': 'query',
-        'format': 'json',
-        'list': 'backlinks',
-        'bllimit': '500',
-        'bltitle': title
-    }
-    if blcontinue is not None:
-        params['blcontinue'] = blcontinue
-    data = make_mw_request(params)
-    count = len(data['query']['backlinks'])
-    if 'continue' in data:
-        blcontinue = data['continue']['blcontinue']
-    else:
-        blcontinue = None
-    return count, blcontinue
+    count the number of pages that link to each of many pages,
+    querying up to MAX_TITLES pages at once. returns a dict of
+    title:count pairs
+
+    counts stop at limit. results come in order of page id, so when
+    the page being continued reaches the limit, the query is started
+    again for only the pages after it, rather than paging through
+    every backlink of a hub such as a country or a year
+
+    :param titles: iterable of page titles
+    :param limit: the most backlinks counted for a page
+    '''
+    unique_titles = [t for t in dict.fromkeys(titles) if t and '|' not in t]
+    counts = {title: 0 for title in titles}
+    for batch in chunks(unique_titles):
+        normalized = {}
+        page_counts = {}
+        page_ids = {}
+        pending = batch
+        while pending:
+            params = {
+                'action': 'query',
+                'format': 'json',
+                'prop': 'linkshere',
+                'lhprop': 'pageid',
+                'lhlimit': '500',
+                'titles': '|'.join(pending),
+            }
+            restart = []
+            while True:
+                data = make_mw_request(params)
+                query = data.get('query', {})
+                for item in query.get('normalized', []):
+                    normalized[item['from']] = item['to']
+                for page in query.get('pages', {}).values():
+                    count = len(page.get('linkshere', []))
+                    page_counts[page['title']] = page_counts.get(page['title'], 0) + count
+                    if 'pageid' in page:
+                        page_ids[page['title']] = page['pageid']
+                if 'continue' not in data:
+                    break
+                current = continued_page_id(data['continue'])
+                hub = [t for t, i in page_ids.items() if i == current and page_counts[t] >= limit]
+                if hub:
+                    restart = [t for t in pending
+                        if page_ids.get(normalized.get(t, t), -1) > current]
+                    break
+                params = dict(params)
+                params.update(data['continue'])
+            pending = restart
+        for title in batch:
+            counts[title] = min(page_counts.get(normalized.get(title, title), 0), limit)
+    return counts
+
+
+def get_backlink_counts(titles):
+    '''
+    get the number of backlinks of each title. counts are taken
+    from the offline link store if one is configured. otherwise
+    they are cached in memory and in the request cache, and
+    missing counts are fetched in bulk from the API.
+    returns a dict of title:count pairs
+
+    :param titles: iterable of page titles
+    '''
+    titles = list(dict.fromkeys(titles))
+    if settings.LINK_STORE is not None:
+        return {title: settings.LINK_STORE.backlink_count(title) for title in titles}
+    params_dict = {title: {'backlinks': title, 'lang': settings.LANG, 'limit': MAX_BACKLINKS}
+        for title in titles}
+    counts = get_cached_values(params_dict)
+    missing = [t for t in titles if t not in counts]
+    if missing:
+        new_counts = count_backlinks_batch(missing)
+        put_cached_values(params_dict, new_counts)
+        counts.update(new_counts)
+    return counts
 
 
 def create_backlinks_count_dict(candidates):
@@ -241,55 +710,36 @@ def create_backlinks_count_dict(candidates):
 
     :param candidates: a list of candidate titles
     '''
-    backlinks_count_dict = {}
-    for candidate in candidates:
-        total = 0
-        blcontinue = None
-        while True:
-            count, blcontinue = count_backlinks(candidate, blcontinue)
-            print(count)
-            if  blcontinue is None:
-                print('done')
-                break
-            total += count
-        backlinks_count_dict[candidate] = total
-    return backlinks_count_dict
+    return get_backlink_counts(candidates)
 
 
 def compare_backlinks(title1, title2):
     '''
-    return the title with the most backlinks
+    return the title with the most backlinks, or a tuple
+    of both titles if they have the same number
     '''
-    t1_continue = None
-    t2_continue = None
-
-    while True:
-        t1_count, t1_continue = count_backlinks(title1, t1_continue)
-        t2_count, t2_continue = count_backlinks(title2, t2_continue)
+    counts = get_backlink_counts([title1, title2])
+    if counts[title1] > counts[title2]:
+        return title1
+    elif counts[title2] > counts[title1]:
+        return title2
+    return (title1, title2)
 
-        if t1_count > t2_count:
-            return title1
-        elif t2_count > t1_count:
-            return title2
-        elif t1_count == t2_count and t1_count < 500:
-            return (title1, title2)
 
-
-def find_most_linked(titles):
+def find_most_linked(titles, counts=None):
     '''
-    find the title with the most backlinks from a list of titles
+    find the title with the most backlinks from a list of titles.
+    the first of the most linked titles is returned if there is a tie
 
     :param titles: iterable of strings corresponding to Wikipedia
     article titles
+    :param counts: optional dict of title:backlinks_count pairs
+    which already holds the counts of all the titles
     '''
-    for i, _ in reversed(list(enumerate(titles))):
-        if i > 0:
-            winner = compare_backlinks(titles[i], titles[i-1])
-            if winner == titles[i]:
-                del titles[i-1]
-            else:
-                del titles[i]
-    return titles[0]
+    titles = list(titles)
+    if counts is None:
+        counts = get_backlink_counts(titles)
+    return max(titles, key=lambda title: counts[title])
 
 
 def check_exact_match(title):
@@ -300,129 +750,230 @@ def check_exact_match(title):
     :param title: the title of the page to
     search for
     '''
-    params = {
-        'action': 'query',
-        'format': 'json',
-        'titles': title,
-    }
-    data = make_mw_request(params)
-    pages = data['query']['pages']
+    return check_exact_matches([title])[title]
 
-    for page in pages.values():
-        if 'missing' in page:
-            return False
-        return True
+
+def check_exact_matches(titles):
+    '''
+    check which of many titles exactly match a Wikipedia
+    page. returns a dict of title:boolean pairs
+
+    :param titles: iterable of titles to search for
+    '''
+    pages, resolved = query_pages(titles, {})
+    matches = {}
+    for title in titles:
+        page = pages.get(resolved.get(title, title))
+        matches[title] = page is not None and 'missing' not in page
+    return matches
 
 
 def is_disambiguation_page(title):
-    valid_categories = (
-        'Category:Disambiguation pages|'
-        'Category:All article disambiguation pages|'
-        'Categoría:Wikipedia:Desambiguación'
-    )
+    '''
+    check if a title is itself a disambiguation page
+    '''
+    return are_disambiguation_pages([title])[title]
+
+
+def are_disambiguation_pages(titles):
+    '''
+    check which of many titles are disambiguation pages.
+    returns a dict of title:boolean pairs
+
+    :param titles: iterable of titles to check
+    '''
     params = {
-        'action': 'query',
-        'format': 'json',
-        'titles': title,
         'prop': 'categories',
-        'clcategories': valid_categories
+        'clcategories': DISAMBIGUATION_CATEGORIES
     }
-    data = make_mw_request(params)
-    pages = data['query']['pages']
-    for page in pages.values():
-        if 'categories' in page:
-            return True
-    return False
+    pages, resolved = query_pages(titles, params)
+    disambiguation = {}
+    for title in titles:
+        page = pages.get(resolved.get(title, title), {})
+        disambiguation[title] = 'categories' in page
+    return disambiguation
 
 
-def is_disambiguation_page_old(title):
+def get_redirect(title):
     '''
-    check if the title itself is a disambiguation page
+    check if a title redirects to another wikipedia page
+
+    :param title: the title of the potentially redirected page
     '''
-    try:
-        wikitext = get_wikitext(title)
-    except:
-        return False
-    pattern = re.compile(r'\{\{(Disambiguation|disambiguation).*\}\}')
-    links = re.findall(pattern, wikitext)
-    if len(links) > 0:
-        return True
-    return False
+    return get_redirects([title])[title]
 
 
-def check_disambiguation_page(title):
-    '''
-    determine if a title has an associated disambiguation page
+def get_redirects(titles):
     '''
-    if is_disambiguation_page(title):
-        matches_title = True
-        search_title = title
-    else:
-        matches_title = False
-        search_title = '{0} (disambiguation)'.format(title)
+    check which of many titles redirect to another page.
+    returns a dict of title:redirect pairs, where redirect
+    is None if the title is not a redirect
 
-    params = {
-        'action': 'query',
-        'format': 'json',
-        'prop': 'links',
-        'titles': search_title,
-        'pllimit': '500'
-    }
-    data = make_mw_request(params)
-    pages = data['query']['pages']
+    :param titles: iterable of potentially redirected titles
+    '''
+    unique_titles = [t for t in dict.fromkeys(titles) if t and '|' not in t]
+    redirects = {title: None for title in titles}
+    for batch in chunks(unique_titles):
+        params = {
+            'action': 'query',
+            'format': 'json',
+            'redirects': '',
+            'titles': '|'.join(batch),
+        }
+        data = make_mw_request(params)
+        query = data.get('query', {})
+        normalized = {item['from']: item['to'] for item in query.get('normalized', [])}
+        #keep only the first hop of a redirect chain
+        first_hops = {}
+        for item in query.get('redirects', []):
+            first_hops.setdefault(item['from'], item['to'])
+        for title in batch:
+            redirects[title] = first_hops.get(normalized.get(title, title))
+    return redirects
+
+
+def filter_disambiguation_links(title, links):
+    '''
+    select the candidates for a title from the links
+    on its disambiguation page
 
+    :param title: the mention being disambiguated
+    :param links: the titles linked from the disambiguation page
+    '''
     candidates = []
     target_phrase = title.lower()
-    for page in pages.values():
-        if 'missing' in page: #if not a valid disambiguation page
-            return None, matches_title
-        links = page['links']
-        for link in links:
-            link_title = link['title'].lower()
-            if target_phrase in link_title:
-                if 'disambiguation' not in link_title:
-                    candidates.append(link['title'])
-    return candidates, matches_title
+    for link in links[:DISAMBIGUATION_LINK_LIMIT]:
+        link_title = link.lower()
+        if target_phrase in link_title:
+            if 'disambiguation' not in link_title:
+                candidates.append(link)
+    return candidates
 
 
-def get_redirect(title):
+def get_candidates_batch(titles):
     '''
-    check if a title redirects to another wikipedia page
+    get the candidates for many titles at once, batching
+    every stage of get_candidates across the titles, after
+    looking titles up in the offline candidate index.
+    returns a dict of title:candidates pairs
 
-    :param title: the title of the potentially redirected page
+    :param titles: iterable of mentions and potential article titles
     '''
-    params = {
-        'action': 'query',
-        'format': 'json',
-        'redirects': '',
-        'titles': title,
-    }
-
-    data = make_mw_request(params)
+    candidates_dict = {}
+    if settings.CANDIDATE_INDEX is not None:
+        for title in dict.fromkeys(titles):
+            candidates = settings.CANDIDATE_INDEX.candidates(title)
+            if candidates is not None:
+                candidates_dict[title] = candidates
+    titles = [t for t in dict.fromkeys(titles) if t not in candidates_dict]
+    disambiguation = are_disambiguation_pages(titles)
+    search_titles = {}
+    for title in titles:
+        if disambiguation[title]:
+            search_titles[title] = title
+        else:
+            search_titles[title] = '{0} (disambiguation)'.format(title)
+    pages, resolved = query_pages(list(search_titles.values()), {'prop': 'links', 'pllimit': '500'})
+    redirects = get_redirects(titles)
+    exact_titles = [t for t in titles if redirects[t] is None and not disambiguation[t]]
+    exact_matches = check_exact_matches(exact_titles)
 
-    if 'redirects' in data['query']:
-        #returns title of page redirected to
-        for redirect in data['query']['redirects']:
-            return redirect['to']
-    return None
+    for title in titles:
+        all_candidates = []
+        search_title = search_titles[title]
+        page = pages.get(resolved.get(search_title, search_title))
+        if page is not None and 'missing' not in page:
+            links = [link['title'] for link in page.get('links', [])]
+            all_candidates += filter_disambiguation_links(title, links)
+        if redirects[title] is not None:
+            all_candidates += [redirects[title]]
+        elif title in exact_matches and exact_matches[title]:
+            if title not in all_candidates: #if not already in the disambiguation page
+                all_candidates += [title]
+        candidates_dict[title] = all_candidates
+    return candidates_dict
 
 
 def get_candidates(title):
     '''
     get a list of all candidates for a title
 
+    a single combined query for the title and its
+    "(disambiguation)" sibling returns the redirect target,
+    categories, existence and links of both pages at once,
+    rather than querying for each separately.
+
+    continuations are only followed while the links of the
+    disambiguation page being used are incomplete. mentions
+    in the offline candidate index, if one is configured,
+    are looked up there instead
+
     :param title: a mention and potential article title
     '''
+    if settings.CANDIDATE_INDEX is not None:
+        candidates = settings.CANDIDATE_INDEX.candidates(title)
+        if candidates is not None:
+            return candidates
+    if not title or '|' in title:
+        return []
+    sibling = '{0} (disambiguation)'.format(title)
+    params = {
+        'action': 'query',
+        'format': 'json',
+        'redirects': '',
+        'prop': 'categories|links|info',
+        'clcategories': DISAMBIGUATION_CATEGORIES,
+        'pllimit': '500',
+        'titles': '|'.join([title, sibling]),
+    }
+
+    def needs_continue(pages, normalized, redirects, cont):
+        if 'plcontinue' not in cont or 'clcontinue' in cont:
+            return True #categories are still to come
+        title_norm = normalized.get(title, title)
+        sibling_norm = normalized.get(sibling, sibling)
+        page = None
+        if title_norm not in redirects:
+            page = pages.get(title_norm)
+        if page is None or 'categories' not in page:
+            page = None
+            if sibling_norm not in redirects:
+                page = pages.get(sibling_norm)
+        if page is None or 'missing' in page:
+            return False
+        #link continuations are ordered by page id
+        next_id = int(cont['plcontinue'].split('|')[0])
+        if page.get('pageid', 0) < next_id:
+            return False
+        return len(page.get('links', [])) < DISAMBIGUATION_LINK_LIMIT
+
+    pages, normalized, redirects = run_query(params, needs_continue)
+    title_norm = normalized.get(title, title)
+    sibling_norm = normalized.get(sibling, sibling)
+    redirect = redirects.get(title_norm)
+
+    #a redirect page is never itself a disambiguation page
+    title_page = pages.get(title_norm) if redirect is None else None
+    matches_title = title_page is not None and 'categories' in title_page
+
     all_candidates = []
-    disamb_candidates, matches_title = check_disambiguation_page(title)
-    if disamb_candidates is not None:
-        all_candidates += disamb_candidates
-    redirect = get_redirect(title)
+    if matches_title:
+        links = [link['title'] for link in title_page.get('links', [])]
+    elif sibling_norm in redirects:
+        #the only link on a redirect page is its target
+        links = [redirects[sibling_norm]]
+    else:
+        sibling_page = pages.get(sibling_norm)
+        if sibling_page is None or 'missing' in sibling_page:
+            links = None
+        else:
+            links = [link['title'] for link in sibling_page.get('links', [])]
+    if links is not None:
+        all_candidates += filter_disambiguation_links(title, links)
     if redirect is not None:
-        all_candidates +=  [redirect]
+        all_candidates += [redirect]
     elif not matches_title:
-        exact_match = check_exact_match(title)
-        if exact_match:
+        if title_page is not None and 'missing' not in title_page:
             if title not in all_candidates: #if not already in the disambiguation page
                 all_candidates += [title]
     return all_candidates
@@ -444,13 +995,92 @@ def trim_candidates(candidates, lower_count, fraction, heuristic='pageviews'):
         return candidates
     else:
         threshold = int(max(lower_count, (fraction * len(candidates) // 1)))
-        pageviews_dict = {}
-        for i, candidate in enumerate(candidates):
-            pageviews_dict[i] = get_pageviews(candidate)
-        sorted_candidates = [k for k, v in sorted(pageviews_dict.items(), key=lambda item: item[1])]
+        if heuristic == 'backlinks':
+            popularity = get_backlink_counts(candidates)
+        else:
+            popularity = get_pageviews_batch(candidates)
+        sorted_candidates = sorted(candidates, key=lambda c: popularity[c], reverse=True)
         return sorted_candidates[:threshold]
 
 
+def title_similarity(mention, title):
+    '''
+    the similarity of a candidate title to a mention, between 0 and 1
+    '''
+    return SequenceMatcher(None, mention.lower(), title.lower()).ratio()
+
+
+def get_popularity(titles, prior):
+    '''
+    get the popularity of many titles for a pruning prior. returns
+    a dict of title:popularity pairs, which is empty if the prior
+    doesn't use popularity
+
+    :param titles: iterable of page titles
+    :param prior: the pruning prior, see top_k_candidates
+    '''
+    if prior.startswith('pageviews'):
+        return get_pageviews_batch(titles)
+    elif prior.startswith('backlinks'):
+        return get_backlink_counts(titles)
+    return {}
+
+
+def top_k_candidates(mention, candidates, k, prior='pageviews', popularity=None):
+    '''
+    keep the k best candidates of a mention, in their original order
+
+    :param mention: the mention the candidates are for
+    :param candidates: a list of article titles
+    :param k: the number of candidates to keep
+    :param prior: how to rank candidates: 'pageviews', 'backlinks',
+    'similarity' to the mention, or 'pageviews+similarity' or
+    'backlinks+similarity' to add the popularity (scaled to
+    between 0 and 1 by log) to the similarity
+    :param popularity: optional dict of title:popularity pairs
+    which already holds the popularity of every candidate
+    '''
+    if len(candidates) <= k:
+        return candidates
+    if popularity is None:
+        popularity = get_popularity(candidates, prior)
+    use_popularity = not prior.startswith('similarity')
+    use_similarity = prior.endswith('similarity')
+    top = max([popularity.get(c, 0) for c in candidates] + [1]) if use_popularity else 1
+
+    def score(i):
+        value = 0
+        if use_popularity:
+            value += math.log1p(popularity.get(candidates[i], 0)) / math.log1p(top)
+        if use_similarity:
+            value += title_similarity(mention, candidates[i])
+        return value
+
+    kept = heapq.nlargest(k, range(len(candidates)), key=score)
+    return [candidates[i] for i in sorted(kept)]
+
+
+def prune_candidates(candidates_dict, k, prior='pageviews'):
+    '''
+    keep the top k candidates of every mention, fetching the
+    popularity of all candidates together. returns a new dict
+    of mention:candidates pairs
+
+    :param candidates_dict: dict of mention:candidates pairs
+    :param k: the number of candidates to keep for each mention
+    :param prior: the ranking to use, see top_k_candidates
+    '''
+    large = [c for candidates in candidates_dict.values() if candidates and len(candidates) > k for c in candidates]
+    popularity = get_popularity(large, prior) if large else {}
+    pruned = {}
+    for mention, candidates in candidates_dict.items():
+        if candidates is None:
+            pruned[mention] = None
+        else:
+            pruned[mention] = top_k_candidates(mention, candidates, k, prior, popularity)
+    return pruned
+
+
 def get_wikitext(title):
     '''
     get the wikitext of a page for parsing